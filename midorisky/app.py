@@ -6,11 +6,16 @@ from chalicelib.farmRoutes import farm_routes
 from chalicelib.taskRoutes import task_routes
 from chalicelib.weatherRoutes import weather_routes
 from chalicelib.deviceRoutes import device_routes
+from chalicelib.telemetryRoutes import telemetry_routes
+from chalicelib.exportRoutes import export_routes
 from chalicelib.notificationService import notification_service
 from chalicelib.authorizers import auth_functions, admin_authorizer, farmer_authorizer
 from chalicelib.wsService import Sender
 import json
-from chalicelib.connectHelper import create_connection
+from chalicelib.connectHelper import db_cursor
+from chalicelib.queryMetrics import start_request, end_request
+from chalicelib.telemetryHelper import TelemetryBatchError, ingest_messages, delete_messages
+from chalicelib.exportJobs import run_export_job
 import os
 
 app = Chalice(app_name='midorisky')
@@ -27,10 +32,27 @@ app.register_blueprint(notification_service)
 app.register_blueprint(auth_functions)
 app.register_blueprint(weather_routes)
 app.register_blueprint(device_routes)
+app.register_blueprint(telemetry_routes)
+app.register_blueprint(export_routes)
 
 
 app.api.binary_types.append('multipart/form-data')
 
+
+@app.middleware('all')
+def query_metrics(event, get_response):
+    # Aggregate query count and DB time per route for every event type
+    start_request()
+    try:
+        return get_response(event)
+    finally:
+        if hasattr(event, 'method') and hasattr(event, 'path'):
+            route = event.method + ' ' + event.path
+        else:
+            route = getattr(event.context, 'function_name', type(event).__name__)
+        end_request(route)
+
+
 @app.route('/', cors=True)
 def index():
     return {'message': 'Hello world, from MidoriSKY!'}
@@ -55,7 +77,7 @@ def connect(event):
 
 @app.on_ws_disconnect()
 def disconnect(event):
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         # Delete connection ID username association
         cursor.execute("DELETE FROM wsConnections WHERE connection_id = %s", (event.connection_id))
 
@@ -71,13 +93,13 @@ def message(event):
 
     if "type" in message:
         if message['type'] == 'logout':
-            with create_connection().cursor() as cursor:
+            with db_cursor() as cursor:
                 cursor.execute("DELETE FROM wsConnections WHERE connection_id = %s", (connection_id))
         return
 
     if message['username']:
         # Store connection ID username association
-        with create_connection().cursor() as cursor:
+        with db_cursor() as cursor:
             cursor.execute("INSERT INTO wsConnections (connection_id, username) VALUES (%s, %s)", (connection_id, message['username']))
 
     return
@@ -87,7 +109,7 @@ def insert_notification(username, title, subtitle, url, action="View"):
     connections_sql = "SELECT connection_id FROM wsConnections WHERE username = %s"
     connections = []
 
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         cursor.execute(sql, (username, title, subtitle, url, action))
         cursor.execute(connections_sql, (username))
         connections = cursor.fetchall()
@@ -121,6 +143,27 @@ def handle_sqs_message(event):
             handleDeviceType(data)
 
 
+@app.on_sqs_message(queue='midori-telemetry', batch_size=100, maximum_batching_window_in_seconds=5)
+def handle_telemetry_messages(event):
+    # Sensor readings, written in one batch per table
+    records = [record.to_dict() for record in event]
+    failed = set(ingest_messages([(record['messageId'], record['body']) for record in records]))
+
+    if failed:
+        # Chalice does not enable ReportBatchItemFailures on the event source mapping, so a partial batch response
+        # would be ignored and the failed messages deleted with the rest. Delete the written messages here and fail
+        # the invocation instead, only the failed ones are received again.
+        delete_messages([record for record in records if record['messageId'] not in failed])
+        raise TelemetryBatchError(f"{len(failed)} of {len(records)} telemetry message(s) failed")
+
+
+@app.on_sqs_message(queue='midori-exports', batch_size=1)
+def handle_export_jobs(event):
+    # Large CSV exports, this function has a longer timeout in .chalice/config.json
+    for record in event:
+        run_export_job(json.loads(record.body)['job_id'])
+
+
 def handleDeviceType(data):
     ses = boto3.client('ses')
     sqs = boto3.client('sqs')
@@ -128,6 +171,15 @@ def handleDeviceType(data):
 
     count = data['count']
 
+    # Where the devices are, e.g. "P1: 3, P2: 1", the plots with the most dead devices first
+    plots = sorted((data.get('plots') or {}).items(), key=lambda item: -item[1])
+    message = "There are " + str(count) + " devices that have been spoilt for more than 2 hours."
+    if data.get('new') and data['new'] < count:
+        message += " " + str(data['new']) + " of them are new or still dead since the last alert."
+    if plots:
+        message += " By plot: " + ", ".join(f"{plot}: {plot_count}" for plot, plot_count in plots[:10])
+        message += (" and " + str(len(plots) - 10) + " more plots." if len(plots) > 10 else ".")
+
     admin_result = cognito_idp.list_users_in_group(
         UserPoolId=os.environ.get('USER_POOL_ID'),
         GroupName='Admin'
@@ -145,7 +197,7 @@ def handleDeviceType(data):
 
 
     for username in admin_username:
-        insert_notification(username, "Device Spoiler Alert", "There are " + str(count) + " devices that have been spoilt for more than 2 hours.", '/staff/devices', "View Devices")
+        insert_notification(username, "Device Spoiler Alert", message, '/staff/devices', "View Devices")
 
     try:
         # send email to users
@@ -160,7 +212,7 @@ def handleDeviceType(data):
                 },
                 'Body': {
                     'Text': {
-                        'Data': 'There are ' + str(count) + ' devices that have been spoilt for more than 2 hours.'
+                        'Data': message
                     }
                 }
             }
@@ -179,7 +231,7 @@ def handleCommentType(data):
     # query item by id
     sql = "SELECT * FROM TaskComments WHERE id = %s"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         cursor.execute(sql, (id))
         item = cursor.fetchone()
 
@@ -213,7 +265,7 @@ def handleTaskType(data):
     # query item by id
     sql = "SELECT * FROM midori.Tasks WHERE id = %s"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         cursor.execute(sql, (id))
         item = cursor.fetchone()
 
@@ -0,0 +1,110 @@
+"""
+Benchmark of the sharded IoT status update against a local MySQL.
+
+Every shard count runs process_device_shard for all shards at once in separate processes, standing in for
+concurrent Lambda workers, and reports the wall time, throughput and speedup over a single shard.
+Device shadows are published to a local stand-in, so only the database work is measured.
+
+Usage (from the midorisky directory):
+    MIDORI_TEST_PRIMARY_HOST=127.0.0.1:3306 MIDORI_TEST_DB_USER=root python -m benchmarks.device_shards 50000 1 2 4 8
+"""
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pymysql
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('IOT_ENDPOINT', 'localhost')
+
+from chalicelib import connectHelper, deviceRoutes, deviceShadows  # noqa: E402
+
+SCHEMA = 'midori_shard_bench'
+LATEST_TIME = deviceRoutes.get_latest_30min_timestamp()
+
+
+def credentials():
+    return {
+        'host': os.environ['MIDORI_TEST_PRIMARY_HOST'],
+        'user': os.environ.get('MIDORI_TEST_DB_USER', 'root'),
+        'password': os.environ.get('MIDORI_TEST_DB_PASSWORD', ''),
+        'database': SCHEMA,
+        'replica_hosts': []
+    }
+
+
+class LocalIotData(object):
+    """Stand-in for the iot-data API so shadow publishes are neither sent to AWS nor part of the timing."""
+
+    def update_thing_shadow(self, thingName, payload):
+        return {'payload': json.dumps({'state': json.loads(payload)['state']})}
+
+
+def use_local_database():
+    connectHelper.get_db_credentials = lambda force_refresh=False: credentials()
+    deviceShadows.iot_client = LocalIotData()
+
+
+def run_shard(shard):
+    return deviceRoutes.process_device_shard(shard[0], shard[1], LATEST_TIME)
+
+
+def setup(devices):
+    host, _, port = os.environ['MIDORI_TEST_PRIMARY_HOST'].partition(':')
+    connection = pymysql.connect(host=host, port=int(port or 3306), user=credentials()['user'],
+                                 password=credentials()['password'], autocommit=True)
+
+    with open(os.path.join(os.path.dirname(__file__), '..', 'deployer.sql')) as f:
+        statements = [s for s in f.read().split(';') if 'IoTDevicesTest' in s or 'IoTDeviceLogTest' in s]
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP DATABASE IF EXISTS {SCHEMA}")
+        cursor.execute(f"CREATE DATABASE {SCHEMA}")
+        cursor.execute(f"USE {SCHEMA}")
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.executemany(
+            "INSERT INTO IoTDevicesTest (IoTType, IoTStatus, IoTSerialNumber, PlotID) VALUES ('Sensor', 1, %s, 'P1')",
+            [('SN-%08d' % i,) for i in range(devices)]
+        )
+    return connection
+
+
+def reset(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE IoTDevicesTest SET IoTStatus = 1, LastDowntime = NULL")
+        cursor.execute("TRUNCATE TABLE IoTDeviceLogTest")
+
+
+def main(devices, shard_counts):
+    connection = setup(devices)
+    baseline = None
+
+    print(f"{'shards':>6} {'seconds':>8} {'devices/s':>10} {'speedup':>8}")
+    for shards in shard_counts:
+        reset(connection)
+        plan = deviceRoutes.plan_shards(1, devices, size=-(-devices // shards))
+
+        with ProcessPoolExecutor(max_workers=len(plan), initializer=use_local_database) as executor:
+            # Connection setup is timed too, as it would be in a fresh Lambda worker
+            start = time.perf_counter()
+            results = list(executor.map(run_shard, plan))
+            elapsed = time.perf_counter() - start
+
+        assert sum(result['changed'] + result['unchanged'] for result in results) == devices
+        baseline = baseline or elapsed
+        print(f"{len(plan):>6} {elapsed:>8.2f} {devices / elapsed:>10.0f} {baseline / elapsed:>7.2f}x")
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP DATABASE {SCHEMA}")
+    connection.close()
+
+
+if __name__ == '__main__':
+    if not os.environ.get('MIDORI_TEST_PRIMARY_HOST'):
+        sys.exit("Set MIDORI_TEST_PRIMARY_HOST to a local MySQL, e.g. 127.0.0.1:3306")
+
+    arguments = [int(argument) for argument in sys.argv[1:]] or [50000, 1, 2, 4, 8]
+    main(arguments[0], arguments[1:] or [1, 2, 4, 8])
@@ -1,22 +1,367 @@
 import boto3
 import pymysql
 import os
+import json
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from contextlib import contextmanager
+from .queryMetrics import InstrumentedCursor, InstrumentedSSCursor
+from .helpers import cursor_to_columnar
 
-ssm_client = boto3.client('ssm')
 prefix = os.environ.get('SSM_PREFIX')
 
-# Batch get parameters from SSM
-response = ssm_client.get_parameters(Names=[prefix + 'rds_host', prefix + 'rds_user', prefix + 'rds_password', prefix + 'db_name'], WithDecryption=True)
-ssm_dict = {param['Name']: param['Value'] for param in response['Parameters']}
+# Credentials are resolved on first DB use, cached in memory and persisted to /tmp for recycled containers
+CREDENTIALS_TTL = float(os.environ.get('DB_CREDENTIALS_TTL', 900))
+CREDENTIALS_CACHE_FILE = os.environ.get('DB_CREDENTIALS_CACHE_FILE', '/tmp/midori-db-credentials.json')
 
-def create_connection():
-    # RDS connection details from environment variables
-    HOST = ssm_dict[prefix + 'rds_host']
-    USER = ssm_dict[prefix + 'rds_user']
-    PASSWORD = ssm_dict[prefix + 'rds_password']
-    DB_NAME = ssm_dict[prefix + 'db_name']
+# MySQL error code for "Access denied", returned once the password has been rotated
+ER_ACCESS_DENIED_ERROR = 1045
 
-    connection = pymysql.connect(host=HOST, user=USER, password=PASSWORD, database=DB_NAME, charset='utf8mb4',
-                                     cursorclass=pymysql.cursors.DictCursor, autocommit=True)
+# Pool settings, the pool lives at module level so it survives warm invocations
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 4))
+POOL_CHECKOUT_TIMEOUT = float(os.environ.get('DB_POOL_CHECKOUT_TIMEOUT', 10))
+POOL_PING_INTERVAL = float(os.environ.get('DB_POOL_PING_INTERVAL', 30))
+POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', 3600))
 
-    return connection
\ No newline at end of file
+_ssm_client = None
+_credentials = None
+_credentials_fetched_at = 0
+_credentials_lock = threading.Lock()
+
+
+def _read_credentials_file():
+    try:
+        with open(CREDENTIALS_CACHE_FILE, 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None, 0
+
+    if cached.get('prefix') != prefix:
+        return None, 0
+    return cached.get('credentials'), cached.get('fetched_at', 0)
+
+
+def _write_credentials_file(credentials, fetched_at):
+    try:
+        # Only the Lambda runtime user should be able to read the password
+        fd = os.open(CREDENTIALS_CACHE_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'prefix': prefix, 'fetched_at': fetched_at, 'credentials': credentials}, f)
+    except OSError as e:
+        print(f"Unable to persist DB credentials: {e}")
+
+
+def _fetch_credentials():
+    global _ssm_client
+    if _ssm_client is None:
+        _ssm_client = boto3.client('ssm')
+
+    # Batch get parameters from SSM
+    response = _ssm_client.get_parameters(Names=[prefix + 'rds_host', prefix + 'rds_user', prefix + 'rds_password', prefix + 'db_name', prefix + 'rds_replica_hosts'], WithDecryption=True)
+    ssm_dict = {param['Name']: param['Value'] for param in response['Parameters']}
+
+    # rds_replica_hosts is optional, a comma separated list of host or host:port entries
+    replica_hosts = ssm_dict.get(prefix + 'rds_replica_hosts', '')
+
+    return {
+        'host': ssm_dict[prefix + 'rds_host'],
+        'user': ssm_dict[prefix + 'rds_user'],
+        'password': ssm_dict[prefix + 'rds_password'],
+        'database': ssm_dict[prefix + 'db_name'],
+        'replica_hosts': [host.strip() for host in replica_hosts.split(',') if host.strip()]
+    }
+
+
+def get_db_credentials(force_refresh=False):
+    """Get the RDS connection details, hitting SSM only when the cached copy is missing or expired."""
+    global _credentials, _credentials_fetched_at
+
+    with _credentials_lock:
+        if not force_refresh:
+            if _credentials is not None and time.time() - _credentials_fetched_at < CREDENTIALS_TTL:
+                return _credentials
+
+            credentials, fetched_at = _read_credentials_file()
+            if credentials is not None and time.time() - fetched_at < CREDENTIALS_TTL:
+                _credentials, _credentials_fetched_at = credentials, fetched_at
+                return _credentials
+
+        _credentials = _fetch_credentials()
+        _credentials_fetched_at = time.time()
+        _write_credentials_file(_credentials, _credentials_fetched_at)
+        return _credentials
+
+
+def create_connection(host=None, **options):
+    # RDS connection details from SSM, replicas share the primary's user and password
+    credentials = get_db_credentials()
+
+    try:
+        return _connect(credentials, host, **options)
+    except pymysql.err.OperationalError as e:
+        if e.args[0] != ER_ACCESS_DENIED_ERROR:
+            raise
+
+    # The password was probably rotated, refresh it from SSM and retry once
+    return _connect(get_db_credentials(force_refresh=True), host, **options)
+
+
+def _connect(credentials, host=None, **options):
+    host, _, port = (host or credentials['host']).partition(':')
+    connection = pymysql.connect(host=host, port=int(port or 3306), user=credentials['user'],
+                                 password=credentials['password'], database=credentials['database'], charset='utf8mb4',
+                                 cursorclass=InstrumentedCursor, autocommit=True, **options)
+
+    return connection
+
+
+class ConnectionPool(object):
+    """A small, thread safe pool of PyMySQL connections."""
+
+    def __init__(self, factory, max_size=POOL_MAX_SIZE, timeout=POOL_CHECKOUT_TIMEOUT,
+                 ping_interval=POOL_PING_INTERVAL, max_lifetime=POOL_MAX_LIFETIME):
+        """Initialize a connection pool.
+
+        :param factory: Callable returning a new PyMySQL connection.
+        :param max_size: Maximum number of sockets open at the same time.
+        :param timeout: Seconds to wait for a free connection before giving up.
+        :param ping_interval: Idle seconds after which a connection is pinged before reuse.
+        :param max_lifetime: Seconds after which a connection is closed and replaced.
+        """
+        self._factory = factory
+        self._max_size = max_size
+        self._timeout = timeout
+        self._ping_interval = ping_interval
+        self._max_lifetime = max_lifetime
+        self._idle = []  # (connection, created_at, last_used_at), most recently used last
+        self._open = 0
+        self._created = {}
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Check out a healthy connection, opening a new one if the pool has room."""
+        deadline = time.monotonic() + self._timeout
+
+        with self._condition:
+            while True:
+                if self._idle:
+                    connection, created_at, last_used_at = self._idle.pop()
+                    break
+                if self._open < self._max_size:
+                    self._open += 1
+                    connection = None
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise pymysql.err.OperationalError(2013, "Timed out waiting for a database connection")
+                self._condition.wait(remaining)
+
+        if connection is None:
+            return self._open_connection()
+
+        now = time.monotonic()
+        if now - created_at > self._max_lifetime:
+            self._discard(connection)
+            return self.acquire()
+
+        if now - last_used_at > self._ping_interval:
+            try:
+                # A socket that went stale while the container was frozen is replaced rather than reconnected in
+                # place, so the new connection starts its own max_lifetime
+                connection.ping(reconnect=False)
+            except pymysql.err.Error:
+                self._discard(connection)
+                return self.acquire()
+
+        return connection
+
+    def release(self, connection, broken=False):
+        """Return a connection to the pool, closing it if it is no longer usable."""
+        if broken or not connection.open:
+            self._discard(connection)
+            return
+
+        with self._condition:
+            self._idle.append((connection, self._created.get(id(connection), time.monotonic()), time.monotonic()))
+            self._condition.notify()
+
+    def close_all(self):
+        """Close every idle connection."""
+        with self._condition:
+            idle, self._idle = self._idle, []
+
+        for connection, _, _ in idle:
+            self._discard(connection)
+
+    def _open_connection(self):
+        try:
+            connection = self._factory()
+        except Exception:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+
+        self._created[id(connection)] = time.monotonic()
+        return connection
+
+    def _discard(self, connection):
+        self._created.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+
+
+# One pool per host, None is the primary
+_pools = {}
+_pool_lock = threading.Lock()
+_replica_counter = itertools.count()
+_routing = threading.local()
+_executor = None
+
+
+def get_pool(host=None):
+    """Get the module level connection pool for a host, creating it on first use."""
+    pool = _pools.get(host)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(host)
+            if pool is None:
+                pool = _pools[host] = ConnectionPool(lambda: create_connection(host))
+    return pool
+
+
+@contextmanager
+def pin_primary():
+    """Send read only checkouts in this block to the primary, for reads that must see our own writes."""
+    _routing.pinned = getattr(_routing, 'pinned', 0) + 1
+    try:
+        yield
+    finally:
+        _routing.pinned -= 1
+
+
+def _acquire(readonly):
+    replica_hosts = get_db_credentials().get('replica_hosts') if readonly else None
+
+    if replica_hosts and not getattr(_routing, 'pinned', 0):
+        # Round robin over the replicas, falling back to the primary if one is down
+        host = replica_hosts[next(_replica_counter) % len(replica_hosts)]
+        pool = get_pool(host)
+        try:
+            return pool, pool.acquire()
+        except pymysql.err.OperationalError as e:
+            print(f"Replica {host} unavailable, using primary: {e}")
+
+    pool = get_pool()
+    return pool, pool.acquire()
+
+
+@contextmanager
+def db_connection(readonly=False):
+    """Check out a pooled connection for the duration of a with block.
+
+    :param readonly: Route the checkout to a read replica when one is configured.
+    """
+    pool, connection = _acquire(readonly)
+    broken = False
+    _routing.held = getattr(_routing, 'held', 0) + 1
+
+    try:
+        yield connection
+    except pymysql.err.OperationalError:
+        broken = True
+        raise
+    except Exception:
+        # Never hand a connection with a half finished transaction to the next caller
+        try:
+            connection.rollback()
+        except pymysql.err.Error:
+            broken = True
+        raise
+    finally:
+        _routing.held -= 1
+        pool.release(connection, broken=broken)
+
+
+@contextmanager
+def db_cursor(readonly=False):
+    """Check out a pooled connection and yield a cursor on it."""
+    with db_connection(readonly) as connection:
+        with connection.cursor() as cursor:
+            yield cursor
+
+
+@contextmanager
+def db_stream_cursor(readonly=True):
+    """Check out a pooled connection and yield an unbuffered tuple cursor on it.
+
+    Rows are read from the socket as they are iterated, so memory does not grow with the result size.
+    The connection cannot run another statement until the cursor is closed.
+    """
+    with db_connection(readonly) as connection:
+        with connection.cursor(InstrumentedSSCursor) as cursor:
+            yield cursor
+
+
+def run_parallel(*tasks, readonly=True):
+    """Run independent tasks at the same time, each on its own pooled connection.
+
+    A caller that already holds a connection runs the tasks one after another instead, workers waiting for the
+    connections it holds would otherwise wait out the checkout timeout.
+
+    :param tasks: Callables taking a connection, e.g. lambda connection: fetch_daily_weather(connection, ...).
+    :param readonly: Route the checkouts to a read replica when one is configured.
+    :return: The tasks' results, in the order the tasks were given.
+    """
+    global _executor
+    if _executor is None:
+        with _pool_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=POOL_MAX_SIZE, thread_name_prefix='db')
+
+    # Pinning is per thread, carry it over to the workers
+    readonly = readonly and not getattr(_routing, 'pinned', 0)
+
+    def run(task):
+        with db_connection(readonly) as connection:
+            return task(connection)
+
+    if getattr(_routing, 'held', 0):
+        return [run(task) for task in tasks]
+
+    futures = [_executor.submit(run, task) for task in tasks]
+    return [future.result() for future in futures]
+
+
+def query_task(query, args=None):
+    """Build a run_parallel task that executes one statement and returns its fetchall()."""
+    def task(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(query, args)
+            return cursor.fetchall()
+
+    return task
+
+
+def columnar_task(query, args=None):
+    """Build a run_parallel task that reads one statement through a tuple cursor into columnar form."""
+    def task(connection):
+        with connection.cursor(InstrumentedSSCursor) as cursor:
+            cursor.execute(query, args)
+            return cursor_to_columnar(cursor)
+
+    return task
+
+
+def fetchall_parallel(*queries, readonly=True):
+    """Run independent (sql, args) statements at the same time and return each one's fetchall()."""
+    return run_parallel(*[query_task(query, args) for query, args in queries], readonly=readonly)
@@ -0,0 +1,173 @@
+import csv
+import io
+import json
+
+# Operations per bulk request, and rows per multi-row statement
+BULK_MAX_ROWS = 5000
+BULK_WRITE_CHUNK = 500
+
+BULK_OPERATIONS = ('upsert', 'delete')
+# Device columns and their lengths in IoTDevicesTest
+DEVICE_FIELDS = {'IoTType': 50, 'IoTSerialNumber': 20, 'PlotID': 10}
+DEVICE_STATUSES = (0, 1)
+
+# Errors returned per request, the count is always complete
+BULK_MAX_REPORTED_ERRORS = 100
+# Seconds the route may spend publishing device shadows, API Gateway gives up on a request after 29
+BULK_SHADOW_PUBLISH_SECONDS = 12
+
+# Only placeholders in VALUES, so executemany sends each chunk as one multi-row statement
+UPSERT_QUERY = """
+INSERT INTO IoTDevicesTest (IoTType, IoTStatus, IoTSerialNumber, PlotID, LastDowntime)
+VALUES (%s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE IoTType = VALUES(IoTType), IoTStatus = VALUES(IoTStatus), PlotID = VALUES(PlotID)
+"""
+
+LOG_QUERY = """
+INSERT INTO IoTDeviceLogTest (IoTType, IoTStatus, IoTSerialNumber, PlotID, Timestamp, ChangedBy)
+VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+
+class DeviceBulkError(ValueError):
+    pass
+
+
+def parse_operations(body, content_type):
+    """Parse a JSON array of operation objects, or a CSV with a header row, into a list of dicts."""
+    if content_type.startswith('text/csv'):
+        reader = csv.DictReader(io.StringIO(body))
+        if reader.fieldnames is None:
+            return []
+        reader.fieldnames = [name.strip() for name in reader.fieldnames]
+        return [{name: (value.strip() if isinstance(value, str) else value) for name, value in row.items()}
+                for row in reader if any(row.values())]
+
+    try:
+        operations = json.loads(body or '[]')
+    except ValueError as e:
+        raise DeviceBulkError("Invalid JSON: " + str(e))
+    if not isinstance(operations, list):
+        raise DeviceBulkError("Expected a JSON array of device operations")
+    return operations
+
+
+def validate_operations(operations):
+    """
+    Check every operation before anything is written.
+    An operation is {"op": "upsert" | "delete", "IoTSerialNumber": ...}, upserts also need IoTType, IoTStatus
+    and PlotID. op defaults to upsert, and a serial number may only appear once per request.
+
+    :return: (normalized operations, [{"row": ..., "error": ...}]), rows are numbered from 1
+    """
+    if len(operations) > BULK_MAX_ROWS:
+        raise DeviceBulkError(f"At most {BULK_MAX_ROWS} device operations can be sent at once")
+
+    valid, errors, seen = [], [], set()
+    for row, operation in enumerate(operations, start=1):
+        if not isinstance(operation, dict):
+            errors.append({'row': row, 'error': "Expected an object"})
+            continue
+
+        op = operation.get('op') or 'upsert'
+        fields = DEVICE_FIELDS if op == 'upsert' else {'IoTSerialNumber': DEVICE_FIELDS['IoTSerialNumber']}
+        problems = []
+        if op not in BULK_OPERATIONS:
+            problems.append("op must be one of " + ", ".join(BULK_OPERATIONS))
+
+        normalized = {'row': row, 'op': op}
+        for name, length in fields.items():
+            value = operation.get(name)
+            if value is None or str(value).strip() == '':
+                problems.append("Missing " + name)
+            elif len(str(value)) > length:
+                problems.append(f"{name} is longer than {length} characters")
+            else:
+                normalized[name] = str(value)
+
+        if op == 'upsert':
+            try:
+                normalized['IoTStatus'] = int(operation.get('IoTStatus'))
+                if normalized['IoTStatus'] not in DEVICE_STATUSES:
+                    raise ValueError
+            except (TypeError, ValueError):
+                problems.append("IoTStatus must be one of " + ", ".join(str(status) for status in DEVICE_STATUSES))
+
+        serial = normalized.get('IoTSerialNumber')
+        if serial is not None and serial in seen:
+            problems.append(f"IoTSerialNumber {serial} appears more than once")
+        seen.add(serial)
+
+        if problems:
+            errors.append({'row': row, 'error': "; ".join(problems)})
+        else:
+            valid.append(normalized)
+
+    return valid, errors
+
+
+def apply_operations(connection, operations, now):
+    """
+    Apply validated operations in one transaction, with a log entry for every device created, changed or deleted.
+    Upserts are keyed by serial number, unchanged devices are not written.
+
+    :param now: The time of every row written, Singapore local time like the rest of the device log (sgt_now).
+
+    :return: Per row results, {"row", "op", "IoTSerialNumber", "result"} where result is created, updated,
+             unchanged, deleted or not_found.
+    """
+    with connection.cursor() as cursor:
+        connection.begin()
+        try:
+            serials = [operation['IoTSerialNumber'] for operation in operations]
+            existing = {}
+            for i in range(0, len(serials), BULK_WRITE_CHUNK):
+                chunk = serials[i:i + BULK_WRITE_CHUNK]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                cursor.execute(f"""
+                SELECT id, IoTType, IoTStatus, IoTSerialNumber, PlotID
+                FROM IoTDevicesTest
+                WHERE IoTSerialNumber IN ({placeholders})
+                FOR UPDATE
+                """, chunk)
+                existing.update({device['IoTSerialNumber']: device for device in cursor.fetchall()})
+
+            upserts, deletes, logs, results = [], [], [], []
+            for operation in operations:
+                serial = operation['IoTSerialNumber']
+                device = existing.get(serial)
+
+                if operation['op'] == 'delete':
+                    result = 'deleted' if device else 'not_found'
+                    if device:
+                        deletes.append(serial)
+                        logs.append((device['IoTType'], device['IoTStatus'], serial, device['PlotID'], now, 'admin'))
+                else:
+                    values = (operation['IoTType'], operation['IoTStatus'], serial, operation['PlotID'])
+                    if device is None:
+                        result = 'created'
+                    elif values == (device['IoTType'], device['IoTStatus'], serial, device['PlotID']):
+                        result = 'unchanged'
+                    else:
+                        result = 'updated'
+                    if result != 'unchanged':
+                        upserts.append(values + (now,))
+                        logs.append(values + (now, 'admin'))
+
+                results.append({'row': operation['row'], 'op': operation['op'], 'IoTSerialNumber': serial,
+                                'result': result})
+
+            for i in range(0, len(upserts), BULK_WRITE_CHUNK):
+                cursor.executemany(UPSERT_QUERY, upserts[i:i + BULK_WRITE_CHUNK])
+            for i in range(0, len(deletes), BULK_WRITE_CHUNK):
+                chunk = deletes[i:i + BULK_WRITE_CHUNK]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                cursor.execute(f"DELETE FROM IoTDevicesTest WHERE IoTSerialNumber IN ({placeholders})", chunk)
+            for i in range(0, len(logs), BULK_WRITE_CHUNK):
+                cursor.executemany(LOG_QUERY, logs[i:i + BULK_WRITE_CHUNK])
+
+            connection.commit()
+            return results
+        except Exception:
+            connection.rollback()
+            raise
@@ -0,0 +1,233 @@
+import datetime
+import os
+
+# Raw IoTDeviceLogTest entries older than this many days are compacted into IoTDeviceIntervals
+COMPACT_AFTER_DAYS = int(os.environ.get('DEVICE_LOG_COMPACT_DAYS', 30))
+# Raw entries read per compaction transaction, and transactions per run so a large backlog drains over several runs
+COMPACT_STEP_ROWS = 10000
+COMPACT_MAX_STEPS = 20
+COMPACT_WRITE_CHUNK = 500
+# Raw entries deleted per statement, each delete commits on its own so no lock is held for long
+COMPACT_DELETE_CHUNK = 5000
+
+WATERMARK_NAME = 'IoTDeviceIntervals'
+
+# Raw entries up to the watermark are already in IoTDeviceIntervals, they are only waiting to be deleted.
+# Readers apply this in the same statement as the interval read, so an entry is never seen in both stores.
+RAW_LOG_FILTER = f"""id > (SELECT COALESCE(MAX(last_id), 0) FROM RollupWatermarks WHERE name = '{WATERMARK_NAME}')"""
+
+LOG_COLUMNS = "id, IoTType, IoTStatus, IoTSerialNumber, PlotID, Timestamp, ChangedBy"
+# An interval reads as the log entry that started it
+INTERVAL_LOG_COLUMNS = "id, IoTType, IoTStatus, IoTSerialNumber, PlotID, StartTime AS Timestamp, ChangedBy"
+
+# Source column of merged reads. Ids of the two stores overlap, so entries are ordered by (Timestamp, Source, id),
+# compacted intervals first since they hold the older history.
+INTERVAL_SOURCE, RAW_SOURCE = 0, 1
+
+
+def device_log_query(serial, conditions=(), limit=1, newest_first=True):
+    """
+    Build the query and arguments for one device's log entries from both stores, merged in time order.
+    Each store is read through its (IoTSerialNumber, time) index and cut at limit before the two are merged.
+    Entries have a Source column, RAW_SOURCE or INTERVAL_SOURCE.
+
+    :param conditions: (template, args) pairs, {time} in a template stands for the entry time and {source} for the
+                       Source of the store.
+    """
+    order = 'DESC' if newest_first else 'ASC'
+    raw_where, raw_args = ["IoTSerialNumber = %s", RAW_LOG_FILTER], [serial]
+    interval_where, interval_args = ["IoTSerialNumber = %s"], [serial]
+    for template, args in conditions:
+        raw_where.append(template.format(time='Timestamp', source=RAW_SOURCE))
+        raw_args.extend(args)
+        interval_where.append(template.format(time='StartTime', source=INTERVAL_SOURCE))
+        interval_args.extend(args)
+
+    query = f"""
+    (SELECT {LOG_COLUMNS}, {RAW_SOURCE} AS Source
+     FROM IoTDeviceLogTest
+     WHERE {' AND '.join(raw_where)}
+     ORDER BY Timestamp {order}, id {order}
+     LIMIT %s)
+    UNION ALL
+    (SELECT {INTERVAL_LOG_COLUMNS}, {INTERVAL_SOURCE} AS Source
+     FROM IoTDeviceIntervals
+     WHERE {' AND '.join(interval_where)}
+     ORDER BY StartTime {order}, id {order}
+     LIMIT %s)
+    ORDER BY Timestamp {order}, Source {order}, id {order}
+    LIMIT %s
+    """
+    return query, raw_args + [limit] + interval_args + [limit, limit]
+
+
+def device_since_query(serial):
+    """
+    Build the query and arguments for when one device entered its current status, in one statement.
+    The log holds state changes, older logs also have an entry per scheduled check. Each entry of both stores is
+    compared with the one before it, and the newest entry whose status differs from its predecessor is the start of
+    the current status. Compacted intervals keep a device's history short enough to scan whole.
+    """
+    query = f"""
+    SELECT Timestamp
+    FROM (
+        SELECT Timestamp, Source, id, IoTStatus,
+               LAG(IoTStatus) OVER (ORDER BY Timestamp, Source, id) AS PreviousStatus
+        FROM (
+            (SELECT Timestamp, {RAW_SOURCE} AS Source, id, IoTStatus
+             FROM IoTDeviceLogTest
+             WHERE IoTSerialNumber = %s AND {RAW_LOG_FILTER})
+            UNION ALL
+            (SELECT StartTime AS Timestamp, {INTERVAL_SOURCE} AS Source, id, IoTStatus
+             FROM IoTDeviceIntervals
+             WHERE IoTSerialNumber = %s)
+        ) entries
+    ) transitions
+    WHERE NOT (IoTStatus <=> PreviousStatus)
+    ORDER BY Timestamp DESC, Source DESC, id DESC
+    LIMIT 1
+    """
+    return query, [serial, serial]
+
+
+def get_compacted_id(cursor):
+    cursor.execute("SELECT last_id FROM RollupWatermarks WHERE name = %s", (WATERMARK_NAME,))
+    row = cursor.fetchone()
+    return row['last_id'] if row else 0
+
+
+def plan_intervals(entries, open_intervals):
+    """
+    Fold raw entries, sorted by device, time and id, into state intervals.
+    An interval starts at a status change and ends when the next one starts, the device's latest interval stays
+    open (EndTime None). Entries repeating the status of the open interval are dropped.
+
+    Entries are compacted in id order, so an entry written after a newer one of the same device was already
+    compacted starts before the device's open interval. Stored intervals are never reordered, such late entries
+    are dropped too.
+
+    :param open_intervals: {serial: {'id': ..., 'IoTStatus': ..., 'StartTime': ...}} of intervals already stored
+                           without an EndTime.
+    :return: (new intervals, [(EndTime, id)] of stored intervals to close)
+    """
+    intervals, closes = [], []
+    current = {}
+    for entry in entries:
+        serial = entry['IoTSerialNumber']
+        interval = current.get(serial) or open_intervals.get(serial)
+        if interval is not None and (interval['IoTStatus'] == entry['IoTStatus']
+                                     or entry['Timestamp'] < interval['StartTime']):
+            continue
+
+        if interval is not None:
+            if 'id' in interval:
+                closes.append((entry['Timestamp'], interval['id']))
+            else:
+                interval['EndTime'] = entry['Timestamp']
+
+        current[serial] = {
+            'IoTSerialNumber': serial, 'IoTType': entry['IoTType'], 'PlotID': entry['PlotID'],
+            'IoTStatus': entry['IoTStatus'], 'StartTime': entry['Timestamp'], 'EndTime': None,
+            'ChangedBy': entry['ChangedBy']
+        }
+        intervals.append(current[serial])
+    return intervals, closes
+
+
+def compact_step(connection, cutoff):
+    """
+    Compact the next COMPACT_STEP_ROWS raw entries older than cutoff in one transaction, in id order.
+    Returns (entries compacted, intervals written), (0, 0) once everything before cutoff is compacted.
+    """
+    with connection.cursor() as cursor:
+        connection.begin()
+        try:
+            last_id = get_compacted_id(cursor)
+            cursor.execute(f"""
+            SELECT {LOG_COLUMNS}
+            FROM IoTDeviceLogTest
+            WHERE id > %s
+            ORDER BY id
+            LIMIT %s
+            """, (last_id, COMPACT_STEP_ROWS))
+            entries = []
+            for entry in cursor.fetchall():
+                # Entries are written with the time they happened, so the first recent one ends the old history
+                if entry['Timestamp'] is not None and entry['Timestamp'] >= cutoff:
+                    break
+                entries.append(entry)
+
+            if not entries:
+                connection.commit()
+                return 0, 0
+
+            # Entries without a serial or time cannot be placed in an interval, they are dropped with the rest
+            devices = [entry for entry in entries
+                       if entry['IoTSerialNumber'] is not None and entry['Timestamp'] is not None]
+            devices.sort(key=lambda entry: (entry['IoTSerialNumber'], entry['Timestamp'], entry['id']))
+            serials = sorted({entry['IoTSerialNumber'] for entry in devices})
+
+            open_intervals = {}
+            if serials:
+                placeholders = ", ".join(["%s"] * len(serials))
+                cursor.execute(f"""
+                SELECT id, IoTSerialNumber, IoTStatus, StartTime
+                FROM IoTDeviceIntervals
+                WHERE IoTSerialNumber IN ({placeholders}) AND EndTime IS NULL
+                FOR UPDATE
+                """, serials)
+                open_intervals = {row['IoTSerialNumber']: row for row in cursor.fetchall()}
+
+            intervals, closes = plan_intervals(devices, open_intervals)
+
+            for i in range(0, len(intervals), COMPACT_WRITE_CHUNK):
+                cursor.executemany("""
+                INSERT INTO IoTDeviceIntervals (IoTSerialNumber, IoTType, PlotID, IoTStatus, StartTime, EndTime, ChangedBy)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, [(interval['IoTSerialNumber'], interval['IoTType'], interval['PlotID'], interval['IoTStatus'],
+                       interval['StartTime'], interval['EndTime'], interval['ChangedBy'])
+                      for interval in intervals[i:i + COMPACT_WRITE_CHUNK]])
+            if closes:
+                cursor.executemany("UPDATE IoTDeviceIntervals SET EndTime = %s WHERE id = %s", closes)
+
+            cursor.execute("""
+            INSERT INTO RollupWatermarks (name, last_id) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE last_id = VALUES(last_id)
+            """, (WATERMARK_NAME, entries[-1]['id']))
+
+            connection.commit()
+            return len(entries), len(intervals)
+        except Exception:
+            connection.rollback()
+            raise
+
+
+def delete_compacted_entries(connection):
+    """Delete raw entries up to the watermark in COMPACT_DELETE_CHUNK sized statements, returns the number deleted."""
+    deleted = 0
+    with connection.cursor() as cursor:
+        last_id = get_compacted_id(cursor)
+        while True:
+            # A primary key range, each statement commits on its own
+            cursor.execute("DELETE FROM IoTDeviceLogTest WHERE id <= %s ORDER BY id LIMIT %s",
+                           (last_id, COMPACT_DELETE_CHUNK))
+            deleted += cursor.rowcount
+            if cursor.rowcount < COMPACT_DELETE_CHUNK:
+                return deleted
+
+
+def compact_device_log(connection, now):
+    """
+    Move raw log history older than COMPACT_AFTER_DAYS into IoTDeviceIntervals, then delete the raw entries.
+    Returns {"entries": compacted, "intervals": written, "deleted": raw entries deleted}.
+    """
+    cutoff = now - datetime.timedelta(days=COMPACT_AFTER_DAYS)
+    compacted = written = 0
+    for _ in range(COMPACT_MAX_STEPS):
+        entries, intervals = compact_step(connection, cutoff)
+        if not entries:
+            break
+        compacted += entries
+        written += intervals
+
+    return {"entries": compacted, "intervals": written, "deleted": delete_compacted_entries(connection)}
@@ -5,10 +5,16 @@ import datetime
 import random
 import os
 import hashlib
-from .connectHelper import create_connection
-from .helpers import json_serial
+from .connectHelper import db_connection, db_cursor, db_stream_cursor, pin_primary
+from .queryMetrics import InstrumentedSSCursor
+from .authorizers import admin_authorizer
+from .deviceBulk import (DeviceBulkError, BULK_MAX_REPORTED_ERRORS, BULK_SHADOW_PUBLISH_SECONDS, parse_operations,
+                         validate_operations, apply_operations)
+from .deviceLog import device_log_query, device_since_query, compact_device_log
+from .deviceShadows import publish_status_changes
+from .deviceUptime import sgt_now, fetch_daily_uptime, refresh_daily_uptime, summarize_uptime
+from .helpers import json_serial, get_int_param, get_datetime_param, get_format_param, cursor_to_columnar
 
-from botocore.config import Config
 from chalice.app import Rate
 
 app = Chalice(app_name='midorisky')
@@ -18,29 +24,85 @@ app.debug = True
 device_routes = Blueprint(__name__)
 
 s3 = boto3.client('s3')
+sqs = boto3.client('sqs')
+
+# Page size of the staff device listing
+DEVICE_PAGE_SIZE = 50
+DEVICE_MAX_PAGE_SIZE = 500
+
+# Query string filters of the device listing and the column each one matches
+DEVICE_FILTERS = {'plot': 'PlotID', 'status': 'IoTStatus', 'type': 'IoTType'}
+
+
+def round_down_30min(value):
+    """Round a datetime down to the previous 30-minute interval, None stays None"""
+    return value - datetime.timedelta(minutes=value.minute % 30) if value else None
+
+
+def get_device_filters(params):
+    """Build the WHERE conditions and arguments of the ?plot=, ?status= and ?type= filters"""
+    conditions, args = [], []
+    for name, column in DEVICE_FILTERS.items():
+        if (params or {}).get(name) is None:
+            continue
+        conditions.append(f"{column} = %s")
+        args.append(get_int_param(params, name, minimum=0) if name == 'status' else params[name])
+    return conditions, args
+
 
 @device_routes.route('/staff/devices/view-all-devices', methods=['GET'], cors=True)
 def fetch_all_devices():
     """
-    Fetch all IoT devices, rounding LastDowntime to the previous 30-minute interval.
-    """
-    query = """
-    SELECT id, IoTType, IoTStatus, IoTSerialNumber, PlotID, 
-           DATE_SUB(LastDowntime, INTERVAL MOD(MINUTE(LastDowntime), 30) MINUTE) AS RoundedLastDowntime
-    FROM IoTDevicesTest
+    Fetch IoT devices ordered by id, optionally filtered by ?plot=, ?status= and ?type=.
+    Without ?limit= or ?after= every matching device is returned as a plain array, as before the listing was paged.
+    With either, at most ?limit= devices are returned after the id in ?after= as {"devices", "next", "total"},
+    pass next back as ?after= to get the following page. Total counts every device matching the filters.
+    LastDowntime is rounded to the previous 30-minute interval.
     """
-
     try:
-        connection = create_connection()
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchall()
+        params = device_routes.current_request.query_params or {}
+        paginated = params.get('limit') is not None or params.get('after') is not None
+        limit = get_int_param(params, 'limit', default=DEVICE_PAGE_SIZE, maximum=DEVICE_MAX_PAGE_SIZE)
+        after = get_int_param(params, 'after', default=0, minimum=0)
+        conditions, args = get_device_filters(params)
+
+        where = ' AND '.join(conditions) or '1 = 1'
+        # Filtered counts are answered from idx_iotdevicestest_plot_status_type without reading the rows
+        count_query = f"SELECT COUNT(*) AS total FROM IoTDevicesTest WHERE {where}"
+        page_query = f"""
+        SELECT id, IoTType, IoTStatus, IoTSerialNumber, PlotID, LastDowntime
+        FROM IoTDevicesTest
+        WHERE {where}{' AND id > %s' if paginated else ''}
+        ORDER BY id
+        {'LIMIT %s' if paginated else ''}
+        """
+
+        with db_connection(readonly=True) as connection, connection.cursor() as cursor:
+            cursor.execute(page_query, args + [after, limit] if paginated else args)
+            devices = cursor.fetchall()
+            if paginated:
+                cursor.execute(count_query, args)
+                total = cursor.fetchone()['total']
+
+        for device in devices:
+            device['RoundedLastDowntime'] = round_down_30min(device.pop('LastDowntime'))
+
+        if paginated:
+            body = {'devices': devices, 'next': devices[-1]['id'] if len(devices) == limit else None, 'total': total}
+        else:
+            body = devices
 
         return Response(
-            body=json.dumps(result, default=json_serial),
+            body=json.dumps(body, default=json_serial),
             status_code=200,
             headers={'Content-Type': 'application/json'}
         )
+    except BadRequestError as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=400,
+            headers={'Content-Type': 'application/json'}
+        )
     except Exception as e:
         return Response(
             body=json.dumps({"error": str(e)}),
@@ -53,18 +115,22 @@ def fetch_all_devices():
 def fetch_device(device_id):
     """
     Fetch the latest log entry for a single IoT device by its serial number.
+    Since is when the device entered its current status.
     """
-    query = """
-    SELECT id, IoTType, IoTStatus, IoTSerialNumber, PlotID, Timestamp, ChangedBy 
-    FROM IoTDeviceLogTest 
-    WHERE IoTSerialNumber = (SELECT IoTSerialNumber FROM IoTDevicesTest WHERE id = %s) 
-    ORDER BY Timestamp DESC 
-    LIMIT 1"""
     try:
-        connection = create_connection()
-        with connection.cursor() as cursor:
-            cursor.execute(query, (device_id,))
-            result = cursor.fetchone()
+        with db_connection(readonly=True) as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT IoTSerialNumber FROM IoTDevicesTest WHERE id = %s", (device_id,))
+            device = cursor.fetchone()
+            result = None
+
+            if device:
+                serial = device['IoTSerialNumber']
+                cursor.execute(*device_log_query(serial))
+                result = cursor.fetchone()
+
+            if result:
+                cursor.execute(*device_since_query(serial))
+                result['Since'] = cursor.fetchone()['Timestamp']
 
         if not result:
             return Response(
@@ -85,6 +151,184 @@ def fetch_device(device_id):
             headers={'Content-Type': 'application/json'}
         )
 
+# Page size of a device history
+HISTORY_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 1000
+
+def get_history_cursor(params):
+    """
+    Parse the ?before= cursor of a device history, "<timestamp>,<source>,<log id>" of the last entry already returned.
+    Log and interval ids overlap, the source tells which store the id is from.
+    """
+    value = (params or {}).get('before')
+    if value is None:
+        return None
+
+    try:
+        timestamp, source, log_id = value.split(',')
+        return datetime.datetime.fromisoformat(timestamp), int(source), int(log_id)
+    except ValueError:
+        raise BadRequestError("Invalid cursor for parameter before: " + value)
+
+
+@device_routes.route('/staff/devices/view/{device_id}/history', methods=['GET'], cors=True)
+def fetch_device_history(device_id):
+    """
+    Fetch the status history of an IoT device, newest first, optionally between ?from= and ?to= (exclusive).
+    Each entry is an interval, the status held from Timestamp until Until, which is null for the current status.
+    At most ?limit= entries are returned, pass the returned next as ?before= to get older entries.
+    Supports ?format=columnar.
+    """
+    try:
+        params = device_routes.current_request.query_params
+        start = get_datetime_param(params, 'from', required=False)
+        end = get_datetime_param(params, 'to', required=False)
+        limit = get_int_param(params, 'limit', default=HISTORY_PAGE_SIZE, maximum=HISTORY_MAX_PAGE_SIZE)
+        cursor_position = get_history_cursor(params)
+        response_format = get_format_param(params)
+
+        if start and end and start >= end:
+            raise BadRequestError("Parameter from must be before to.")
+
+        # Every condition is a range on the (IoTSerialNumber, time) index of both stores, which also gives the order
+        conditions = []
+        if start:
+            conditions.append(("{time} >= %s", [start]))
+        if end:
+            conditions.append(("{time} < %s", [end]))
+        if cursor_position:
+            timestamp, source, log_id = cursor_position
+            conditions.append(("({time} < %s OR ({time} = %s AND ({source} < %s OR ({source} = %s AND id < %s))))",
+                               [timestamp, timestamp, source, source, log_id]))
+
+        with db_connection(readonly=True) as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT IoTSerialNumber FROM IoTDevicesTest WHERE id = %s", (device_id,))
+            device = cursor.fetchone()
+            if not device:
+                return Response(
+                    body=json.dumps({"error": "Device not found"}),
+                    status_code=404,
+                    headers={'Content-Type': 'application/json'}
+                )
+
+            page_query = device_log_query(device['IoTSerialNumber'], conditions, limit)
+            if response_format == 'columnar':
+                # Columnar pages are read straight from a tuple cursor, without building row dicts
+                with connection.cursor(InstrumentedSSCursor) as page_cursor:
+                    page_cursor.execute(*page_query)
+                    result = cursor_to_columnar(page_cursor)
+                timestamps = result['data']['Timestamp']
+                last = {column: values[-1] for column, values in result['data'].items()} if timestamps else None
+            else:
+                cursor.execute(*page_query)
+                logs = cursor.fetchall()
+                timestamps = [log['Timestamp'] for log in logs]
+                last = logs[-1] if logs else None
+
+            # The entry just newer than the page ends the first interval, on the first page that is the current status
+            until = cursor_position[0] if cursor_position else None
+            if timestamps and not cursor_position and end:
+                cursor.execute(*device_log_query(device['IoTSerialNumber'], [("{time} >= %s", [end])],
+                                                 newest_first=False))
+                newer = cursor.fetchone()
+                until = newer['Timestamp'] if newer else None
+
+        untils = [until] + timestamps[:-1]
+        next_cursor = None
+        if len(timestamps) == limit:
+            next_cursor = f"{last['Timestamp'].isoformat()},{last['Source']},{last['id']}"
+
+        if response_format == 'columnar':
+            result['columns'].append('Until')
+            result['data']['Until'] = untils
+            result['next'] = next_cursor
+        else:
+            for log, log_until in zip(logs, untils):
+                log['Until'] = log_until
+            result = {'logs': logs, 'next': next_cursor}
+
+        return Response(
+            body=json.dumps(result, default=json_serial),
+            status_code=200,
+            headers={'Content-Type': 'application/json'}
+        )
+    except BadRequestError as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=400,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+
+# Longest range of the uptime report, and the default range ending today
+UPTIME_MAX_DAYS = 366
+UPTIME_DEFAULT_DAYS = 7
+
+
+@device_routes.route('/staff/devices/uptime', methods=['GET'], cors=True)
+def fetch_device_uptime():
+    """
+    Fetch uptime percentage, downtime count and mean time to recovery for the Singapore days ?from= to ?to= inclusive,
+    the last 7 days by default. ?group=plot adds devices up per plot instead of reporting each device.
+    """
+    try:
+        params = device_routes.current_request.query_params
+        today = sgt_now().date()
+        start = get_datetime_param(params, 'from', required=False)
+        end = get_datetime_param(params, 'to', required=False)
+        last_day = end.date() if end else today
+        first_day = start.date() if start else last_day - datetime.timedelta(days=UPTIME_DEFAULT_DAYS - 1)
+        group = (params or {}).get('group', 'device')
+
+        if group not in ('device', 'plot'):
+            raise BadRequestError("Parameter group must be device or plot.")
+        if first_day > last_day:
+            raise BadRequestError("Parameter from must not be after to.")
+        if (last_day - first_day).days >= UPTIME_MAX_DAYS:
+            raise BadRequestError(f"At most {UPTIME_MAX_DAYS} days can be requested.")
+
+        # Each log store is streamed on its own connection
+        with db_stream_cursor() as log_cursor, db_stream_cursor() as interval_cursor:
+            with db_connection(readonly=True) as connection:
+                rows = fetch_daily_uptime(connection, log_cursor, interval_cursor, first_day, min(last_day, today),
+                                          sgt_now())
+
+        return Response(
+            body=json.dumps(summarize_uptime(rows, group), default=json_serial),
+            status_code=200,
+            headers={'Content-Type': 'application/json'}
+        )
+    except BadRequestError as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=400,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+
+def read_written_device(device_id):
+    """Read a device this request just wrote, from the primary since a replica may not have the write yet."""
+    with pin_primary(), db_cursor(readonly=True) as cursor:
+        cursor.execute("""
+        SELECT id, IoTType, IoTStatus, IoTSerialNumber, PlotID, LastDowntime
+        FROM IoTDevicesTest
+        WHERE id = %s
+        """, (device_id,))
+        return cursor.fetchone()
+
+
 @device_routes.route('/staff/devices/create', methods=['POST'], cors=True)
 def create_device():
     """
@@ -101,18 +345,23 @@ def create_device():
             raise BadRequestError("Missing required fields")
 
         query = """INSERT INTO IoTDevicesTest (IoTType, IoTStatus, IoTSerialNumber, PlotID, LastDowntime) 
-                   VALUES (%s, %s, %s, %s, NOW())"""
+                   VALUES (%s, %s, %s, %s, %s)"""
         log_query = """INSERT INTO IoTDeviceLogTest (IoTType, IoTStatus, IoTSerialNumber, PlotID, Timestamp, ChangedBy) 
-                        VALUES (%s, %s, %s, %s, NOW(), 'Admin')"""
-
-        connection = create_connection()
-        with connection.cursor() as cursor:
-            cursor.execute(query, (IoTType, IoTStatus, IoTSerialNumber, PlotID))
-            cursor.execute(log_query, (IoTType, IoTStatus, IoTSerialNumber, PlotID))
+                        VALUES (%s, %s, %s, %s, %s, 'Admin')"""
+
+        # Device times are Singapore local time, like the scheduled status update writes them
+        now = sgt_now()
+        with db_connection() as connection, connection.cursor() as cursor:
+            cursor.execute(query, (IoTType, IoTStatus, IoTSerialNumber, PlotID, now))
+            device_id = cursor.lastrowid
+            cursor.execute(log_query, (IoTType, IoTStatus, IoTSerialNumber, PlotID, now))
             connection.commit()
 
+        publish_status_changes([{'IoTSerialNumber': IoTSerialNumber, 'IoTStatus': IoTStatus, 'PlotID': PlotID}])
+
         return Response(
-            body=json.dumps({"message": "Device created successfully"}),
+            body=json.dumps({"message": "Device created successfully", "device": read_written_device(device_id)},
+                            default=json_serial),
             status_code=201,
             headers={'Content-Type': 'application/json'}
         )
@@ -143,16 +392,22 @@ def edit_device(device_id):
         query = """UPDATE IoTDevicesTest SET IoTType=%s, IoTStatus=%s, IoTSerialNumber=%s, PlotID=%s 
                    WHERE id=%s"""
         log_query = """INSERT INTO IoTDeviceLogTest (IoTType, IoTStatus, IoTSerialNumber, PlotID, Timestamp, ChangedBy) 
-                        VALUES (%s, %s, %s, %s, NOW(), 'admin')"""
+                        VALUES (%s, %s, %s, %s, %s, 'admin')"""
 
-        connection = create_connection()
-        with connection.cursor() as cursor:
+        with db_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT IoTStatus FROM IoTDevicesTest WHERE id = %s FOR UPDATE", (device_id,))
+            previous = cursor.fetchone()
             cursor.execute(query, (IoTType, IoTStatus, IoTSerialNumber, PlotID, device_id))
-            cursor.execute(log_query, (IoTType, IoTStatus, IoTSerialNumber, PlotID))
+            cursor.execute(log_query, (IoTType, IoTStatus, IoTSerialNumber, PlotID, sgt_now()))
             connection.commit()
 
+        # The shadow only needs the new state when the status changed
+        if previous and previous['IoTStatus'] != int(IoTStatus):
+            publish_status_changes([{'IoTSerialNumber': IoTSerialNumber, 'IoTStatus': IoTStatus, 'PlotID': PlotID}])
+
         return Response(
-            body=json.dumps({"message": "Device updated successfully"}),
+            body=json.dumps({"message": "Device updated successfully", "device": read_written_device(device_id)},
+                            default=json_serial),
             status_code=200,
             headers={'Content-Type': 'application/json'}
         )
@@ -171,12 +426,11 @@ def delete_device(device_id):
     """
     try:
         log_query = """INSERT INTO IoTDeviceLogTest (IoTType, IoTStatus, IoTSerialNumber, PlotID, Timestamp, ChangedBy) 
-                        SELECT IoTType, IoTStatus, IoTSerialNumber, PlotID, NOW(), 'admin' FROM IoTDevicesTest WHERE id = %s"""
+                        SELECT IoTType, IoTStatus, IoTSerialNumber, PlotID, %s, 'admin' FROM IoTDevicesTest WHERE id = %s"""
         delete_query = "DELETE FROM IoTDevicesTest WHERE id = %s"
 
-        connection = create_connection()
-        with connection.cursor() as cursor:
-            cursor.execute(log_query, (device_id,))
+        with db_connection() as connection, connection.cursor() as cursor:
+            cursor.execute(log_query, (sgt_now(), device_id))
             cursor.execute(delete_query, (device_id,))
             connection.commit()
 
@@ -193,12 +447,61 @@ def delete_device(device_id):
         )
 
 
-# AWS IoT Client Configuration
-iot_client = boto3.client(
-    'iot-data',
-    endpoint_url=f"https://{os.getenv('IOT_ENDPOINT')}",
-    config=Config(signature_version='v4')
-)
+@device_routes.route('/staff/devices/bulk', methods=['POST'], authorizer=admin_authorizer, cors=True,
+                     content_types=['application/json', 'text/csv'])
+def bulk_devices():
+    """
+    Create, update and delete many IoT devices in one transaction, from a JSON array or a CSV with a header row.
+    Every row is {"op": "upsert" | "delete", "IoTSerialNumber", "IoTType", "IoTStatus", "PlotID"}, see
+    validate_operations. Nothing is written when a row is invalid, the errors are returned per row instead.
+    The summary reports the shadow updates of written devices, {"published": count, "failed": [...]}.
+    """
+    request = device_routes.current_request
+
+    try:
+        body = (request.raw_body or b'').decode('utf-8-sig')
+        operations = parse_operations(body, request.headers.get('content-type', 'application/json'))
+        operations, errors = validate_operations(operations)
+
+        if errors:
+            return Response(
+                body=json.dumps({"error": "Invalid device operations, nothing was applied",
+                                 "rejected": len(errors), "errors": errors[:BULK_MAX_REPORTED_ERRORS]}),
+                status_code=400,
+                headers={'Content-Type': 'application/json'}
+            )
+
+        with db_connection() as connection:
+            results = apply_operations(connection, operations, sgt_now())
+
+        # Devices learn about created and changed devices through their shadows, deleted ones are left as they are
+        written = {result['row'] for result in results if result['result'] in ('created', 'updated')}
+        shadows = publish_status_changes([operation for operation in operations if operation['row'] in written],
+                                         seconds=BULK_SHADOW_PUBLISH_SECONDS)
+
+        summary = {}
+        for result in results:
+            summary[result['result']] = summary.get(result['result'], 0) + 1
+        summary['shadows'] = shadows
+
+        return Response(
+            body=json.dumps({"summary": summary, "results": results}),
+            status_code=200,
+            headers={'Content-Type': 'application/json'}
+        )
+    except (DeviceBulkError, UnicodeDecodeError) as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=400,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
 
 # UTC Offset for Singapore Time
 SGT_OFFSET = datetime.timedelta(hours=8)
@@ -207,84 +510,188 @@ SGT_OFFSET = datetime.timedelta(hours=8)
 DOWNTIME_PROBABILITY = 0.2  # 10% chance for a device to go inactive
 DOWNTIME_COOLDOWN_DAYS = 40
 
+# Devices per shard of the scheduled status update, each shard is one SQS message and worker invocation
+IOT_SHARD_SIZE = int(os.environ.get('IOT_SHARD_SIZE', 2000))
+IOT_SHARD_FETCH_SIZE = 500
+IOT_SHARD_WRITE_CHUNK = 500
+
 def get_latest_30min_timestamp():
     """Get the latest rounded 30-minute timestamp."""
     now = datetime.datetime.utcnow() + SGT_OFFSET
     rounded_minute = (now.minute // 30) * 30
     return now.replace(minute=rounded_minute, second=0, microsecond=0)
 
+def next_status(device, latest_time):
+    """Get the (status, LastDowntime) a device should have at latest_time, based on probability and cooldown."""
+    current_status = device["IoTStatus"]
+    last_downtime = device["LastDowntime"]
+
+    # Default: Keep the same status
+    final_status = current_status
+
+    # Check if we should set device to inactive
+    if current_status == 1:
+        can_go_inactive = False
+        if last_downtime is None:
+            can_go_inactive = True
+        else:
+            diff_days = (latest_time.date() - last_downtime.date()).days
+            if diff_days >= DOWNTIME_COOLDOWN_DAYS:
+                can_go_inactive = True
+
+        if can_go_inactive:
+            hash_key = f"{device['IoTSerialNumber']}-{latest_time.strftime('%Y-%m-%d %H')}"
+            hash_val = int(hashlib.sha256(hash_key.encode()).hexdigest(), 16)
+            if (hash_val % 100) < DOWNTIME_PROBABILITY:
+                final_status = 0
+                last_downtime = latest_time
+
+    return final_status, last_downtime
+
+def plan_shards(min_id, max_id, size=None):
+    """Split the inclusive id range into (start_id, end_id) shards of at most size (IOT_SHARD_SIZE) ids."""
+    if min_id is None:
+        return []
+    size = size or IOT_SHARD_SIZE
+    return [(start, min(start + size - 1, max_id)) for start in range(min_id, max_id + 1, size)]
+
 @device_routes.schedule(Rate(30, unit=Rate.MINUTES))
 def scheduled_iot_status_update(event):
-    """Scheduled event to update IoT device statuses based on probability and cooldown."""
+    """
+    Scheduled event to update IoT device statuses based on probability and cooldown.
+    The fleet is split into id-range shards, a single shard is processed here and larger fleets are fanned out
+    to handle_iot_status_shard through SQS.
+    IoTDeviceLogTest only gets a row when a device's status changes, so each row starts a state interval
+    that lasts until the device's next row.
+    """
     print("Running scheduled IoT status update...")
-    connection = create_connection()
     latest_time = get_latest_30min_timestamp()
 
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT id, IoTType, IoTStatus, IoTSerialNumber, PlotID, LastDowntime
-                FROM IoTDevicesTest
-            """
-            )
-            devices = cursor.fetchall()
+        with db_cursor() as cursor:
+            cursor.execute("SELECT MIN(id) AS min_id, MAX(id) AS max_id FROM IoTDevicesTest")
+            bounds = cursor.fetchone()
+
+        shards = plan_shards(bounds['min_id'], bounds['max_id'])
+        if len(shards) <= 1:
+            result = process_device_shard(*(shards[0] if shards else (0, 0)), latest_time)
+            return dict(result, message="IoT statuses updated successfully.")
+
+        messages = [{
+            'Id': str(i),
+            'MessageBody': json.dumps({'start_id': start, 'end_id': end, 'latest_time': latest_time.isoformat()})
+        } for i, (start, end) in enumerate(shards)]
+        for i in range(0, len(messages), 10):
+            response = sqs.send_message_batch(QueueUrl=os.environ.get('IOT_SHARD_QUEUE_URL'), Entries=messages[i:i + 10])
+            if response.get('Failed'):
+                raise Exception(f"Failed to queue {len(response['Failed'])} shard(s)")
+
+        print(f"Queued {len(shards)} shard(s) of up to {IOT_SHARD_SIZE} devices")
+        return {"message": "IoT status shards queued successfully.", "shards": len(shards)}
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return {"error": str(e)}
 
-            logs = []
-            updates = []
-
-            for device in devices:
-                device_id = device["id"]
-                serial = device["IoTSerialNumber"]
-                current_status = device["IoTStatus"]
-                last_downtime = device["LastDowntime"]
-
-                # Default: Keep the same status
-                final_status = current_status
-
-                # Check if we should set device to inactive
-                if current_status == 1:
-                    can_go_inactive = False
-                    if last_downtime is None:
-                        can_go_inactive = True
-                    else:
-                        diff_days = (latest_time.date() - last_downtime.date()).days
-                        if diff_days >= DOWNTIME_COOLDOWN_DAYS:
-                            can_go_inactive = True
-
-                    if can_go_inactive:
-                        hash_key = f"{serial}-{latest_time.strftime('%Y-%m-%d %H')}"
-                        hash_val = int(hashlib.sha256(hash_key.encode()).hexdigest(), 16)
-                        if (hash_val % 100) < DOWNTIME_PROBABILITY:
-                            final_status = 0
-                            last_downtime = latest_time
-
-                logs.append((
-                    device["IoTType"], serial, final_status, latest_time, device["PlotID"], "system"
-                ))
-                updates.append((final_status, last_downtime, latest_time, serial))
-
-            # Insert logs into IoTDeviceLogTest
-            if logs:
+@device_routes.on_sqs_message(queue='midori-iot-shards', batch_size=1)
+def handle_iot_status_shard(event):
+    """Worker for one shard queued by scheduled_iot_status_update, errors are retried by SQS."""
+    for record in event:
+        shard = json.loads(record.body)
+        result = process_device_shard(shard['start_id'], shard['end_id'],
+                                      datetime.datetime.fromisoformat(shard['latest_time']))
+        print(f"Shard {shard['start_id']}-{shard['end_id']}: {result['changed']} changed, {result['unchanged']} unchanged")
+
+def process_device_shard(start_id, end_id, latest_time):
+    """
+    Update the devices with start_id <= id <= end_id.
+    Devices are streamed from an unbuffered cursor so only the status changes are held in memory, and only changed
+    devices are logged and rewritten (with their LastUpdated), so a quiet shard writes nothing.
+    Deterministic per hour, so a retried shard does not change a device twice.
+    """
+    changes = []
+    unchanged = 0
+
+    with db_stream_cursor(readonly=False) as cursor:
+        cursor.execute("""
+            SELECT id, IoTType, IoTStatus, IoTSerialNumber, PlotID, LastDowntime
+            FROM IoTDevicesTest
+            WHERE id >= %s AND id <= %s
+        """, (start_id, end_id))
+        columns = [description[0] for description in cursor.description]
+
+        while True:
+            rows = cursor.fetchmany(IOT_SHARD_FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                device = dict(zip(columns, row))
+                final_status, last_downtime = next_status(device, latest_time)
+                if final_status == device["IoTStatus"]:
+                    unchanged += 1
+                else:
+                    changes.append((device, final_status, last_downtime))
+
+    if changes:
+        with db_connection() as connection, connection.cursor() as cursor:
+            connection.begin()
+
+            # Lock the changed devices and skip any whose status was edited since they were read
+            placeholders = ", ".join(["%s"] * len(changes))
+            cursor.execute(f"SELECT id, IoTStatus FROM IoTDevicesTest WHERE id IN ({placeholders}) FOR UPDATE",
+                           [device["id"] for device, _, _ in changes])
+            current = {row["id"]: row["IoTStatus"] for row in cursor.fetchall()}
+            changes = [change for change in changes
+                       if change[0]["id"] in current and current[change[0]["id"]] == change[0]["IoTStatus"]]
+
+            logs = [(device["IoTType"], device["IoTSerialNumber"], final_status, latest_time, device["PlotID"], "system")
+                    for device, final_status, _ in changes]
+            updates = [(final_status, last_downtime, latest_time, device["id"])
+                       for device, final_status, last_downtime in changes]
+
+            for i in range(0, len(changes), IOT_SHARD_WRITE_CHUNK):
                 cursor.executemany("""
                     INSERT INTO IoTDeviceLogTest (IoTType, IoTSerialNumber, IoTStatus, Timestamp, PlotID, ChangedBy)
                     VALUES (%s, %s, %s, %s, %s, %s)
-                """, logs)
-
-            # Update IoTDevicesTest
-            cursor.executemany("""
-                UPDATE IoTDevicesTest
-                SET IoTStatus = %s, LastDowntime = %s, LastUpdated = %s
-                WHERE IoTSerialNumber = %s
-            """, updates)
+                """, logs[i:i + IOT_SHARD_WRITE_CHUNK])
+                cursor.executemany("""
+                    UPDATE IoTDevicesTest
+                    SET IoTStatus = %s, LastDowntime = %s, LastUpdated = %s
+                    WHERE id = %s
+                """, updates[i:i + IOT_SHARD_WRITE_CHUNK])
 
             connection.commit()
 
-        return {"message": "IoT statuses updated successfully."}
+    shadows = publish_status_changes([{"IoTSerialNumber": device["IoTSerialNumber"], "IoTStatus": final_status,
+                                       "PlotID": device["PlotID"]} for device, final_status, _ in changes])
+    return {"changed": len(changes), "unchanged": unchanged, "published": shadows["published"]}
+
+
+@device_routes.schedule(Rate(1, unit=Rate.DAYS))
+def scheduled_device_uptime(event):
+    """Scheduled event to materialize the last days of device uptime into DeviceDailyUptime."""
+    print("Running scheduled device uptime rollup...")
+    try:
+        with db_connection() as connection, db_stream_cursor() as log_cursor, db_stream_cursor() as interval_cursor:
+            count = refresh_daily_uptime(connection, log_cursor, interval_cursor, sgt_now().date())
+
+        print(f"Wrote {count} device uptime row(s)")
+        return {"message": "Device uptime updated successfully.", "rows": count}
     except Exception as e:
         print(f"Error: {str(e)}")
         return {"error": str(e)}
-    finally:
-        connection.close()
 
 
+@device_routes.schedule(Rate(1, unit=Rate.HOURS))
+def scheduled_device_log_compaction(event):
+    """Scheduled event to compact old IoTDeviceLogTest history into IoTDeviceIntervals."""
+    print("Running scheduled device log compaction...")
+    try:
+        with db_connection() as connection:
+            result = compact_device_log(connection, get_latest_30min_timestamp())
 
+        print(f"Compacted {result['entries']} log entries into {result['intervals']} interval(s), "
+              f"deleted {result['deleted']} log entries")
+        return {"message": "Device log compacted successfully.", **result}
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return {"error": str(e)}
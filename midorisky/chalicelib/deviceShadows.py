@@ -0,0 +1,92 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+# Shadow updates in flight at once, and how long one batch may keep retrying
+SHADOW_WORKERS = int(os.environ.get('SHADOW_WORKERS', 16))
+SHADOW_PUBLISH_SECONDS = int(os.environ.get('SHADOW_PUBLISH_SECONDS', 30))
+SHADOW_MAX_ATTEMPTS = 6
+# Backoff before retry n is a random delay up to SHADOW_BASE_DELAY * 2 ** n, capped at SHADOW_MAX_DELAY
+SHADOW_BASE_DELAY = 0.1
+SHADOW_MAX_DELAY = 5
+
+# iot-data errors worth retrying, anything else fails the update straight away
+RETRYABLE_ERRORS = {'ThrottlingException', 'ServiceUnavailableException', 'InternalFailureException'}
+
+# Retries are done here with jittered backoff bounded by the batch deadline, so botocore does not retry on its own
+iot_client = boto3.client(
+    'iot-data',
+    endpoint_url=f"https://{os.getenv('IOT_ENDPOINT')}",
+    config=Config(signature_version='v4', retries={'mode': 'standard', 'max_attempts': 1})
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=SHADOW_WORKERS, thread_name_prefix='shadow')
+    return _executor
+
+
+def shadow_payload(change):
+    """The desired state of a device's shadow, the shadow metadata records when each field changed."""
+    return json.dumps({'state': {'desired': {'IoTStatus': change['IoTStatus'], 'PlotID': change['PlotID']}}})
+
+
+def publish_shadow(client, change, deadline):
+    """
+    Update one device's shadow, returns None once it is updated or the error that made it give up.
+    Changes still queued for a worker at the deadline are not sent, they fail with DeadlineExceeded.
+    """
+    for attempt in range(SHADOW_MAX_ATTEMPTS):
+        if time.monotonic() >= deadline:
+            return 'DeadlineExceeded'
+        try:
+            client.update_thing_shadow(thingName=change['IoTSerialNumber'], payload=shadow_payload(change))
+            return None
+        except ClientError as e:
+            error = e.response.get('Error', {}).get('Code') or str(e)
+            if error not in RETRYABLE_ERRORS:
+                return error
+        except BotoCoreError as e:
+            return str(e)
+
+        delay = random.uniform(0, min(SHADOW_MAX_DELAY, SHADOW_BASE_DELAY * 2 ** attempt))
+        if attempt == SHADOW_MAX_ATTEMPTS - 1 or time.monotonic() + delay > deadline:
+            return error
+        time.sleep(delay)
+
+
+def publish_status_changes(changes, client=None, seconds=None):
+    """
+    Publish device status changes to the desired state of their shadows, SHADOW_WORKERS at a time.
+    Throttled updates are retried with backoff, nothing is sent later than SHADOW_PUBLISH_SECONDS (or seconds)
+    after the batch started.
+
+    :param changes: Dicts with IoTSerialNumber, IoTStatus and PlotID, the thing name is the serial number.
+    :param client: An iot-data client, or a stand-in with update_thing_shadow(thingName, payload).
+    :return: {"published": count, "failed": [{"IoTSerialNumber": ..., "error": ...}]}
+    """
+    if not changes:
+        return {'published': 0, 'failed': []}
+
+    client = client or iot_client
+    deadline = time.monotonic() + (SHADOW_PUBLISH_SECONDS if seconds is None else seconds)
+    errors = list(get_executor().map(lambda change: publish_shadow(client, change, deadline), changes))
+
+    failed = [{'IoTSerialNumber': change['IoTSerialNumber'], 'error': error}
+              for change, error in zip(changes, errors) if error]
+    if failed:
+        print(f"Failed to publish {len(failed)} of {len(changes)} device shadow update(s): {failed[:10]}")
+    return {'published': len(changes) - len(failed), 'failed': failed}
@@ -0,0 +1,278 @@
+import datetime
+import heapq
+import itertools
+import numpy as np
+from .deviceLog import RAW_LOG_FILTER
+
+# Every writer of IoTDeviceLogTest stamps it in Singapore local time (sgt_now), days are cut at local midnight
+SGT_OFFSET = datetime.timedelta(hours=8)
+UP, DOWN, UNKNOWN = 1, 0, -1
+
+# Devices are folded a batch at a time, whole devices of about this many log entries together
+UPTIME_BATCH_ROWS = 10000
+# Days recomputed by every scheduled run, so late log rows of the previous day are picked up
+UPTIME_REFRESH_DAYS = 2
+
+METRICS = ['UpSeconds', 'DownSeconds', 'DowntimeCount', 'Recoveries', 'RecoverySeconds']
+
+# The entry each device was in when the window starts, one query per log store. MAX() per serial is a loose scan of
+# the (IoTSerialNumber, time) index, an older carry-in entry from the other store only starts a run before the window.
+RAW_CARRY_IN_QUERY = f"""
+SELECT l.IoTSerialNumber, l.PlotID, l.IoTStatus, l.Timestamp
+FROM IoTDeviceLogTest l
+JOIN (SELECT IoTSerialNumber, MAX(Timestamp) AS Timestamp
+      FROM IoTDeviceLogTest
+      WHERE IoTSerialNumber IS NOT NULL AND Timestamp < %s AND {RAW_LOG_FILTER}
+      GROUP BY IoTSerialNumber) p
+  ON p.IoTSerialNumber = l.IoTSerialNumber AND p.Timestamp = l.Timestamp
+ORDER BY l.IoTSerialNumber, l.Timestamp
+"""
+
+INTERVAL_CARRY_IN_QUERY = """
+SELECT i.IoTSerialNumber, i.PlotID, i.IoTStatus, i.StartTime
+FROM IoTDeviceIntervals i
+JOIN (SELECT IoTSerialNumber, MAX(StartTime) AS StartTime
+      FROM IoTDeviceIntervals
+      WHERE StartTime < %s
+      GROUP BY IoTSerialNumber) p
+  ON p.IoTSerialNumber = i.IoTSerialNumber AND p.StartTime = i.StartTime
+ORDER BY i.IoTSerialNumber, i.StartTime
+"""
+
+# The entries of the window in (IoTSerialNumber, time) index order, compacted intervals read as the entries that
+# started them. read_device_log merges the two streams.
+RAW_WINDOW_QUERY = f"""
+SELECT IoTSerialNumber, PlotID, IoTStatus, Timestamp
+FROM IoTDeviceLogTest
+WHERE IoTSerialNumber IS NOT NULL AND Timestamp >= %s AND Timestamp < %s AND {RAW_LOG_FILTER}
+ORDER BY IoTSerialNumber, Timestamp
+"""
+
+INTERVAL_WINDOW_QUERY = """
+SELECT IoTSerialNumber, PlotID, IoTStatus, StartTime
+FROM IoTDeviceIntervals
+WHERE StartTime >= %s AND StartTime < %s
+ORDER BY IoTSerialNumber, StartTime
+"""
+
+
+def sgt_now():
+    """Get the current Singapore local time, the clock of IoTDeviceLogTest."""
+    return datetime.datetime.utcnow() + SGT_OFFSET
+
+
+def to_micros(value):
+    return np.datetime64(value, 'us').astype(np.int64)
+
+
+def day_start(day):
+    return datetime.datetime.combine(day, datetime.time())
+
+
+def read_device_log(log_cursor, interval_cursor, start, end):
+    """
+    Stream the log entries between start and end (exclusive), with each device's last entries before start,
+    as (IoTSerialNumber, PlotID, IoTStatus, time) tuples ordered by device and time.
+    Each store is streamed in index order on its own unbuffered cursor and the streams are merged as they are read,
+    only the carry-in entries (one per device and store) are held in memory.
+    """
+    log_cursor.execute(RAW_CARRY_IN_QUERY, (start,))
+    raw_carry_in = list(log_cursor.fetchall())
+    log_cursor.execute(INTERVAL_CARRY_IN_QUERY, (start,))
+    interval_carry_in = list(log_cursor.fetchall())
+
+    log_cursor.execute(RAW_WINDOW_QUERY, (start, end))
+    interval_cursor.execute(INTERVAL_WINDOW_QUERY, (start, end))
+    return heapq.merge(raw_carry_in, interval_carry_in, log_cursor, interval_cursor,
+                       key=lambda row: (row[0], row[3]))
+
+
+def device_log_batches(rows, batch_rows):
+    """Cut log entries ordered by device into lists of whole devices, of at least batch_rows entries but the last."""
+    batch = []
+    for _, device_rows in itertools.groupby(rows, key=lambda row: row[0]):
+        batch.extend(device_rows)
+        if len(batch) >= batch_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def device_log_arrays(rows):
+    """
+    Turn log entries ordered by device and time into arrays, devices are coded in the order they appear.
+
+    :return: (serials, plots, device codes, statuses, times in microseconds)
+    """
+    serials, plots, statuses, times = zip(*rows)
+    serials = np.array(serials, dtype=object)
+    new_device = np.ones(len(serials), dtype=bool)
+    new_device[1:] = serials[1:] != serials[:-1]
+    codes = np.cumsum(new_device) - 1
+
+    statuses = np.array([UNKNOWN if status is None else status for status in statuses], dtype=np.int64)
+    times = np.array(times, dtype='datetime64[us]').astype(np.int64)
+
+    # Each device's plot is the plot of its newest entry
+    last = np.append(np.flatnonzero(new_device)[1:] - 1, len(serials) - 1)
+    return serials[new_device], np.array(plots, dtype=object)[last], codes, statuses, times
+
+
+def state_intervals(codes, statuses, times, end):
+    """
+    Run-length encode a log sorted by device code and time into state intervals, in one vectorized pass.
+    A run starts at a device's first entry and at every status change, repeated statuses are folded in.
+    It lasts until the next run of the same device, the last run of a device lasts until end.
+
+    :return: (codes, statuses, starts, ends, next statuses), the next status is UNKNOWN for a device's last run
+    """
+    if not len(codes):
+        return codes, statuses, times, times, statuses
+
+    new_device = np.ones(len(codes), dtype=bool)
+    new_device[1:] = codes[1:] != codes[:-1]
+    new_run = new_device.copy()
+    new_run[1:] |= statuses[1:] != statuses[:-1]
+
+    index = np.flatnonzero(new_run)
+    run_codes, run_statuses, run_starts = codes[index], statuses[index], times[index]
+
+    last_of_device = np.append(run_codes[1:] != run_codes[:-1], True)
+    run_ends = np.append(run_starts[1:], end)
+    run_ends[last_of_device] = end
+    next_statuses = np.append(run_statuses[1:], UNKNOWN)
+    next_statuses[last_of_device] = UNKNOWN
+    return run_codes, run_statuses, run_starts, run_ends, next_statuses
+
+
+def window_metrics(runs, device_count, window_start, window_end):
+    """
+    Get every device's metrics over [window_start, window_end) from its state intervals.
+
+    A downtime is a down run starting in the window, a recovery is a down run followed by an up run within the
+    window and its RecoverySeconds is the whole length of that run.
+    :return: {metric: array indexed by device code}
+    """
+    codes, statuses, starts, ends, next_statuses = runs
+    seconds = (np.minimum(ends, window_end) - np.maximum(starts, window_start)).clip(0) / 1e6
+    down = statuses == DOWN
+    went_down = down & (starts >= window_start) & (starts < window_end)
+    recovered = down & (next_statuses == UP) & (ends > window_start) & (ends <= window_end)
+
+    def per_device(weights):
+        return np.bincount(codes, weights=weights, minlength=device_count)
+
+    return {
+        'UpSeconds': per_device(seconds * (statuses == UP)),
+        'DownSeconds': per_device(seconds * down),
+        'DowntimeCount': per_device(went_down).astype(np.int64),
+        'Recoveries': per_device(recovered).astype(np.int64),
+        'RecoverySeconds': per_device((ends - starts) / 1e6 * recovered)
+    }
+
+
+def compute_daily_uptime(log_cursor, interval_cursor, first_day, last_day, now):
+    """
+    Compute per device and day metrics for the Singapore days first_day to last_day inclusive, up to now.
+    The log is read once, a batch of devices at a time, and every day is cut from the same intervals.
+
+    :param log_cursor: An unbuffered tuple cursor for IoTDeviceLogTest, see db_stream_cursor.
+    :param interval_cursor: An unbuffered tuple cursor on another connection, for IoTDeviceIntervals.
+    :return: Rows of Date, IoTSerialNumber, PlotID and METRICS, for devices observed on the day.
+    """
+    start = day_start(first_day)
+    end = min(day_start(last_day + datetime.timedelta(days=1)), now)
+    if start >= end:
+        return []
+
+    rows = []
+    log = read_device_log(log_cursor, interval_cursor, start, end)
+    for batch in device_log_batches(log, UPTIME_BATCH_ROWS):
+        serials, plots, codes, statuses, times = device_log_arrays(batch)
+        runs = state_intervals(codes, statuses, times, to_micros(end))
+
+        day = first_day
+        while day <= last_day and day_start(day) < end:
+            window_start = to_micros(day_start(day))
+            window_end = min(to_micros(day_start(day + datetime.timedelta(days=1))), to_micros(end))
+            metrics = window_metrics(runs, len(serials), window_start, window_end)
+
+            observed = metrics['UpSeconds'] + metrics['DownSeconds'] + metrics['DowntimeCount'] > 0
+            for code in np.flatnonzero(observed):
+                row = {'Date': day, 'IoTSerialNumber': serials[code], 'PlotID': plots[code]}
+                row.update({metric: metrics[metric][code].item() for metric in METRICS})
+                rows.append(row)
+            day += datetime.timedelta(days=1)
+    return rows
+
+
+def refresh_daily_uptime(connection, log_cursor, interval_cursor, today):
+    """Recompute the DeviceDailyUptime rows of the UPTIME_REFRESH_DAYS days before today, returns the row count."""
+    first_day = today - datetime.timedelta(days=UPTIME_REFRESH_DAYS)
+    last_day = today - datetime.timedelta(days=1)
+    rows = compute_daily_uptime(log_cursor, interval_cursor, first_day, last_day, day_start(today))
+
+    with connection.cursor() as cursor:
+        connection.begin()
+        try:
+            cursor.execute("DELETE FROM DeviceDailyUptime WHERE Date >= %s AND Date <= %s", (first_day, last_day))
+            cursor.executemany(f"""
+            INSERT INTO DeviceDailyUptime (Date, IoTSerialNumber, PlotID, {', '.join(METRICS)})
+            VALUES (%s, %s, %s, {', '.join(['%s'] * len(METRICS))})
+            """, [[row['Date'], row['IoTSerialNumber'], row['PlotID']] + [row[m] for m in METRICS] for row in rows])
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+    return len(rows)
+
+
+def fetch_daily_uptime(connection, log_cursor, interval_cursor, first_day, last_day, now):
+    """
+    Get per device and day rows for the Singapore days first_day to last_day inclusive.
+    Days already in DeviceDailyUptime are read from it, the others (always including today) are computed live.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+        SELECT Date, IoTSerialNumber, PlotID, {', '.join(METRICS)}
+        FROM DeviceDailyUptime
+        WHERE Date >= %s AND Date <= %s AND Date < %s
+        """, (first_day, last_day, now.date()))
+        rows = list(cursor.fetchall())
+
+    materialized = {row['Date'] for row in rows}
+    missing = [first_day + datetime.timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    missing = [day for day in missing if day not in materialized]
+    if missing:
+        live = compute_daily_uptime(log_cursor, interval_cursor, missing[0], missing[-1], now)
+        rows.extend(row for row in live if row['Date'] not in materialized)
+    return rows
+
+
+def summarize_uptime(rows, group='device'):
+    """
+    Add up daily rows per device or per plot, with the uptime percentage of the observed time and the mean time
+    to recovery. Both are None when there is nothing to divide by.
+    """
+    key = 'IoTSerialNumber' if group == 'device' else 'PlotID'
+    totals = {}
+    for row in sorted(rows, key=lambda row: row['Date']):
+        total = totals.setdefault(row[key], {key: row[key], 'devices': set(), **{metric: 0 for metric in METRICS}})
+        # A device is reported in the plot of its latest day
+        total['PlotID'] = row['PlotID']
+        total['devices'].add(row['IoTSerialNumber'])
+        for metric in METRICS:
+            total[metric] += row[metric]
+
+    results = []
+    for total in totals.values():
+        devices = total.pop('devices')
+        if group == 'plot':
+            total['Devices'] = len(devices)
+        observed = total['UpSeconds'] + total['DownSeconds']
+        total['UptimePercent'] = round(100 * total['UpSeconds'] / observed, 3) if observed else None
+        total['MTTRSeconds'] = total['RecoverySeconds'] / total['Recoveries'] if total['Recoveries'] else None
+        results.append(total)
+
+    return sorted(results, key=lambda total: (total[key] is None, total[key] or ''))
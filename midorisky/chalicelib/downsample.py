@@ -0,0 +1,78 @@
+import numpy as np
+
+
+def lttb_indices(x, y, n):
+    """
+    Pick n indices of the series with largest-triangle-three-buckets.
+    The first and last points are always kept, every bucket in between keeps the point forming the
+    largest triangle with the previously kept point and the average of the next bucket.
+
+    :param x: Sorted 1-D float array of x values (e.g. epoch seconds).
+    :param y: 1-D float array of y values, same length as x.
+    :param n: Number of points to keep.
+    """
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+    if n < 3:
+        raise ValueError("LTTB needs at least 3 points")
+
+    # Bucket edges over the points between the first and the last
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    selected = np.empty(n, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+
+    # Averages of every bucket, used as the third vertex of the triangle
+    sums_x = np.add.reduceat(x[1:size - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:size - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, y[-1])
+
+    previous = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+
+        # Twice the triangle area, the constant factor does not change the argmax
+        areas = np.abs((x[previous] - avg_x[i + 1]) * (bucket_y - y[previous])
+                       - (x[previous] - bucket_x) * (avg_y[i + 1] - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+
+    return selected
+
+
+def bucket_aggregate(x, columns, n):
+    """
+    Split the x range into n equal width buckets and get the mean, min and max of every column in each.
+    Empty buckets are dropped.
+
+    :param x: Sorted 1-D float array of x values.
+    :param columns: Dict of column name to 1-D float array, same length as x.
+    :param n: Number of buckets.
+    :return: (bucket start x values, {column: (means, mins, maxes)})
+    """
+    if len(x) == 0:
+        return x, {name: (values, values, values) for name, values in columns.items()}
+
+    bounds = np.linspace(x[0], x[-1], n + 1)
+    starts = np.searchsorted(x, bounds[:-1], side='left')
+    starts[0] = 0
+
+    # reduceat needs strictly increasing offsets to skip empty buckets
+    non_empty = np.append(starts[1:], len(x)) > starts
+    offsets = starts[non_empty]
+    counts = np.diff(np.append(offsets, len(x)))
+
+    result = {}
+    for name, values in columns.items():
+        result[name] = (
+            np.add.reduceat(values, offsets) / counts,
+            np.minimum.reduceat(values, offsets),
+            np.maximum.reduceat(values, offsets)
+        )
+
+    return bounds[:-1][non_empty], result
@@ -0,0 +1,181 @@
+import csv
+import datetime
+import io
+import json
+import os
+import boto3
+from .connectHelper import db_cursor, db_stream_cursor
+from .weatherArchive import get_archived_months_between, merge_archived_rows
+
+EXPORT_BUCKET = os.environ.get('S3_BUCKET')
+EXPORT_PREFIX = 'exports/'
+
+# Size of every uploaded part but the last, S3 needs at least 5 MiB
+EXPORT_PART_SIZE = int(os.environ.get('EXPORT_PART_SIZE', 8 * 1024 * 1024))
+EXPORT_FETCH_SIZE = 5000
+EXPORT_URL_SECONDS = 3600
+
+# Open ended exports cover everything
+EXPORT_MIN_DATE = datetime.datetime(1970, 1, 1)
+EXPORT_MAX_DATE = datetime.datetime(9999, 1, 1)
+
+# Rows are streamed in the order of an index so the server never has to sort the whole table
+DATASETS = {
+    'weather': """
+    SELECT Timestamp, Windspeed, Temperature, Precipitation, Humidity
+    FROM WeatherData
+    WHERE Timestamp >= %s AND Timestamp < %s
+    ORDER BY Timestamp
+    """,
+    'device-logs': """
+    SELECT id, IoTType, IoTSerialNumber, IoTStatus, Timestamp, PlotID, ChangedBy
+    FROM IoTDeviceLogTest
+    WHERE Timestamp >= %s AND Timestamp < %s
+    ORDER BY id
+    """,
+    # Log history older than DEVICE_LOG_COMPACT_DAYS lives here, EndTime is null for a device's latest interval
+    'device-intervals': """
+    SELECT id, IoTType, IoTSerialNumber, IoTStatus, StartTime, EndTime, PlotID, ChangedBy
+    FROM IoTDeviceIntervals
+    WHERE StartTime >= %s AND StartTime < %s
+    ORDER BY id
+    """
+}
+
+s3 = boto3.client('s3')
+sqs = boto3.client('sqs')
+
+
+class S3MultipartWriter(object):
+    """Text file object that uploads to S3 in parts of exactly part_size bytes, holding at most one part in memory."""
+
+    def __init__(self, bucket, key, part_size=EXPORT_PART_SIZE):
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.parts = []
+        self.buffer = io.BytesIO()
+        self.upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, ContentType='text/csv')['UploadId']
+
+    def write(self, text):
+        self.buffer.write(text.encode('utf-8'))
+        if self.buffer.tell() >= self.part_size:
+            data = self.buffer.getvalue()
+            while len(data) >= self.part_size:
+                self._upload_part(data[:self.part_size])
+                data = data[self.part_size:]
+            self.buffer = io.BytesIO()
+            self.buffer.write(data)
+
+    def _upload_part(self, data):
+        number = len(self.parts) + 1
+        response = s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number,
+                                  Body=data)
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': number})
+
+    def close(self):
+        # The last part may be smaller, and an empty export still needs one part
+        if self.buffer.tell() or not self.parts:
+            self._upload_part(self.buffer.getvalue())
+        s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                     MultipartUpload={'Parts': self.parts})
+
+    def abort(self):
+        s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+def create_export_job(dataset, start, end, username):
+    """Record a queued export job and hand it to the export worker, returns the job id."""
+    with db_cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO ExportJobs (Dataset, FromDate, ToDate, RequestedBy) VALUES (%s, %s, %s, %s)",
+            (dataset, start, end, username)
+        )
+        job_id = cursor.lastrowid
+
+    sqs.send_message(
+        QueueUrl=os.environ.get('EXPORT_QUEUE_URL'),
+        MessageBody=json.dumps({'job_id': job_id})
+    )
+    return job_id
+
+
+def get_export_job(job_id):
+    """Get a job row, with a presigned download URL once it is done."""
+    with db_cursor() as cursor:
+        cursor.execute("""
+        SELECT id, Dataset, Status, FromDate, ToDate, RequestedBy, S3Key, RowCount, Attempts, Error, CreatedAt,
+               CompletedAt
+        FROM ExportJobs
+        WHERE id = %s
+        """, (job_id,))
+        job = cursor.fetchone()
+
+    if job and job['Status'] == 'done':
+        job['DownloadUrl'] = s3.generate_presigned_url(
+            'get_object', Params={'Bucket': EXPORT_BUCKET, 'Key': job['S3Key']}, ExpiresIn=EXPORT_URL_SECONDS
+        )
+    return job
+
+
+def run_export_job(job_id):
+    """
+    Stream a job's rows from an unbuffered cursor into a CSV multipart upload.
+    Jobs that already finished are skipped, so a redelivered message does not export twice.
+    """
+    with db_cursor() as cursor:
+        # Attempts always changes the row, so rowcount also counts a rerun of a job left 'running' by a timeout
+        cursor.execute("""
+        UPDATE ExportJobs SET Status = 'running', Attempts = Attempts + 1
+        WHERE id = %s AND Status IN ('queued', 'running')
+        """, (job_id,))
+        if not cursor.rowcount:
+            print(f"Export job {job_id} is not pending, skipping")
+            return None
+        cursor.execute("SELECT id, Dataset, FromDate, ToDate FROM ExportJobs WHERE id = %s", (job_id,))
+        job = cursor.fetchone()
+
+    start = job['FromDate'] or EXPORT_MIN_DATE
+    end = job['ToDate'] or EXPORT_MAX_DATE
+    key = f"{EXPORT_PREFIX}{job_id}/{job['Dataset']}.csv"
+    writer = S3MultipartWriter(EXPORT_BUCKET, key)
+
+    try:
+        # Weather months archived to S3 are part of the export too
+        archived_months = get_archived_months_between(start, end) if job['Dataset'] == 'weather' else []
+        with db_stream_cursor() as cursor:
+            cursor.execute(DATASETS[job['Dataset']], (start, end))
+            rows = merge_archived_rows(cursor, archived_months, start, end, None)
+            count = write_csv(writer, [description[0] for description in cursor.description], rows)
+        writer.close()
+    except Exception as e:
+        writer.abort()
+        with db_cursor() as cursor:
+            cursor.execute("UPDATE ExportJobs SET Status = 'failed', Error = %s, CompletedAt = NOW() WHERE id = %s",
+                           (str(e)[:1024], job_id))
+        print(f"Export job {job_id} failed: {e}")
+        return None
+
+    with db_cursor() as cursor:
+        cursor.execute("""
+        UPDATE ExportJobs SET Status = 'done', S3Key = %s, RowCount = %s, CompletedAt = NOW()
+        WHERE id = %s
+        """, (key, count, job_id))
+
+    print(f"Export job {job_id} wrote {count} row(s) to s3://{EXPORT_BUCKET}/{key}")
+    return count
+
+
+def write_csv(writer, columns, rows):
+    """Write a header and every row, fetched EXPORT_FETCH_SIZE at a time, returns the number of rows."""
+    csv_writer = csv.writer(writer)
+    csv_writer.writerow(columns)
+
+    count = 0
+    while True:
+        chunk = rows.fetchmany(EXPORT_FETCH_SIZE)
+        if not chunk:
+            break
+        csv_writer.writerows(chunk)
+        count += len(chunk)
+    return count
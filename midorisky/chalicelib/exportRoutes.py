@@ -0,0 +1,77 @@
+from chalice import Blueprint, Response, BadRequestError
+import json
+from .authorizers import admin_authorizer
+from .helpers import json_serial, get_datetime_param
+from .exportJobs import DATASETS, create_export_job, get_export_job
+
+export_routes = Blueprint(__name__)
+
+
+@export_routes.route('/staff/exports', methods=['POST'], authorizer=admin_authorizer, cors=True)
+def create_export():
+    """
+    Queue a CSV export of {"dataset": "weather" | "device-logs" | "device-intervals", "from": ..., "to": ...},
+    from and to are optional.
+    Poll /staff/exports/{id} for the download URL.
+    """
+    request = export_routes.current_request
+
+    try:
+        body = request.json_body or {}
+        if not isinstance(body, dict):
+            raise BadRequestError("Expected a JSON object.")
+
+        dataset = body.get('dataset')
+        if not isinstance(dataset, str) or dataset not in DATASETS:
+            raise BadRequestError("Parameter dataset must be one of " + ", ".join(DATASETS) + ".")
+
+        start = get_datetime_param(body, 'from', required=False)
+        end = get_datetime_param(body, 'to', required=False)
+        if start and end and start >= end:
+            raise BadRequestError("Parameter from must be before to.")
+
+        job_id = create_export_job(dataset, start, end, request.context['authorizer']['principalId'])
+
+        return Response(
+            body=json.dumps({'id': job_id, 'Status': 'queued'}),
+            status_code=202,
+            headers={'Content-Type': 'application/json'}
+        )
+
+    except BadRequestError as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=400,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+
+@export_routes.route('/staff/exports/{job_id}', methods=['GET'], authorizer=admin_authorizer, cors=True)
+def fetch_export(job_id):
+    """Get the status of an export job, with a presigned DownloadUrl once it is done."""
+    try:
+        job = get_export_job(job_id)
+        if not job:
+            return Response(
+                body=json.dumps({"error": "Export job not found"}),
+                status_code=404,
+                headers={'Content-Type': 'application/json'}
+            )
+
+        return Response(
+            body=json.dumps(job, default=json_serial),
+            status_code=200,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
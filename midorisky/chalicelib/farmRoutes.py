@@ -3,7 +3,7 @@ import boto3
 import json
 from .authorizers import farmer_authorizer
 import pymysql
-from .connectHelper import create_connection
+from .connectHelper import db_cursor
 
 farm_routes = Blueprint(__name__)
 
@@ -11,7 +11,7 @@ farm_routes = Blueprint(__name__)
 def get_farms():
     sql = "SELECT * FROM `Farms`"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor(readonly=True) as cursor:
         cursor.execute(sql)
         result = cursor.fetchall()
         return result
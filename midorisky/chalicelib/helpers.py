@@ -1,4 +1,6 @@
 from datetime import date, datetime
+import json
+from chalice import BadRequestError
 
 def json_serial(obj):
     """JSON serializer for objects not serializable by default json code"""
@@ -17,4 +19,96 @@ def json_serial(obj):
 
 
 
-    raise TypeError ("Type %s not serializable" % type(obj))
\ No newline at end of file
+    raise TypeError ("Type %s not serializable" % type(obj))
+
+
+def iter_json_array(rows, columns):
+    """Encode tuple rows as a JSON array of objects one row at a time"""
+    yield '['
+    for i, row in enumerate(rows):
+        yield (',' if i else '') + json.dumps(dict(zip(columns, row)), default=json_serial)
+    yield ']'
+
+
+def get_datetime_param(params, name, required=True):
+    """Parse an ISO 8601 date or datetime query string parameter, or the same string in a JSON body"""
+    value = (params or {}).get(name)
+    if value is None:
+        if required:
+            raise BadRequestError("Missing required parameter: " + name)
+        return None
+
+    # JSON bodies can hold numbers, lists or objects where a date string is expected
+    if not isinstance(value, str):
+        raise BadRequestError("Invalid date for parameter " + name + ": " + json.dumps(value))
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise BadRequestError("Invalid date for parameter " + name + ": " + value)
+
+
+def get_int_param(params, name, default=None, minimum=1, maximum=None):
+    """Parse a bounded integer query string parameter"""
+    value = (params or {}).get(name)
+    if value is None:
+        if default is None:
+            raise BadRequestError("Missing required parameter: " + name)
+        return default
+
+    try:
+        value = int(value)
+    except ValueError:
+        raise BadRequestError("Invalid integer for parameter " + name + ": " + value)
+
+    if value < minimum:
+        raise BadRequestError(f"Parameter {name} must be at least {minimum}")
+    if maximum is not None and value > maximum:
+        raise BadRequestError(f"Parameter {name} must be at most {maximum}")
+    return value
+
+
+def get_format_param(params):
+    """Get the ?format= of a series response, rows (the default) or columnar"""
+    value = (params or {}).get('format', 'rows')
+    if value not in ('rows', 'columnar'):
+        raise BadRequestError("Parameter format must be rows or columnar")
+    return value
+
+
+def cursor_to_columnar(cursor):
+    """Read a tuple cursor into {"columns": [...], "data": {column: [values]}} without building row dicts"""
+    columns = [description[0] for description in cursor.description]
+    data = {column: [] for column in columns}
+    appends = [data[column].append for column in columns]
+
+    for row in cursor:
+        for append, value in zip(appends, row):
+            append(value)
+
+    return {'columns': columns, 'data': data}
+
+
+def rows_to_columnar(rows, columns):
+    """Turn a list of row dicts into {"columns": [...], "data": {column: [values]}}"""
+    return {'columns': columns, 'data': {column: [row.get(column) for row in rows] for column in columns}}
+
+
+def concat_columnar(*results):
+    """Stack {"columns", "data"} results in order, a column missing from one of them is None on its rows"""
+    columns = []
+    for result in results:
+        columns.extend(column for column in result['columns'] if column not in columns)
+
+    data = {column: [] for column in columns}
+    for result in results:
+        length = columnar_length(result)
+        for column in columns:
+            data[column].extend(result['data'].get(column, [None] * length))
+
+    return {'columns': columns, 'data': data}
+
+
+def columnar_length(result):
+    """Number of rows in a {"columns", "data"} result"""
+    return len(result['data'][result['columns'][0]]) if result['columns'] else 0
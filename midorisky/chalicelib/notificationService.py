@@ -1,7 +1,7 @@
 from chalice import Blueprint, BadRequestError, WebsocketDisconnectedError
 import json
 import os
-from .connectHelper import create_connection
+from .connectHelper import db_cursor, db_connection
 from .authorizers import login_authorizer
 from .helpers import json_serial
 from .wsService import Sender
@@ -13,6 +13,58 @@ ses = boto3.client('ses')
 sqs = boto3.client('sqs')
 cognito_idp = boto3.client('cognito-idp')
 
+# Devices already alerted are only alerted again after this many hours, 0 alerts once per downtime
+SPOILT_RENOTIFY_HOURS = float(os.environ.get('SPOILT_RENOTIFY_HOURS', 24))
+
+# Range scan on idx_iotdevicestest_status_downtime plus a primary key lookup per spoilt device.
+# A device is due when it has no alert for its current downtime yet, or its alert is older than the re-notify interval.
+SPOILT_DEVICES_QUERY = """
+SELECT d.PlotID, COUNT(*) AS count, SUM({due}) AS due
+FROM IoTDevicesTest d
+LEFT JOIN SpoiltDeviceAlerts a ON a.DeviceID = d.id
+WHERE d.IoTStatus = 0 AND d.LastDowntime <= NOW() - INTERVAL 2 HOUR
+GROUP BY d.PlotID
+"""
+
+# The devices due for an alert, locked until their alerts are recorded
+DUE_DEVICES_QUERY = """
+SELECT d.id
+FROM IoTDevicesTest d
+LEFT JOIN SpoiltDeviceAlerts a ON a.DeviceID = d.id
+WHERE d.IoTStatus = 0 AND d.LastDowntime <= NOW() - INTERVAL 2 HOUR AND {due}
+FOR UPDATE
+"""
+
+# The derived table names the new row, VALUES() in ON DUPLICATE KEY UPDATE is deprecated since MySQL 8.0.20
+RECORD_ALERTS_QUERY = """
+INSERT INTO SpoiltDeviceAlerts (DeviceID, LastDowntime, AlertedAt)
+SELECT * FROM (
+    SELECT id AS DeviceID, LastDowntime, %s AS AlertedAt
+    FROM IoTDevicesTest
+    WHERE id IN ({ids})
+) AS new
+ON DUPLICATE KEY UPDATE LastDowntime = new.LastDowntime, AlertedAt = new.AlertedAt
+"""
+
+# Takes back the alerts of a run whose message was not sent, a newer alert of the same device is kept
+FORGET_ALERTS_QUERY = """
+DELETE FROM SpoiltDeviceAlerts
+WHERE DeviceID IN ({ids}) AND AlertedAt = %s
+"""
+
+# Alerts of devices that came back up or were deleted
+CLEAR_ALERTS_QUERY = """
+DELETE FROM SpoiltDeviceAlerts
+WHERE DeviceID NOT IN (SELECT id FROM IoTDevicesTest WHERE IoTStatus = 0)
+"""
+
+
+def spoilt_due_condition():
+    condition = "a.DeviceID IS NULL OR NOT (a.LastDowntime <=> d.LastDowntime)"
+    if SPOILT_RENOTIFY_HOURS > 0:
+        condition += f" OR a.AlertedAt <= NOW() - INTERVAL {int(SPOILT_RENOTIFY_HOURS * 60)} MINUTE"
+    return f"({condition})"
+
 
 def create_notification(itemType, id, actionType):
     # Create SQS message
@@ -35,7 +87,7 @@ def get_notifications():
     username  = notification_service.current_request.context['authorizer']['principalId']
     sql = "SELECT id, username, title, subtitle, action_url, action FROM Notifications WHERE username = %s AND is_read = false ORDER BY created_at DESC"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor(readonly=True) as cursor:
         cursor.execute(sql, (username))
         result = cursor.fetchall()
         return result
@@ -45,7 +97,7 @@ def read_all_notifications():
     username  = notification_service.current_request.context['authorizer']['principalId']
     sql = "UPDATE Notifications SET is_read = 1 WHERE username = %s"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         cursor.execute(sql, (username))
         return
 
@@ -54,44 +106,66 @@ def read_notification(id):
     username  = notification_service.current_request.context['authorizer']['principalId']
     sql = "UPDATE Notifications SET is_read = 1 WHERE id = %s AND username = %s"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         cursor.execute(sql, (id, username))
         return
 
 
 @notification_service.schedule(Rate(2, unit=Rate.HOURS))
 def check_spoilt_devices(event):
-    # Count devices that have been spoilt for more than 2 hours
-
-    query = """
-    SELECT id
-    FROM IoTDevicesTest
-    WHERE IoTStatus = 0 AND TIMESTAMPDIFF(HOUR, LastDowntime, NOW()) >= 2
-    """
+    # Count devices that have been spoilt for more than 2 hours, per plot, and alert only for the ones that are due
+    due = spoilt_due_condition()
+    device_ids = []
 
     try:
-        connection = create_connection()
-        with connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchall()
-
-            # Count the number of spoilt devices
-            spoilt_count = len(result)
-
-            if spoilt_count > 0:
-                qMessage = {
-                    'type': "device",
-                    'count': spoilt_count
-                }
-
-                print(qMessage)
-
-                # Send SQS message
+        with db_connection() as connection, connection.cursor() as cursor:
+            connection.begin()
+            cursor.execute(CLEAR_ALERTS_QUERY)
+            cursor.execute(SPOILT_DEVICES_QUERY.format(due=due))
+            rows = cursor.fetchall()
+
+            plots = {row['PlotID'] or 'Unassigned': row['count'] for row in rows}
+            spoilt_count = sum(plots.values())
+            due_count = sum(int(row['due'] or 0) for row in rows)
+
+            print(f"{spoilt_count} spoilt device(s), {due_count} due for an alert")
+
+            if due_count > 0:
+                # The recorded devices are kept, so their alerts can be taken back if the message is not sent
+                cursor.execute("SELECT NOW() AS now")
+                alerted_at = cursor.fetchone()['now']
+                cursor.execute(DUE_DEVICES_QUERY.format(due=due))
+                device_ids = [row['id'] for row in cursor.fetchall()]
+            if device_ids:
+                ids = ", ".join(["%s"] * len(device_ids))
+                cursor.execute(RECORD_ALERTS_QUERY.format(ids=ids), [alerted_at] + device_ids)
+
+            # Committed before the message is sent, so no lock is held while waiting on SQS
+            connection.commit()
+
+        if due_count > 0:
+            qMessage = {
+                'type': "device",
+                'count': spoilt_count,
+                'new': due_count,
+                'plots': plots
+            }
+
+            print(qMessage)
+
+            try:
                 response = sqs.send_message(
                     QueueUrl=os.environ.get('SQS_URL'),
                     MessageBody=json.dumps(qMessage)
                 )
+            except Exception:
+                # Forget this run's alerts so the devices are due again on the next run
+                if device_ids:
+                    with db_cursor() as cursor:
+                        cursor.execute(FORGET_ALERTS_QUERY.format(ids=", ".join(["%s"] * len(device_ids))),
+                                       device_ids + [alerted_at])
+                raise
         return
     except Exception as e:
         print(e)
-        return
\ No newline at end of file
+        return
@@ -0,0 +1,110 @@
+import json
+import os
+import re
+import threading
+import time
+from pymysql.cursors import DictCursor, SSCursor
+
+# Statements slower than this are logged one by one
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+
+_COMMENT_RE = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACE_RE = re.compile(r'\s+')
+
+# A Lambda container serves one event at a time, but queries may run on worker threads
+_lock = threading.Lock()
+_request = {'queries': 0, 'db_ms': 0.0, 'rows': 0}
+
+
+def normalize_sql(sql):
+    """Strip comments and literals so the same statement always logs the same text."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+
+    sql = _COMMENT_RE.sub(' ', sql)
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+def record_query(sql, elapsed_ms, rows):
+    """Add a query to the current request totals and log it when it is slow."""
+    with _lock:
+        _request['queries'] += 1
+        _request['db_ms'] += elapsed_ms
+        if rows > 0:
+            _request['rows'] += rows
+
+    if elapsed_ms >= SLOW_QUERY_MS:
+        print(json.dumps({
+            'type': 'slow_query',
+            'sql': normalize_sql(sql),
+            'ms': round(elapsed_ms, 2),
+            'rows': rows
+        }))
+
+
+def start_request():
+    """Reset the per-request totals."""
+    with _lock:
+        _request.update(queries=0, db_ms=0.0, rows=0)
+
+
+def end_request(route):
+    """Log the query count and total DB time of the request that just finished."""
+    with _lock:
+        summary = dict(_request)
+
+    if summary['queries']:
+        print(json.dumps({
+            'type': 'request_db_summary',
+            'route': route,
+            'queries': summary['queries'],
+            'db_ms': round(summary['db_ms'], 2),
+            'rows': summary['rows']
+        }))
+
+    return summary
+
+
+class InstrumentedCursorMixin(object):
+    """Times every execute/executemany call made through the cursor."""
+
+    _batching = False
+
+    def execute(self, query, args=None):
+        # executemany is timed as a whole, skip the execute calls it makes internally
+        if self._batching:
+            return super().execute(query, args)
+
+        start = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            record_query(query, (time.perf_counter() - start) * 1000, self._metrics_rowcount())
+
+    def executemany(self, query, args):
+        start = time.perf_counter()
+        self._batching = True
+        try:
+            return super().executemany(query, args)
+        finally:
+            self._batching = False
+            record_query(query, (time.perf_counter() - start) * 1000, self._metrics_rowcount())
+
+    def _metrics_rowcount(self):
+        return self.rowcount
+
+
+class InstrumentedCursor(InstrumentedCursorMixin, DictCursor):
+    """DictCursor that reports to the slow query log and per-request totals."""
+
+
+class InstrumentedSSCursor(InstrumentedCursorMixin, SSCursor):
+    """Unbuffered tuple cursor, rows are streamed from the server as they are fetched."""
+
+    def _metrics_rowcount(self):
+        # Unknown until the result has been read, execute only times the first round trip
+        return -1
@@ -1,7 +1,7 @@
 from chalice import Blueprint, BadRequestError, ForbiddenError, Response
 import boto3
 from .authorizers import farmer_authorizer, farm_manager_authorizer
-from .connectHelper import create_connection
+from .connectHelper import db_cursor
 from .notificationService import create_notification
 import json
 import os
@@ -26,7 +26,7 @@ def create_task():
     sql = "INSERT INTO Tasks (title, description, priority, created_by) VALUES (%s, %s, %s, %s)"
     assigneeSql = "INSERT INTO TasksAssignees (taskId, username) VALUES (%s, %s)"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         cursor.execute(sql, (title, description, priority, task_routes.current_request.context['authorizer']['principalId']))
 
         # get the last inserted item
@@ -81,7 +81,7 @@ def get_all_tasks(display):
             LIMIT 3;
         """
 
-    with create_connection().cursor() as cursor:
+    with db_cursor(readonly=True) as cursor:
         if display == 'my' or display == 'outstanding':
             cursor.execute(sql, task_routes.current_request.context['authorizer']['principalId'])
         else:
@@ -95,7 +95,7 @@ def get_all_tasks(display):
 def get_task_comments(id):
     sql = "SELECT * FROM TaskComments WHERE taskId = %s"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor(readonly=True) as cursor:
         cursor.execute(sql, id)
         result = cursor.fetchall()
         return json.loads(json.dumps(result, default=str))
@@ -109,7 +109,7 @@ def create_task_comment(id):
     comment = body["comment"]
     sql = "INSERT INTO TaskComments (taskId, comment, username) VALUES (%s, %s, %s)"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         cursor.execute(sql, (id, comment, task_routes.current_request.context['authorizer']['principalId']))
 
         # get the last inserted item
@@ -125,7 +125,7 @@ def delete_task_comment(id, commentId):
     sql = "DELETE FROM TaskComments WHERE id = %s AND taskId = %s"
 
     try:
-        with create_connection().cursor() as cursor:
+        with db_cursor() as cursor:
             cursor.execute(sql, commentId)
             return {"message": "Comment deleted successfully!"}
     except Exception as e:
@@ -143,7 +143,7 @@ def edit_task_comment(id, commentId):
     sql = "UPDATE TaskComments SET comment = %s WHERE id = %s"
 
 
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         cursor.execute(getSql, commentId)
 
         # check if the comment author is the same as the current user
@@ -163,7 +163,7 @@ def get_task(id):
     sql = "SELECT t.id, t.title, t.description, t.created_at, t.updated_at, t.created_by, t.status, t.priority, t.hidden, count(ta.id) as users_assigned FROM Tasks as t LEFT JOIN TasksAssignees AS ta ON t.id = ta.taskId WHERE t.id = %s GROUP BY t.id, t.title, t.description, t.created_at, t.updated_at, t.created_by, t.status"
     assignee_sql = "SELECT username, email FROM TasksAssignees WHERE taskId = %s"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor(readonly=True) as cursor:
         cursor.execute(sql, id)
         taskResult = cursor.fetchone()
 
@@ -177,7 +177,7 @@ def get_task(id):
 def delete_task(id):
     sql = "DELETE FROM Tasks WHERE id = %s"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         cursor.execute(sql, id)
 
         # delete the attachments
@@ -216,7 +216,7 @@ def edit_task(id):
     getSql = "SELECT * FROM Tasks WHERE id = %s"
 
     try:
-        with create_connection().cursor() as cursor:
+        with db_cursor() as cursor:
             cursor.execute(sql, params)
             cursor.execute(getSql, id)
             task = cursor.fetchone()
@@ -229,7 +229,7 @@ def edit_task(id):
 def hide_task(id):
     sql = "UPDATE Tasks SET hidden = 1 WHERE id = %s"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         cursor.execute(sql, id)
         return {"message": "Task hidden successfully!"}
 
@@ -245,7 +245,7 @@ def update_task_status(id):
     # Check if the user is assigned to the task or if the user is the creator of the task
     check_sql = "SELECT * FROM TasksAssignees WHERE taskId = %s AND username = %s"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         cursor.execute(check_sql, (id, task_routes.current_request.context['authorizer']['principalId']))
         result = cursor.fetchone()
 
@@ -261,7 +261,7 @@ def update_task_status(id):
 def get_task_assignees(id):
     sql = "SELECT username FROM TasksAssignees WHERE taskId = %s"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor(readonly=True) as cursor:
         cursor.execute(sql, id)
         result = cursor.fetchall()
 
@@ -280,7 +280,7 @@ def set_task_assignees(id):
     delete_sql = "DELETE FROM TasksAssignees WHERE taskId = %s"
     sql = "INSERT INTO TasksAssignees (taskId, username) VALUES (%s, %s)"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         cursor.execute(delete_sql, id)
         for assignee in assignees:
             cursor.execute(sql, (id, assignee))
@@ -325,7 +325,7 @@ def delete_task_attachment(id, filename):
 
     sql = "DELETE FROM taskAttachments WHERE taskId = %s AND filename = %s"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         cursor.execute(sql, (id, filename))
 
     return {'message': 'File deleted successfully'}
@@ -360,7 +360,7 @@ def upload_task_attachment(id):
 
     sql = "INSERT INTO taskAttachments (taskId, filename) VALUES (%s, %s)"
 
-    with create_connection().cursor() as cursor:
+    with db_cursor() as cursor:
         cursor.execute(sql, (id, filename))
 
     return {'message': 'File uploaded successfully'}
@@ -0,0 +1,323 @@
+import csv
+import io
+import json
+import os
+import tempfile
+import boto3
+import numpy as np
+from .connectHelper import db_connection
+
+# Columns accepted for each telemetry table, in insert order, and how they are validated
+TELEMETRY_TABLES = {
+    'WeatherData': {
+        'Timestamp': 'timestamp',
+        'Windspeed': (0, 200),
+        'Temperature': (-50, 70),
+        'Precipitation': (0, 1000),
+        'Humidity': (0, 100)
+    },
+    'WeatherIoT': {
+        'Timestamp': 'timestamp',
+        'PlotID': 10,
+        'IoTSerialNumber': 20,
+        'Windspeed': (0, 200),
+        'Temperature': (-50, 70),
+        'Precipitation': (0, 1000),
+        'Humidity': (0, 100)
+    },
+    'SoilMoistureIoT': {
+        'Timestamp': 'timestamp',
+        'PlotID': 10,
+        'IoTSerialNumber': 20,
+        'SoilMoisture': (0, 100)
+    }
+}
+
+# Rows per multi-row INSERT
+INSERT_CHUNK_SIZE = int(os.environ.get('TELEMETRY_INSERT_CHUNK_SIZE', 1000))
+
+# Use LOAD DATA LOCAL INFILE instead of INSERTs, the server must allow local_infile
+USE_LOAD_DATA = os.environ.get('TELEMETRY_LOAD_DATA') == '1'
+
+# Errors returned per request, the counts are always complete
+MAX_REPORTED_ERRORS = 100
+
+
+sqs = boto3.client('sqs')
+
+# DeleteMessageBatch takes at most 10 entries
+SQS_DELETE_BATCH_SIZE = 10
+
+
+class TelemetryError(ValueError):
+    pass
+
+
+class TelemetryBatchError(Exception):
+    """Raised by the queue consumer so Lambda leaves the failed messages on the queue."""
+
+
+def parse_ndjson(body, table):
+    """Parse one JSON object per line into a dict of column name to list of raw values."""
+    records = []
+    errors = []
+    for line_number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            records.append((line_number, json.loads(line)))
+        except ValueError as e:
+            errors.append({'line': line_number, 'error': "Invalid JSON: " + str(e)})
+
+    return records_to_columns(records, table, errors)
+
+
+def parse_json_array(body, table):
+    """Parse a JSON array of objects into a dict of column name to list of raw values, lines are element numbers."""
+    try:
+        records = json.loads(body or '[]')
+    except ValueError as e:
+        raise TelemetryError("Invalid JSON: " + str(e))
+    if not isinstance(records, list):
+        raise TelemetryError("Expected a JSON array of readings")
+
+    return records_to_columns(enumerate(records, start=1), table, [])
+
+
+def records_to_columns(records, table, errors):
+    """Gather (line number, record) pairs into columns, adding an error for every record that is not an object."""
+    columns = {name: [] for name in TELEMETRY_TABLES[table]}
+    columns['_line'] = []
+
+    for line_number, record in records:
+        if not isinstance(record, dict):
+            errors.append({'line': line_number, 'error': "Invalid JSON: not an object"})
+            continue
+
+        for name in TELEMETRY_TABLES[table]:
+            columns[name].append(record.get(name))
+        columns['_line'].append(line_number)
+
+    errors.sort(key=lambda error: error['line'])
+    return columns, errors
+
+
+def parse_csv(body, table):
+    """Parse a CSV with a header row into a dict of column name to list of raw values."""
+    reader = csv.reader(io.StringIO(body))
+    header = next(reader, None)
+    if header is None:
+        return {name: [] for name in TELEMETRY_TABLES[table]}, []
+
+    header = [name.strip() for name in header]
+    missing = [name for name in TELEMETRY_TABLES[table] if name not in header]
+    if missing:
+        raise TelemetryError("Missing CSV columns: " + ", ".join(missing))
+
+    positions = [header.index(name) for name in TELEMETRY_TABLES[table]]
+    columns = {name: [] for name in TELEMETRY_TABLES[table]}
+    columns['_line'] = []
+    errors = []
+
+    for line_number, row in enumerate(reader, start=2):
+        if not row:
+            continue
+        if len(row) < len(header):
+            errors.append({'line': line_number, 'error': "Expected %d fields, got %d" % (len(header), len(row))})
+            continue
+
+        for name, position in zip(TELEMETRY_TABLES[table], positions):
+            columns[name].append(row[position])
+        columns['_line'].append(line_number)
+
+    return columns, errors
+
+
+def _to_array(values, dtype):
+    """Convert a list to a typed array in one pass, falling back to per-value conversion to find bad values."""
+    try:
+        return np.array(values, dtype=dtype), np.ones(len(values), dtype=bool)
+    except (ValueError, TypeError):
+        pass
+
+    array = np.empty(len(values), dtype=dtype)
+    valid = np.ones(len(values), dtype=bool)
+    for i, value in enumerate(values):
+        try:
+            array[i] = np.array(value, dtype=dtype)
+        except (ValueError, TypeError):
+            valid[i] = False
+    return array, valid
+
+
+def validate(table, columns):
+    """
+    Validate every column with array operations.
+
+    :return: (rows ready to insert, list of {'line', 'error'} for rejected records)
+    """
+    spec = TELEMETRY_TABLES[table]
+    lines = np.array(columns.get('_line', []), dtype=np.int64)
+    valid = np.ones(len(lines), dtype=bool)
+    reasons = np.full(len(lines), '', dtype=object)
+    converted = {}
+
+    def reject(mask, reason):
+        mask = mask & valid
+        reasons[mask] = reason
+        valid[mask] = False
+
+    for name, rule in spec.items():
+        values = columns[name]
+        missing = np.array([value is None or value == '' for value in values], dtype=bool)
+        reject(missing, "Missing " + name)
+
+        if rule == 'timestamp':
+            # Only ISO 8601 strings, numbers would be read as microseconds since the epoch
+            array, ok = _to_array([value if isinstance(value, str) and value else 'NaT' for value in values],
+                                  'datetime64[us]')
+            reject(~ok | np.isnat(array), "Invalid " + name)
+        elif isinstance(rule, tuple):
+            array, ok = _to_array([value if value not in (None, '') else 'nan' for value in values], np.float64)
+            reject(~ok | ~np.isfinite(array), "Invalid " + name)
+            reject(np.isfinite(array) & ((array < rule[0]) | (array > rule[1])),
+                   f"{name} out of range [{rule[0]}, {rule[1]}]")
+        else:
+            array = np.array([str(value).strip() if value is not None else '' for value in values], dtype=object)
+            reject(np.array([len(value) > rule for value in array], dtype=bool), f"{name} longer than {rule}")
+
+        converted[name] = array
+
+    accepted = np.flatnonzero(valid)
+    rows = list(zip(*[
+        converted[name][accepted].astype(object).tolist() if spec[name] == 'timestamp'
+        else converted[name][accepted].tolist()
+        for name in spec
+    ])) if len(accepted) else []
+
+    errors = [{'line': int(lines[i]), 'error': reasons[i]} for i in np.flatnonzero(~valid)]
+    return rows, errors
+
+
+def insert_rows(connection, table, rows):
+    """
+    Write validated rows inside one transaction.
+    Uses chunked multi-row INSERTs, or LOAD DATA LOCAL INFILE when TELEMETRY_LOAD_DATA is set.
+    """
+    names = list(TELEMETRY_TABLES[table])
+    if not rows:
+        return 0
+
+    with connection.cursor() as cursor:
+        connection.begin()
+        try:
+            if USE_LOAD_DATA:
+                _load_data(cursor, table, names, rows)
+            else:
+                # PyMySQL rewrites executemany on INSERT ... VALUES into multi-row INSERTs
+                query = "INSERT INTO {} ({}) VALUES ({})".format(table, ", ".join(names), ", ".join(["%s"] * len(names)))
+                for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+                    cursor.executemany(query, rows[start:start + INSERT_CHUNK_SIZE])
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+    return len(rows)
+
+
+def _load_data(cursor, table, names, rows):
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False) as f:
+        csv.writer(f).writerows(rows)
+        path = f.name
+
+    try:
+        cursor.execute(
+            "LOAD DATA LOCAL INFILE %s INTO TABLE {} FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+            "LINES TERMINATED BY '\\r\\n' ({})".format(table, ", ".join(names)),
+            (path,)
+        )
+    finally:
+        os.remove(path)
+
+
+def ingest_messages(messages):
+    """
+    Write the readings of a batch of queue messages, grouped by table with one transaction per table.
+    A message is {"table": ..., "readings": [...]} or a single reading with a "table" key.
+    Messages are all or nothing, so a retried message never duplicates readings that were already written.
+
+    :param messages: List of (message id, body).
+    :return: Ids of the messages that were not written and should be retried.
+    """
+    failed = {}
+    groups = {}
+
+    for message_id, body in messages:
+        try:
+            message = json.loads(body)
+            table = message['table']
+            if table not in TELEMETRY_TABLES:
+                raise TelemetryError("Unknown telemetry table " + str(table))
+            readings = message.get('readings', [message])
+            if not isinstance(readings, list) or not all(isinstance(reading, dict) for reading in readings):
+                raise TelemetryError("readings must be a list of objects")
+        except (ValueError, KeyError, TypeError) as e:
+            failed[message_id] = "Invalid message: " + str(e)
+            continue
+
+        # '_line' holds the position of each reading in owners, so rejected readings map back to their message
+        if table not in groups:
+            groups[table] = ({name: [] for name in list(TELEMETRY_TABLES[table]) + ['_line']}, [])
+        columns, owners = groups[table]
+        for reading in readings:
+            for name in TELEMETRY_TABLES[table]:
+                columns[name].append(reading.get(name))
+            columns['_line'].append(len(owners))
+            owners.append(message_id)
+
+    for table, (columns, owners) in groups.items():
+        rows, errors = validate(table, columns)
+        rejected = {error['line'] for error in errors}
+        for error in errors:
+            failed.setdefault(owners[error['line']], error['error'])
+
+        accepted = [position for position in columns['_line'] if position not in rejected]
+        rows = [row for position, row in zip(accepted, rows) if owners[position] not in failed]
+
+        try:
+            with db_connection() as connection:
+                insert_rows(connection, table, rows)
+        except Exception as e:
+            for message_id in owners:
+                failed.setdefault(message_id, f"Insert into {table} failed: {e}")
+
+    for message_id, error in failed.items():
+        print(json.dumps({'type': 'telemetry_failed', 'message_id': message_id, 'error': error}))
+
+    return list(failed)
+
+
+def queue_url(arn):
+    """Get the URL of an SQS queue from its ARN, arn:aws:sqs:region:account:name."""
+    _, _, _, region, account, name = arn.split(':')
+    return f"https://sqs.{region}.amazonaws.com/{account}/{name}"
+
+
+def delete_messages(records):
+    """
+    Delete SQS messages that were handled, before the invocation fails for the rest of the batch.
+    Lambda only deletes a batch whose invocation succeeds, so these are not received again.
+
+    :param records: SQS event records, each with messageId, receiptHandle and eventSourceARN.
+    """
+    for i in range(0, len(records), SQS_DELETE_BATCH_SIZE):
+        chunk = records[i:i + SQS_DELETE_BATCH_SIZE]
+        response = sqs.delete_message_batch(
+            QueueUrl=queue_url(chunk[0]['eventSourceARN']),
+            Entries=[{'Id': str(n), 'ReceiptHandle': record['receiptHandle']} for n, record in enumerate(chunk)]
+        )
+        for failure in response.get('Failed', []):
+            # The message comes back and is written again, there is nothing better to do with it here
+            print(json.dumps({'type': 'telemetry_delete_failed', 'message_id': chunk[int(failure['Id'])]['messageId'],
+                              'error': failure.get('Message')}))
@@ -0,0 +1,70 @@
+from chalice import Blueprint, Response, BadRequestError
+import json
+from .authorizers import admin_authorizer
+from .connectHelper import db_connection, create_connection
+from .telemetryHelper import (TELEMETRY_TABLES, USE_LOAD_DATA, MAX_REPORTED_ERRORS, TelemetryError, parse_ndjson,
+                              parse_json_array, parse_csv, validate, insert_rows)
+
+telemetry_routes = Blueprint(__name__)
+
+
+def ingest(table, body, content_type):
+    """Parse, validate and insert a telemetry batch, returns the summary sent back to the client."""
+    if table not in TELEMETRY_TABLES:
+        raise TelemetryError("Unknown telemetry table " + table)
+
+    if content_type.startswith('text/csv'):
+        columns, errors = parse_csv(body, table)
+    elif content_type.startswith('application/json'):
+        columns, errors = parse_json_array(body, table)
+    else:
+        columns, errors = parse_ndjson(body, table)
+
+    rows, invalid = validate(table, columns)
+    errors = sorted(errors + invalid, key=lambda error: error['line'])
+
+    if USE_LOAD_DATA:
+        # LOAD DATA LOCAL needs local_infile on the client, which pooled connections do not enable
+        connection = create_connection(local_infile=True)
+        try:
+            accepted = insert_rows(connection, table, rows)
+        finally:
+            connection.close()
+    else:
+        with db_connection() as connection:
+            accepted = insert_rows(connection, table, rows)
+
+    return {
+        'table': table,
+        'accepted': accepted,
+        'rejected': len(errors),
+        'errors': errors[:MAX_REPORTED_ERRORS]
+    }
+
+
+@telemetry_routes.route('/telemetry/{table}', methods=['POST'], authorizer=admin_authorizer, cors=True,
+                        content_types=['application/x-ndjson', 'application/json', 'text/csv'])
+def ingest_telemetry(table):
+    request = telemetry_routes.current_request
+
+    try:
+        body = (request.raw_body or b'').decode('utf-8-sig')
+        content_type = request.headers.get('content-type', 'application/x-ndjson')
+        return Response(
+            body=json.dumps(ingest(table, body, content_type)),
+            status_code=200,
+            headers={'Content-Type': 'application/json'}
+        )
+
+    except (TelemetryError, UnicodeDecodeError, BadRequestError) as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=400,
+            headers={'Content-Type': 'application/json'}
+        )
+    except Exception as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=500,
+            headers={'Content-Type': 'application/json'}
+        )
@@ -0,0 +1,248 @@
+import datetime
+import functools
+import heapq
+import io
+import itertools
+import os
+import time
+import boto3
+import numpy as np
+from .connectHelper import db_cursor
+from .queryMetrics import InstrumentedSSCursor
+
+# WeatherData is partitioned by month (p201901 holds January 2019), months older than the retention window
+# are moved to S3 as compressed NumPy column files. fetch_weather_data merges them back in, the daily endpoints read
+# WeatherDailyRollup, whose rows for archived days stay in place and are not recomputed.
+ARCHIVE_BUCKET = os.environ.get('S3_BUCKET')
+ARCHIVE_PREFIX = 'archive/WeatherData/'
+RETENTION_MONTHS = int(os.environ.get('WEATHER_RETENTION_MONTHS', 24))
+PARTITION_MONTHS_AHEAD = 3
+
+# Partitions archived per scheduled run, so a backlog does not hit the Lambda timeout
+ARCHIVE_BATCH = int(os.environ.get('WEATHER_ARCHIVE_BATCH', 3))
+ARCHIVE_FETCH_SIZE = 10000
+# Exports of one partition before giving up on dropping it this run, when readings keep arriving in it
+ARCHIVE_EXPORT_ATTEMPTS = 3
+
+# Seconds the partition list is kept per container, a partition dropped elsewhere is read from S3 after at most this
+PARTITIONS_TTL = float(os.environ.get('WEATHER_PARTITIONS_TTL', 60))
+
+# Archived months kept in memory, the files never change once written
+ARCHIVE_CACHE_MONTHS = 24
+
+COLUMNS = {
+    'id': np.int64,
+    'Timestamp': 'datetime64[us]',
+    'Windspeed': np.float64,
+    'Temperature': np.float64,
+    'Precipitation': np.float64,
+    'Humidity': np.float64
+}
+
+PARTITIONS_QUERY = """
+SELECT PARTITION_NAME AS name
+FROM information_schema.PARTITIONS
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'WeatherData' AND PARTITION_NAME IS NOT NULL
+ORDER BY PARTITION_ORDINAL_POSITION
+"""
+
+s3 = boto3.client('s3')
+# Archived months as listed from S3, the first partition they were listed against and when it was read
+_archive_state = {'first_partition': None, 'months': [], 'checked_at': 0}
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def partition_name(month):
+    return month.strftime('p%Y%m')
+
+
+def partition_definition(month):
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ('{add_months(month, 1).isoformat()}')"
+
+
+def archive_key(month):
+    return f"{ARCHIVE_PREFIX}{month:%Y-%m}.npz"
+
+
+def get_partition_months(cursor):
+    """Get the months of the monthly WeatherData partitions in order, empty when the table is not partitioned."""
+    cursor.execute(PARTITIONS_QUERY)
+    return [datetime.datetime.strptime(row['name'], 'p%Y%m').date() for row in cursor.fetchall()
+            if row['name'] != 'pmax']
+
+
+def ensure_partitions(connection, today):
+    """
+    Split pmax into monthly partitions up to PARTITION_MONTHS_AHEAD months after today.
+    The migration partitions the table just as far ahead, so pmax is normally empty.
+    """
+    with connection.cursor() as cursor:
+        months = get_partition_months(cursor)
+        if not months:
+            return []
+
+        target = add_months(month_start(today), PARTITION_MONTHS_AHEAD)
+        new_months = []
+        month = add_months(months[-1], 1)
+        while month <= target:
+            new_months.append(month)
+            month = add_months(month, 1)
+
+        if new_months:
+            # Cheap while pmax is empty, readings it already holds (after missed runs) are copied into the new months
+            definitions = ", ".join(partition_definition(month) for month in new_months)
+            cursor.execute(f"ALTER TABLE WeatherData REORGANIZE PARTITION pmax INTO "
+                           f"({definitions}, PARTITION pmax VALUES LESS THAN (MAXVALUE))")
+
+    return new_months
+
+
+def archive_partitions(connection, today):
+    """
+    Export partitions older than the retention window to S3, then drop them.
+    The newest partition is never archived, and the first partition also holds any readings older than its month,
+    so those are archived together with it.
+    """
+    cutoff = add_months(month_start(today), -RETENTION_MONTHS)
+    with connection.cursor() as cursor:
+        months = get_partition_months(cursor)
+
+    archived = []
+    for month in [month for month in months[:-1] if month < cutoff][:ARCHIVE_BATCH]:
+        # Only dropped once the file in S3 has every row, a reading that arrived during the export is exported again
+        for _ in range(ARCHIVE_EXPORT_ATTEMPTS):
+            rows = export_partition(connection, month)
+            if count_partition(connection, month) == rows:
+                break
+        else:
+            print(f"Readings are still arriving in WeatherData {month:%Y-%m}, not archiving it this run")
+            continue
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE WeatherData DROP PARTITION {partition_name(month)}")
+
+        print(f"Archived {rows} WeatherData row(s) of {month:%Y-%m} to s3://{ARCHIVE_BUCKET}/{archive_key(month)}")
+        archived.append(month)
+
+    if archived:
+        _archive_state['checked_at'] = 0
+    return archived
+
+
+def count_partition(connection, month):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) AS count FROM WeatherData PARTITION ({partition_name(month)})")
+        return cursor.fetchone()['count']
+
+
+def export_partition(connection, month):
+    """Stream one partition into a compressed column file in S3, returns the number of rows."""
+    chunks = {name: [] for name in COLUMNS}
+    with connection.cursor(InstrumentedSSCursor) as cursor:
+        cursor.execute(f"SELECT {', '.join(COLUMNS)} FROM WeatherData PARTITION ({partition_name(month)}) "
+                       f"ORDER BY Timestamp")
+        while True:
+            rows = cursor.fetchmany(ARCHIVE_FETCH_SIZE)
+            if not rows:
+                break
+            for i, (name, dtype) in enumerate(COLUMNS.items()):
+                chunks[name].append(np.array([row[i] for row in rows], dtype=dtype))
+
+    arrays = {name: np.concatenate(chunks[name]) if chunks[name] else np.array([], dtype=dtype)
+              for name, dtype in COLUMNS.items()}
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    s3.put_object(Bucket=ARCHIVE_BUCKET, Key=archive_key(month), Body=buffer.getvalue())
+    return len(arrays['id'])
+
+
+def get_archived_months():
+    """
+    Get the months whose rows are only in S3: archived and no longer partitions of WeatherData.
+    A month in both (between upload and drop) is still read from the database.
+
+    The partitions are read at most every PARTITIONS_TTL seconds. Months are uploaded before their partition is
+    dropped, so the S3 listing only needs refreshing when the first partition changes, in this container or any other.
+    """
+    if time.time() - _archive_state['checked_at'] < PARTITIONS_TTL:
+        return _archive_state['months']
+
+    with db_cursor(readonly=True) as cursor:
+        partitions = get_partition_months(cursor)
+    _archive_state['checked_at'] = time.time()
+    if not partitions:
+        _archive_state.update(first_partition=None, months=[])
+        return []
+
+    if _archive_state['first_partition'] != partitions[0]:
+        months = []
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=ARCHIVE_BUCKET, Prefix=ARCHIVE_PREFIX):
+            for item in page.get('Contents', []):
+                name = item['Key'][len(ARCHIVE_PREFIX):].split('.')[0]
+                month = datetime.datetime.strptime(name, '%Y-%m').date()
+                if month < partitions[0]:
+                    months.append(month)
+        _archive_state.update(first_partition=partitions[0], months=sorted(months))
+
+    return _archive_state['months']
+
+
+def get_archived_months_between(start, end):
+    """Archived months overlapping the UTC range [start, end)."""
+    return [month for month in get_archived_months()
+            if datetime.datetime.combine(month, datetime.time()) < end
+            and datetime.datetime.combine(add_months(month, 1), datetime.time()) > start]
+
+
+@functools.lru_cache(maxsize=ARCHIVE_CACHE_MONTHS)
+def load_archive(month):
+    body = s3.get_object(Bucket=ARCHIVE_BUCKET, Key=archive_key(month))['Body'].read()
+    with np.load(io.BytesIO(body)) as archive:
+        return {name: archive[name] for name in archive.files}
+
+
+def iter_archived_rows(months, start, end, columns):
+    """Yield tuples of `columns` (matched case-insensitively) from the archived months in Timestamp order."""
+    names = {name.lower(): name for name in COLUMNS}
+    for month in months:
+        archive = load_archive(month)
+        timestamps = archive['Timestamp']
+        order = np.argsort(timestamps, kind='stable')
+        timestamps = timestamps[order]
+        mask = (timestamps >= np.datetime64(start)) & (timestamps < np.datetime64(end))
+        yield from zip(*[archive[names[column.lower()]][order][mask].tolist() for column in columns])
+
+
+class ArchiveMergedCursor(object):
+    """
+    Read-only cursor over a WeatherData query with the rows of archived months merged in.
+    The first column must be the timestamp, both sources are merged in order and cut at `limit` rows.
+    """
+
+    def __init__(self, cursor, archived_rows, limit):
+        self.description = cursor.description
+        self._rows = itertools.islice(heapq.merge(archived_rows, cursor, key=lambda row: row[0]), limit)
+
+    def __iter__(self):
+        return self._rows
+
+    def fetchmany(self, size):
+        return list(itertools.islice(self._rows, size))
+
+
+def merge_archived_rows(cursor, months, start, end, limit):
+    """Return the executed tuple cursor itself when no archived month is involved, else an ArchiveMergedCursor."""
+    if not months:
+        return cursor
+
+    columns = [description[0] for description in cursor.description]
+    return ArchiveMergedCursor(cursor, iter_archived_rows(months, start, end, columns), limit)
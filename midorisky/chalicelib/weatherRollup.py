@@ -0,0 +1,173 @@
+import datetime
+
+# WeatherData timestamps are stored in UTC, days are rolled up in Singapore time
+SGT_OFFSET = datetime.timedelta(hours=8)
+ROLLUP_NAME = 'WeatherDailyRollup'
+# MAX(id) seen by the last run, the next run rolls up to it
+ROLLUP_PENDING_NAME = 'WeatherDailyRollupPending'
+METRICS = ['Temperature', 'Humidity', 'Precipitation', 'Windspeed']
+
+# Per metric the count of non-NULL readings, SUM, MIN and MAX are NULL when a day has none
+_AGGREGATES = ",\n           ".join(
+    f"COUNT({m}) AS {m}Count, SUM({m}) AS {m}Sum, MIN({m}) AS {m}Min, MAX({m}) AS {m}Max" for m in METRICS
+)
+_ROLLUP_COLUMNS = ", ".join(f"{m}Count, {m}Sum, {m}Min, {m}Max" for m in METRICS)
+
+# Readings the rollup has not picked up yet, bounded by the primary key and a UTC Timestamp range
+TAIL_QUERY = f"""
+SELECT DATE(Timestamp + INTERVAL 8 HOUR) AS Date,
+       COUNT(*) AS ReadingCount,
+       {_AGGREGATES},
+       MAX(Timestamp) AS LastTimestamp
+FROM WeatherData
+WHERE id > %s AND Timestamp >= %s AND Timestamp < %s
+GROUP BY DATE(Timestamp + INTERVAL 8 HOUR)
+"""
+
+
+def sgt_today():
+    """Get the current date in Singapore."""
+    return (datetime.datetime.utcnow() + SGT_OFFSET).date()
+
+
+def sgt_day_range(start_date, end_date):
+    """Get the UTC [start, end) datetimes covering the Singapore days start_date to end_date inclusive."""
+    start = datetime.datetime.combine(start_date, datetime.time()) - SGT_OFFSET
+    end = datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time()) - SGT_OFFSET
+    return start, end
+
+
+def get_watermark(cursor, name=ROLLUP_NAME):
+    cursor.execute("SELECT last_id FROM RollupWatermarks WHERE name = %s", (name,))
+    row = cursor.fetchone()
+    return row['last_id'] if row else 0
+
+
+def set_watermark(cursor, name, last_id):
+    cursor.execute("""
+    INSERT INTO RollupWatermarks (name, last_id) VALUES (%s, %s)
+    ON DUPLICATE KEY UPDATE last_id = VALUES(last_id)
+    """, (name, last_id))
+
+
+def day_runs(days):
+    """Group sorted days into (first, last) runs of consecutive days."""
+    runs = []
+    for day in days:
+        if runs and runs[-1][1] + datetime.timedelta(days=1) == day:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(run) for run in runs]
+
+
+def refresh_daily_rollup(connection):
+    """
+    Recompute the rollup rows of every day that received readings since the last run.
+
+    Ids are taken when a reading is inserted but become visible when its transaction commits, so a MAX(id) read now
+    can be ahead of readings still in flight. The watermark therefore only advances to the MAX(id) seen by the
+    previous run, an hour ago, and readers add every reading after it themselves.
+    """
+    with connection.cursor() as cursor:
+        connection.begin()
+        try:
+            last_id = get_watermark(cursor)
+            settled_id = get_watermark(cursor, ROLLUP_PENDING_NAME)
+
+            cursor.execute("SELECT MAX(id) AS max_id FROM WeatherData")
+            max_id = cursor.fetchone()['max_id'] or 0
+            if max_id > settled_id:
+                set_watermark(cursor, ROLLUP_PENDING_NAME, max_id)
+
+            if settled_id <= last_id:
+                connection.commit()
+                return []
+
+            # Days touched since the watermark, found through the primary key
+            cursor.execute("""
+            SELECT DISTINCT DATE(Timestamp + INTERVAL 8 HOUR) AS Date
+            FROM WeatherData
+            WHERE id > %s AND id <= %s
+            ORDER BY Date
+            """, (last_id, settled_id))
+            days = [row['Date'] for row in cursor.fetchall()]
+
+            if days:
+                # One Timestamp range per run of touched days, a late reading of an old day does not rescan the gap
+                ranges, args = [], []
+                for first, last in day_runs(days):
+                    ranges.append("(Timestamp >= %s AND Timestamp < %s)")
+                    args.extend(sgt_day_range(first, last))
+
+                cursor.execute(f"""
+                REPLACE INTO WeatherDailyRollup (Date, ReadingCount, {_ROLLUP_COLUMNS}, LastTimestamp, UpdatedAt)
+                SELECT DATE(Timestamp + INTERVAL 8 HOUR) AS Date,
+                       COUNT(*) AS ReadingCount,
+                       {_AGGREGATES},
+                       MAX(Timestamp) AS LastTimestamp,
+                       NOW() AS UpdatedAt
+                FROM WeatherData
+                WHERE ({' OR '.join(ranges)}) AND id <= %s
+                GROUP BY DATE(Timestamp + INTERVAL 8 HOUR)
+                """, args + [settled_id])
+
+            set_watermark(cursor, ROLLUP_NAME, settled_id)
+
+            connection.commit()
+            return days
+        except Exception:
+            connection.rollback()
+            raise
+
+
+def fetch_daily_weather(connection, start_date, end_date):
+    """
+    Get per-day sums, counts, minimums and maximums for the Singapore days start_date to end_date inclusive.
+    Rolled up days are merged with readings newer than the rollup watermark, so the current day is live.
+    """
+    with connection.cursor() as cursor:
+        # Read the watermark, rollup and tail from one snapshot so no reading is counted twice
+        connection.begin()
+        try:
+            last_id = get_watermark(cursor)
+
+            cursor.execute(f"""
+            SELECT Date, ReadingCount, {_ROLLUP_COLUMNS}, LastTimestamp
+            FROM WeatherDailyRollup
+            WHERE Date >= %s AND Date <= %s
+            ORDER BY Date ASC
+            """, (start_date, end_date))
+            days = {row['Date']: row for row in cursor.fetchall()}
+
+            start, end = sgt_day_range(start_date, end_date)
+            cursor.execute(TAIL_QUERY, (last_id, start, end))
+            tail = cursor.fetchall()
+
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+    for row in tail:
+        day = days.get(row['Date'])
+        if day is None:
+            days[row['Date']] = row
+            continue
+
+        day['ReadingCount'] += row['ReadingCount']
+        day['LastTimestamp'] = max(day['LastTimestamp'], row['LastTimestamp'])
+        for m in METRICS:
+            if not row[m + 'Count']:
+                continue
+            day[m + 'Count'] += row[m + 'Count']
+            day[m + 'Sum'] = (day[m + 'Sum'] or 0) + row[m + 'Sum']
+            day[m + 'Min'] = min(value for value in (day[m + 'Min'], row[m + 'Min']) if value is not None)
+            day[m + 'Max'] = max(value for value in (day[m + 'Max'], row[m + 'Max']) if value is not None)
+
+    return [days[date] for date in sorted(days)]
+
+
+def daily_mean(day, metric):
+    """The mean of a metric over a day's non-NULL readings, None when it has none."""
+    return day[metric + 'Sum'] / day[metric + 'Count'] if day[metric + 'Count'] else None
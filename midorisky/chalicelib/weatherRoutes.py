@@ -1,41 +1,145 @@
 from chalice import Blueprint, Response, BadRequestError
 import boto3
 import json
-from datetime import datetime
-from .connectHelper import create_connection
+import time
+from datetime import datetime, date, timedelta
+from .connectHelper import db_cursor, db_connection, db_stream_cursor, run_parallel, query_task, columnar_task
 import traceback
-from .helpers import json_serial
+from .helpers import (json_serial, iter_json_array, get_datetime_param, get_int_param, get_format_param,
+                      cursor_to_columnar, rows_to_columnar, concat_columnar, columnar_length)
+from .weatherRollup import SGT_OFFSET, sgt_today, fetch_daily_weather, refresh_daily_rollup, daily_mean
+from chalice.app import Rate
+import numpy as np
+from .downsample import lttb_indices, bucket_aggregate
+from .weatherArchive import ensure_partitions, archive_partitions, get_archived_months_between, merge_archived_rows
 
 weather_routes = Blueprint(__name__)
 
+# Upper bound for ?limit= on the raw weather data route
+WEATHER_MAX_LIMIT = 20000
+
+# Downsampled requests read many more rows than they return
+DOWNSAMPLE_MAX_POINTS = 5000
+DOWNSAMPLE_MAX_LIMIT = 1000000
+DOWNSAMPLE_FETCH_SIZE = 10000
+
+# First day of weather history served by the daily endpoints
+HISTORY_START_DATE = date(2019, 1, 1)
+
+# Closest reading per 30-minute bucket, kept for a minute so readings that arrive during the bucket show up
+CLOSEST_CACHE_SECONDS = 1800
+CLOSEST_CACHE_TTL = 60
+_closest_cache = {}  # bucket: (reading, monotonic expiry)
+
+# WeatherData queries only filter on plain UTC Timestamp ranges so they can use idx_weatherdata_timestamp,
+# Singapore day and hour boundaries are worked out in Python
+WEATHER_DATA_QUERY = """
+SELECT timestamp, temperature, humidity, precipitation, windspeed 
+FROM WeatherData 
+WHERE timestamp >= %s AND timestamp < %s
+ORDER BY timestamp ASC
+LIMIT %s;
+"""
+
+CLOSEST_READING_QUERY = """
+(SELECT timestamp, temperature, humidity, precipitation, windspeed 
+ FROM WeatherData 
+ WHERE timestamp >= %s AND timestamp <= %s
+ ORDER BY timestamp DESC
+ LIMIT 1)
+UNION ALL
+(SELECT timestamp, temperature, humidity, precipitation, windspeed 
+ FROM WeatherData 
+ WHERE timestamp > %s AND timestamp <= %s
+ ORDER BY timestamp ASC
+ LIMIT 1);
+"""
+
+CURRENT_HOURS_QUERY = """
+SELECT CONVERT_TZ(MIN(Timestamp), '+00:00', '+08:00') AS Timestamp, 
+       AVG(Temperature) AS Temperature, 
+       AVG(Humidity) AS Humidity, 
+       SUM(Precipitation) AS Precipitation, 
+       AVG(Windspeed) AS Windspeed 
+FROM WeatherData 
+WHERE Timestamp >= %s 
+  AND Timestamp <= %s
+GROUP BY FLOOR(UNIX_TIMESTAMP(Timestamp) / 1800)  -- Group by 30-minute intervals
+ORDER BY MIN(Timestamp) ASC;
+"""
+
 s3 = boto3.client('s3')
 
 @weather_routes.route('/staff/weather/fetch-weather-data', methods=['GET'], cors=True)
 def fetch_weather_data():
     """
-    Fetch daily weather data and return JSON for frontend consumption.
-    """
-    query = """
-    SELECT timestamp, temperature, humidity, precipitation, windspeed 
-    FROM WeatherData 
-    WHERE timestamp BETWEEN '2019-01-01' AND CURDATE();
+    Fetch weather data between ?from= and ?to= (exclusive), at most ?limit= rows, and return JSON for frontend consumption.
+    Rows are streamed from an unbuffered cursor straight into the JSON encoder so memory stays flat.
+    With ?points=N the series is downsampled to N points, see downsample_weather_data.
+    ?format=columnar returns {"columns": [...], "data": {column: [values]}} instead of an array of objects.
+    Months that were archived to S3 are merged back in, see weatherArchive.
     """
+    columns = ['timestamp', 'temperature', 'humidity', 'precipitation', 'windspeed']
     try:
-        # Fetch data from the database
-        with create_connection().cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchall()
+        params = weather_routes.current_request.query_params
+        start = get_datetime_param(params, 'from')
+        end = get_datetime_param(params, 'to')
+        response_format = get_format_param(params)
+        points = get_int_param(params, 'points', default=0, minimum=0, maximum=DOWNSAMPLE_MAX_POINTS)
+        limit = get_int_param(params, 'limit', maximum=DOWNSAMPLE_MAX_LIMIT if points else WEATHER_MAX_LIMIT)
+
+        if start >= end:
+            raise BadRequestError("Parameter from must be before to.")
+
+        if points:
+            method = (params or {}).get('method', 'lttb')
+            field = (params or {}).get('field', 'temperature')
+            if method not in ('lttb', 'bucket'):
+                raise BadRequestError("Parameter method must be lttb or bucket.")
+            if field not in columns[1:]:
+                raise BadRequestError("Parameter field must be one of " + ", ".join(columns[1:]) + ".")
+            if method == 'lttb' and points < 3:
+                raise BadRequestError("Parameter points must be at least 3 for lttb.")
+
+            archived_months = get_archived_months_between(start, end)
+            with db_stream_cursor() as cursor:
+                cursor.execute(WEATHER_DATA_QUERY, (start, end, limit))
+                rows = merge_archived_rows(cursor, archived_months, start, end, limit)
+                keys, series = downsample_weather_data(rows, columns, points, method, field)
+
+            if not series[keys[0]]:
+                raise BadRequestError("No data found for the specified period.")
+
+            if response_format == 'columnar':
+                weather_data = {'columns': keys, 'data': series}
+            else:
+                weather_data = [dict(zip(keys, row)) for row in zip(*series.values())]
+
+            return Response(
+                body=json.dumps(weather_data, default=json_serial),
+                status_code=200,
+                headers={'Content-Type': 'application/json'}
+            )
+
+        # Stream rows from the database into the encoder
+        archived_months = get_archived_months_between(start, end)
+        with db_stream_cursor() as cursor:
+            cursor.execute(WEATHER_DATA_QUERY, (start, end, limit))
+            rows = merge_archived_rows(cursor, archived_months, start, end, limit)
+            if response_format == 'columnar':
+                weather_data = cursor_to_columnar(rows)
+                found = bool(weather_data['data']['timestamp'])
+                body = json.dumps(weather_data, default=json_serial)
+            else:
+                body = ''.join(iter_json_array(rows, columns))
+                found = body != '[]'
 
         # Check if data exists
-        if not result:
+        if not found:
             raise BadRequestError("No data found for the specified period.")
 
-        # Format the data
-        columns = ['timestamp', 'temperature', 'humidity', 'precipitation', 'windspeed']
-        weather_data = result
-
         return Response(
-            body=json.dumps(weather_data, default=json_serial),
+            body=body,
             status_code=200,
             headers={'Content-Type': 'application/json'}
         )
@@ -53,6 +157,43 @@ def fetch_weather_data():
             headers={'Content-Type': 'application/json'}
         )
 
+def downsample_weather_data(cursor, columns, points, method, field):
+    """
+    Read the cursor's rows into NumPy columns and reduce them to at most `points` rows.
+    Returns the output column names and a dict of column name to values.
+
+    lttb keeps the readings that best preserve the shape of `field`.
+    bucket splits the range into equal time buckets and returns the mean, min and max of every column.
+    """
+    timestamps = []
+    values = []
+    while True:
+        rows = cursor.fetchmany(DOWNSAMPLE_FETCH_SIZE)
+        if not rows:
+            break
+        timestamps.append(np.array([row[0] for row in rows], dtype='datetime64[us]'))
+        values.append(np.array([row[1:] for row in rows], dtype=np.float64))
+
+    if not timestamps:
+        return columns, {name: [] for name in columns}
+
+    timestamps = np.concatenate(timestamps)
+    values = np.concatenate(values)
+    x = timestamps.astype(np.int64) / 1e6
+    series = {name: values[:, i] for i, name in enumerate(columns[1:])}
+
+    if method == 'lttb':
+        indices = lttb_indices(x, series[field], points)
+        result = {columns[0]: timestamps[indices].tolist()}
+        result.update({name: series[name][indices].tolist() for name in series})
+    else:
+        starts, aggregates = bucket_aggregate(x, series, points)
+        result = {columns[0]: (starts * 1e6).astype('datetime64[us]').tolist()}
+        for name, (means, mins, maxes) in aggregates.items():
+            result.update({name: means.tolist(), name + '_min': mins.tolist(), name + '_max': maxes.tolist()})
+
+    return list(result), result
+
 @weather_routes.route('/staff/weather/fetch-predicted-weather-data', methods=['GET'], cors=True)
 def fetch_predicted_weather_data():
     """
@@ -64,19 +205,24 @@ def fetch_predicted_weather_data():
     WHERE Date > CURDATE();
     """
     try:
-        # Fetch data from the database
-        with create_connection().cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchall()
+        response_format = get_format_param(weather_routes.current_request.query_params)
+
+        # Fetch data from the database, columnar responses are read straight from a tuple cursor
+        if response_format == 'columnar':
+            with db_stream_cursor() as cursor:
+                cursor.execute(query)
+                weather_data = cursor_to_columnar(cursor)
+            result = weather_data['data']['Date']
+        else:
+            with db_cursor(readonly=True) as cursor:
+                cursor.execute(query)
+                result = cursor.fetchall()
+            weather_data = result
 
         # Check if data exists
         if not result:
             raise BadRequestError("No data found for the specified period.")
 
-        # Format the data
-        columns = ['Date', 'Temperature', 'Humidity', 'Precipitation', 'Windspeed']
-        weather_data = result
-
         return Response(
             body=json.dumps(weather_data, default=json_serial),
             status_code=200,
@@ -101,40 +247,51 @@ def fetch_combined_weather_data():
     """
     Fetch combined daily weather data (actual and predicted) and return JSON for frontend consumption.
     """
-    sensor_query = """
-    SELECT 
-        DATE(timestamp) as Date, 
-        AVG(temperature) as Temperature, 
-        AVG(humidity) as Humidity, 
-        AVG(precipitation) as Precipitation, 
-        AVG(windspeed) as Windspeed
-    FROM WeatherData 
-    WHERE timestamp BETWEEN '2019-01-01' AND CURDATE()
-    GROUP BY DATE(timestamp);
-    """
     prediction_query = """
     SELECT Date, Temperature, Humidity, Precipitation, Windspeed 
     FROM WeatherPrediction 
-    WHERE Date > CURDATE();
+    WHERE Date > %s;
     """
     try:
-        # Fetch data from WeatherData
-        with create_connection().cursor() as cursor:
-            cursor.execute(sensor_query)
-            sensor_result = cursor.fetchall()
+        response_format = get_format_param(weather_routes.current_request.query_params)
+
+        # Fetch daily averages from the rollup (with the current day merged in live) and the predictions at the same time
+        # Columnar responses read the predictions through a tuple cursor straight into columns
+        today = sgt_today()
+        columnar = response_format == 'columnar'
+        days, prediction_result = run_parallel(
+            lambda connection: fetch_daily_weather(connection, HISTORY_START_DATE, today),
+            (columnar_task if columnar else query_task)(prediction_query, (today,))
+        )
 
-        if not sensor_result:
+        if not days:
             raise BadRequestError("No data found for the WeatherData table.")
 
-        # Fetch data from WeatherPrediction
-        with create_connection().cursor() as cursor:
-            cursor.execute(prediction_query)
-            prediction_result = cursor.fetchall()
-
-        if not prediction_result:
+        if not (columnar_length(prediction_result) if columnar else prediction_result):
             raise BadRequestError("No data found for the WeatherPrediction table.")
 
-        sensor_data = sensor_result
+        if columnar:
+            sensor_columns = {'Date': [day['Date'] for day in days]}
+            for metric in ('Temperature', 'Humidity', 'Precipitation', 'Windspeed'):
+                sensor_columns[metric] = [daily_mean(day, metric) for day in days]
+
+            combined_data = concat_columnar(
+                with_column({'columns': list(sensor_columns), 'data': sensor_columns}, 'Type', 'Actual'),
+                with_column(prediction_result, 'Type', 'Predicted')
+            )
+            return Response(
+                body=json.dumps(combined_data, default=json_serial),
+                status_code=200,
+                headers={'Content-Type': 'application/json'}
+            )
+
+        sensor_data = [{
+            'Date': day['Date'],
+            'Temperature': daily_mean(day, 'Temperature'),
+            'Humidity': daily_mean(day, 'Humidity'),
+            'Precipitation': daily_mean(day, 'Precipitation'),
+            'Windspeed': daily_mean(day, 'Windspeed')
+        } for day in days]
         prediction_data = prediction_result
 
         # Add a type field to distinguish between actual and predicted data
@@ -172,28 +329,35 @@ def fetch_closest_weather_data():
     """
     Fetch the closest weather data (to the current time) from WeatherData and return JSON.
     """
-    sensor_query = """
-    SELECT CONVERT_TZ(timestamp, '+00:00', '+08:00') AS timestamp, temperature, humidity, precipitation, windspeed 
-    FROM WeatherData 
-    WHERE timestamp BETWEEN DATE_SUB(NOW(), INTERVAL 1 DAY) AND NOW()
-    ORDER BY ABS(TIMESTAMPDIFF(SECOND, timestamp, NOW())) ASC
-    LIMIT 1;
-    """
     try:
-        # Fetch closest data from WeatherData
-        with create_connection().cursor() as cursor:
-            cursor.execute(sensor_query)
-            sensor_result = cursor.fetchone()
+        response_format = get_format_param(weather_routes.current_request.query_params)
+        now = datetime.utcnow()
+        # Epoch seconds from time.time(), a naive utcnow() would be read as local time by timestamp()
+        bucket = int(time.time() // CLOSEST_CACHE_SECONDS)
+
+        # Repeated dashboard polls are served from the container for up to CLOSEST_CACHE_TTL seconds
+        sensor_result, expires = _closest_cache.get(bucket, (None, 0))
+        if sensor_result is None or time.monotonic() >= expires:
+            sensor_result = fetch_closest_reading(now)
 
-        if not sensor_result:
-            raise Exception("No recent data found in the WeatherData table.")
+            if not sensor_result:
+                raise Exception("No recent data found in the WeatherData table.")
+
+            _closest_cache.clear()
+            _closest_cache[bucket] = sensor_result, time.monotonic() + CLOSEST_CACHE_TTL
 
         return Response(
-            body=json.dumps([sensor_result], default=json_serial),
+            body=json.dumps(format_series([sensor_result], response_format), default=json_serial),
             status_code=200,
             headers={'Content-Type': 'application/json'}
         )
 
+    except BadRequestError as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=400,
+            headers={'Content-Type': 'application/json'}
+        )
     except Exception as e:
         return Response(
             body=json.dumps({"error": str(e)}),
@@ -201,23 +365,27 @@ def fetch_closest_weather_data():
             headers={'Content-Type': 'application/json'}
         )
 
+def fetch_closest_reading(now, window=timedelta(days=1)):
+    """
+    Get the reading closest to `now` (UTC) with its timestamp in Singapore time.
+    Two index probes on Timestamp: the latest reading at or before now and the earliest one after it.
+    """
+    with db_cursor(readonly=True) as cursor:
+        cursor.execute(CLOSEST_READING_QUERY, (now - window, now, now, now + window))
+        readings = cursor.fetchall()
+
+    if not readings:
+        return None
+
+    closest = min(readings, key=lambda reading: abs((reading['timestamp'] - now).total_seconds()))
+    closest['timestamp'] = closest['timestamp'] + SGT_OFFSET
+    return closest
+
 @weather_routes.route('/staff/weather/fetch-current-and-next-days', methods=['GET'], cors=True)
 def fetch_current_and_next_days_weather():
     """
     Fetch the average weather data for the current day and the next 3 days (predicted).
     """
-    # Query for the current day's weather data
-    current_day_query = """
-    SELECT CONVERT_TZ(timestamp, '+00:00', '+08:00') AS timestamp, 
-           AVG(temperature) AS temperature, 
-           AVG(humidity) AS humidity, 
-           SUM(precipitation) AS precipitation, 
-           AVG(windspeed) AS windspeed 
-    FROM WeatherData 
-    WHERE DATE(CONVERT_TZ(timestamp, '+00:00', '+08:00')) = DATE(CONVERT_TZ(NOW(), '+00:00', '+08:00'))
-    GROUP BY DATE(CONVERT_TZ(timestamp, '+00:00', '+08:00'));
-    """
-
     # Query for the next 3 days' predicted weather data
     next_days_query = """
     SELECT Date AS timestamp, 
@@ -226,35 +394,46 @@ def fetch_current_and_next_days_weather():
            SUM(Precipitation) AS precipitation, 
            AVG(Windspeed) AS windspeed 
     FROM WeatherPrediction 
-    WHERE Date > DATE(CONVERT_TZ(NOW(), '+00:00', '+08:00')) 
+    WHERE Date > %s 
     GROUP BY Date 
     ORDER BY Date ASC 
     LIMIT 3;
     """
 
     try:
-        # Fetch current day's data from WeatherData
-        with create_connection().cursor() as cursor:
-            cursor.execute(current_day_query)
-            current_day_result = cursor.fetchall()
+        response_format = get_format_param(weather_routes.current_request.query_params)
+
+        # Fetch current day's data from the rollup, merged with readings it has not picked up yet,
+        # and the next 3 days' predicted data from WeatherPrediction at the same time
+        today = sgt_today()
+        columnar = response_format == 'columnar'
+        days, next_days_result = run_parallel(
+            lambda connection: fetch_daily_weather(connection, today, today),
+            (columnar_task if columnar else query_task)(next_days_query, (today,))
+        )
+
+        current_day_result = [{
+            'timestamp': day['LastTimestamp'] + SGT_OFFSET,
+            'temperature': daily_mean(day, 'Temperature'),
+            'humidity': daily_mean(day, 'Humidity'),
+            'precipitation': day['PrecipitationSum'],
+            'windspeed': daily_mean(day, 'Windspeed')
+        } for day in days]
 
         if not current_day_result:
             raise Exception("No data found for the current day in the WeatherData table.")
 
-        # Fetch next 3 days' predicted data from WeatherPrediction
-        with create_connection().cursor() as cursor:
-            cursor.execute(next_days_query)
-            next_days_result = cursor.fetchall()
-
-        if not next_days_result:
+        if not (columnar_length(next_days_result) if columnar else next_days_result):
             raise Exception("No data found for the next 3 days in the WeatherPrediction table.")
 
-        # Format the data
-        current_day_data = current_day_result
-        next_days_data = next_days_result
-
-        # Combine both datasets
-        combined_data = current_day_data + next_days_data
+        # Combine both datasets, the current day is a single row so it is the only part built from dicts
+        if columnar:
+            combined_data = concat_columnar(
+                rows_to_columnar(current_day_result, list(current_day_result[0])),
+                next_days_result
+            )
+        else:
+            combined_data = current_day_result + next_days_result
 
         return Response(
             body=json.dumps(combined_data, default=json_serial),
@@ -262,6 +441,12 @@ def fetch_current_and_next_days_weather():
             headers={'Content-Type': 'application/json'}
         )
 
+    except BadRequestError as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=400,
+            headers={'Content-Type': 'application/json'}
+        )
     except Exception as e:
         return Response(
             body=json.dumps({"error": str(e)}),
@@ -274,20 +459,6 @@ def fetch_current_and_next_hours_weather():
     """
     Fetch the weather data for the current 2 hours (from WeatherData) and the next 2 hours (from WeatherPrediction24).
     """
-    # Query for the current 2 hours' weather data from WeatherData
-    current_hours_query = """
-    SELECT CONVERT_TZ(Timestamp, '+00:00', '+08:00') AS Timestamp, 
-           AVG(Temperature) AS Temperature, 
-           AVG(Humidity) AS Humidity, 
-           SUM(Precipitation) AS Precipitation, 
-           AVG(Windspeed) AS Windspeed 
-    FROM WeatherData 
-    WHERE Timestamp >= DATE_SUB(NOW(), INTERVAL 2 HOUR) 
-      AND Timestamp <= NOW()
-    GROUP BY FLOOR(UNIX_TIMESTAMP(Timestamp) / 1800)  -- Group by 30-minute intervals
-    ORDER BY Timestamp ASC;
-    """
-
     # Query for the next 2 hours' predicted weather data from WeatherPrediction24
     next_hours_query = """
     SELECT CONVERT_TZ(DateTime, '+00:00', '+08:00') AS Timestamp, 
@@ -303,28 +474,30 @@ def fetch_current_and_next_hours_weather():
     """
 
     try:
-        # Fetch current 2 hours' data from WeatherData
-        with create_connection().cursor() as cursor:
-            cursor.execute(current_hours_query)
-            current_hours_result = cursor.fetchall()
+        response_format = get_format_param(weather_routes.current_request.query_params)
+
+        # Fetch current 2 hours' data from WeatherData and the next 2 hours' predicted data from WeatherPrediction24
+        # at the same time, bounds are computed here so the Timestamp index is used
+        now = datetime.utcnow()
+        columnar = response_format == 'columnar'
+        task = columnar_task if columnar else query_task
+        current_hours_result, next_hours_result = run_parallel(
+            task(CURRENT_HOURS_QUERY, (now - timedelta(hours=2), now)),
+            task(next_hours_query)
+        )
+        size = columnar_length if columnar else len
 
-        if not current_hours_result:
+        if not size(current_hours_result):
             raise Exception("No data found for the current 2 hours in the WeatherData table.")
 
-        # Fetch next 2 hours' predicted data from WeatherPrediction24
-        with create_connection().cursor() as cursor:
-            cursor.execute(next_hours_query)
-            next_hours_result = cursor.fetchall()
-
-        if not next_hours_result:
+        if not size(next_hours_result):
             raise Exception("No data found for the next 2 hours in the WeatherPrediction24 table.")
 
-        # Format the data
-        current_hours_data = current_hours_result
-        next_hours_data = next_hours_result
-
         # Combine both datasets
-        combined_data = current_hours_data + next_hours_data
+        if columnar:
+            combined_data = concat_columnar(current_hours_result, next_hours_result)
+        else:
+            combined_data = current_hours_result + next_hours_result
 
         return Response(
             body=json.dumps(combined_data, default=json_serial),
@@ -332,9 +505,61 @@ def fetch_current_and_next_hours_weather():
             headers={'Content-Type': 'application/json'}
         )
 
+    except BadRequestError as e:
+        return Response(
+            body=json.dumps({"error": str(e)}),
+            status_code=400,
+            headers={'Content-Type': 'application/json'}
+        )
     except Exception as e:
         return Response(
             body=json.dumps({"error": str(e)}),
             status_code=500,
             headers={'Content-Type': 'application/json'}
-        )
\ No newline at end of file
+        )
+
+def with_column(result, column, value):
+    """Add a column holding the same value on every row of a {"columns", "data"} result"""
+    result['columns'].append(column)
+    result['data'][column] = [value] * columnar_length(result)
+    return result
+
+def format_series(rows, response_format):
+    """Return rows as they are, or as {"columns": [...], "data": {column: [values]}} for ?format=columnar."""
+    if response_format != 'columnar':
+        return rows
+
+    columns = []
+    for row in rows:
+        columns.extend(key for key in row if key not in columns)
+    return rows_to_columnar(rows, columns)
+
+@weather_routes.schedule(Rate(1, unit=Rate.HOURS))
+def scheduled_weather_rollup(event):
+    """Scheduled event to fold new WeatherData readings into WeatherDailyRollup."""
+    print("Running scheduled weather rollup...")
+    try:
+        with db_connection() as connection:
+            days = refresh_daily_rollup(connection)
+
+        print(f"Rolled up {len(days)} day(s)")
+        return {"message": "Weather rollup updated successfully.", "days": len(days)}
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return {"error": str(e)}
+
+@weather_routes.schedule(Rate(1, unit=Rate.DAYS))
+def scheduled_weather_partitions(event):
+    """Scheduled event to add upcoming WeatherData partitions and move partitions past retention to S3."""
+    print("Running scheduled weather partition maintenance...")
+    try:
+        today = datetime.utcnow().date()
+        with db_connection() as connection:
+            added = ensure_partitions(connection, today)
+            archived = archive_partitions(connection, today)
+
+        print(f"Added {len(added)} partition(s), archived {len(archived)} partition(s)")
+        return {"message": "Weather partitions updated successfully.", "added": len(added), "archived": len(archived)}
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return {"error": str(e)}
@@ -1,5 +1,5 @@
 from boto3 import session
-from .connectHelper import create_connection
+from .connectHelper import db_cursor
 import os
 
 wsSession = session.Session()
@@ -27,7 +27,7 @@ class Sender(object):
             wsClient.post_to_connection(ConnectionId=connection_id, Data=message)
         except wsClient.exceptions.GoneException:
             # If the connection is closed, remove the connection ID
-            with create_connection().cursor() as cursor:
+            with db_cursor() as cursor:
                 cursor.execute("DELETE FROM wsConnections WHERE connection_id = %s", (connection_id))
 
 
@@ -8,6 +8,9 @@ This script deploys the necessary AWS resources for the Reclaimit application.
 
 The script creates the following resources:
 - SQS queue for message processing
+- SQS queue for sensor telemetry, with a dead letter queue
+- SQS queue for export jobs
+- SQS queue for the sharded IoT status update
 - S3 bucket for file storage
 - Cognito User Pool and Identity Pool for user authentication
 - DB setup with schema initialization
@@ -30,6 +33,7 @@ Usage:
 8. (Frontend) Deploy the frontend using Amplify by connecting to the git repository
 
 Note: This script is a one-time deployment script and should be run only once.
+To add tables and indexes introduced later to an existing database, run `python deployer.py migrate`.
 REMEMBER TO ALSO UPDATE THE CONFIG.JSON FILE IN THE CHALICE DIRECTORY WITH THE CREATED RESOURCES AND DEPLOY THE CHALICE APPLICATION.
 """
 
@@ -38,6 +42,7 @@ import pymysql
 import sys
 import logging
 import json
+from datetime import date, datetime
 from botocore.exceptions import ClientError
 
 # Configure logging
@@ -53,13 +58,25 @@ CONFIG = {
     'db_host': 'midori-db.czq2gkq0uuty.us-east-1.rds.amazonaws.com',
     'db_user': 'admin',
     'db_password': '',
+    'db_replica_hosts': '',  # Comma separated read replica endpoints, leave empty to read from the primary
     'sql_file': 'deployer.sql',
+    'telemetry_queue': 'midori-telemetry',  # Must match the queue of handle_telemetry_messages in app.py
+    'telemetry_max_receives': 5,  # Failed telemetry messages move to the dead letter queue after this many tries
+    'export_queue': 'midori-exports',  # Must match the queue of handle_export_jobs in app.py
+    'iot_shard_queue': 'midori-iot-shards',  # Must match the queue of handle_iot_status_shard in deviceRoutes.py
+    'weather_months_ahead': 3,  # Must match PARTITION_MONTHS_AHEAD in chalicelib/weatherArchive.py
     'admin_email': 'admin@admin.com'
 }
 
+# MySQL errors for CREATE TABLE / CREATE INDEX on objects that already exist
+EXISTING_OBJECT_ERRORS = (1050, 1061)
+
 # Resource trackers
 RESOURCES = {
     'sqs_url': None,
+    'telemetry_sqs_url': None,
+    'export_sqs_url': None,
+    'iot_shard_sqs_url': None,
     'ssm_prefix': None,
     'cognito_pool_id': None,
     'cognito_client_id': None,
@@ -110,6 +127,94 @@ def create_sqs():
     logger.info(f"Created SQS queue: {RESOURCES['sqs_url']}")
 
 
+@handle_aws_error
+def create_telemetry_sqs():
+    """Create the telemetry queue and its dead letter queue"""
+    sqs = boto3.client('sqs', region_name=CONFIG['region'])
+    queue_name = CONFIG['telemetry_queue']
+
+    try:
+        response = sqs.get_queue_url(QueueName=queue_name)
+        RESOURCES['telemetry_sqs_url'] = response['QueueUrl']
+        logger.info(f"Telemetry SQS queue already exists: {RESOURCES['telemetry_sqs_url']}")
+        return
+    except sqs.exceptions.QueueDoesNotExist:
+        pass
+
+    dlq_url = sqs.create_queue(
+        QueueName=f"{queue_name}-dlq",
+        Attributes={'MessageRetentionPeriod': '1209600'}
+    )['QueueUrl']
+    dlq_arn = sqs.get_queue_attributes(QueueUrl=dlq_url, AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+
+    # AWS recommends a visibility timeout of six times the Lambda timeout (60 seconds) for SQS event sources
+    response = sqs.create_queue(
+        QueueName=queue_name,
+        Attributes={
+            'VisibilityTimeout': '360',
+            'MessageRetentionPeriod': '86400',
+            'RedrivePolicy': json.dumps({
+                'deadLetterTargetArn': dlq_arn,
+                'maxReceiveCount': str(CONFIG['telemetry_max_receives'])
+            })
+        }
+    )
+    RESOURCES['telemetry_sqs_url'] = response['QueueUrl']
+    logger.info(f"Created telemetry SQS queue: {RESOURCES['telemetry_sqs_url']}")
+
+
+@handle_aws_error
+def create_export_sqs():
+    """Create the export job queue"""
+    sqs = boto3.client('sqs', region_name=CONFIG['region'])
+    queue_name = CONFIG['export_queue']
+
+    try:
+        response = sqs.get_queue_url(QueueName=queue_name)
+        RESOURCES['export_sqs_url'] = response['QueueUrl']
+        logger.info(f"Export SQS queue already exists: {RESOURCES['export_sqs_url']}")
+        return
+    except sqs.exceptions.QueueDoesNotExist:
+        pass
+
+    # Six times the 900 second timeout of the export worker
+    response = sqs.create_queue(
+        QueueName=queue_name,
+        Attributes={
+            'VisibilityTimeout': '5400',
+            'MessageRetentionPeriod': '86400'
+        }
+    )
+    RESOURCES['export_sqs_url'] = response['QueueUrl']
+    logger.info(f"Created export SQS queue: {RESOURCES['export_sqs_url']}")
+
+
+@handle_aws_error
+def create_iot_shard_sqs():
+    """Create the queue the scheduled IoT status update fans its shards out on"""
+    sqs = boto3.client('sqs', region_name=CONFIG['region'])
+    queue_name = CONFIG['iot_shard_queue']
+
+    try:
+        response = sqs.get_queue_url(QueueName=queue_name)
+        RESOURCES['iot_shard_sqs_url'] = response['QueueUrl']
+        logger.info(f"IoT shard SQS queue already exists: {RESOURCES['iot_shard_sqs_url']}")
+        return
+    except sqs.exceptions.QueueDoesNotExist:
+        pass
+
+    # Shards older than the next run are useless, the next run covers every device again
+    response = sqs.create_queue(
+        QueueName=queue_name,
+        Attributes={
+            'VisibilityTimeout': '360',
+            'MessageRetentionPeriod': '1800'
+        }
+    )
+    RESOURCES['iot_shard_sqs_url'] = response['QueueUrl']
+    logger.info(f"Created IoT shard SQS queue: {RESOURCES['iot_shard_sqs_url']}")
+
+
 @handle_aws_error
 def create_s3():
     """Create S3 bucket with proper region handling"""
@@ -373,6 +478,8 @@ def create_db():
                 for statement in sql.split(';'):
                     if statement.strip():
                         cursor.execute(statement)
+            # WeatherData gets its monthly partitions up to the months kept ahead, the app only adds new ones
+            partition_weather_data(cursor)
             logger.info("SQL schema executed successfully")
 
         conn.commit()
@@ -384,6 +491,80 @@ def create_db():
             conn.close()
 
 
+@handle_aws_error
+def migrate_db():
+    """Bring an existing database up to date with deployer.sql"""
+    conn = None
+    try:
+        conn = pymysql.connect(
+            host=CONFIG['db_host'],
+            user=CONFIG['db_user'],
+            password=CONFIG['db_password'],
+            database=CONFIG['app_name'],
+            charset='utf8mb4',
+            cursorclass=pymysql.cursors.DictCursor
+        )
+
+        with conn.cursor() as cursor:
+            with open(CONFIG['sql_file'], 'r') as f:
+                sql = f.read()
+                for statement in sql.split(';'):
+                    if not statement.strip():
+                        continue
+                    try:
+                        cursor.execute(statement)
+                        logger.info(f"Applied: {statement.strip().splitlines()[0]}")
+                    except pymysql.err.OperationalError as e:
+                        # Tables and indexes that already exist are skipped
+                        if e.args[0] not in EXISTING_OBJECT_ERRORS:
+                            raise
+                partition_weather_data(cursor)
+            logger.info("Database migrated successfully")
+
+        conn.commit()
+    except pymysql.Error as e:
+        logger.error(f"Database error: {e}")
+        sys.exit(1)
+    finally:
+        if conn:
+            conn.close()
+
+
+def partition_weather_data(cursor):
+    """
+    Convert an unpartitioned WeatherData table to monthly partitions, from its first reading (this month for an empty
+    table) up to the months the app keeps ahead of today.
+    pmax starts out empty, the app splits off new months before readings reach it.
+    """
+    cursor.execute("""
+    SELECT COUNT(*) AS count FROM information_schema.PARTITIONS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'WeatherData' AND PARTITION_NAME IS NOT NULL
+    """)
+    if cursor.fetchone()['count']:
+        return
+
+    cursor.execute("SELECT MIN(Timestamp) AS first_timestamp FROM WeatherData")
+    first = cursor.fetchone()['first_timestamp'] or datetime.utcnow()
+    today = date.today()
+    month = date(first.year, first.month, 1)
+    last_index = today.year * 12 + today.month - 1 + CONFIG['weather_months_ahead']
+    last = date(last_index // 12, last_index % 12 + 1, 1)
+
+    # The partition column has to be part of the primary key
+    definitions = []
+    while month <= last:
+        next_month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        definitions.append(f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{next_month.isoformat()}')")
+        month = next_month
+    definitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+
+    cursor.execute(
+        "ALTER TABLE WeatherData DROP PRIMARY KEY, ADD PRIMARY KEY (id, Timestamp) "
+        f"PARTITION BY RANGE COLUMNS (Timestamp) ({', '.join(definitions)})"
+    )
+    logger.info(f"Partitioned WeatherData into {len(definitions) - 1} monthly partitions")
+
+
 @handle_aws_error
 def create_ssm():
     """Store configuration in SSM Parameter Store"""
@@ -398,6 +579,9 @@ def create_ssm():
         'db_name': CONFIG['app_name']
     }
 
+    if CONFIG['db_replica_hosts']:
+        parameters['rds_replica_hosts'] = CONFIG['db_replica_hosts']
+
     for name, value in parameters.items():
         ssm.put_parameter(
             Name=f"{prefix}{name}",
@@ -412,6 +596,9 @@ def main():
     """Main deployment workflow"""
     logger.info("Starting deployment...")
     create_sqs()
+    create_telemetry_sqs()
+    create_export_sqs()
+    create_iot_shard_sqs()
     create_s3()
     create_cognito()
     create_db()
@@ -419,6 +606,9 @@ def main():
 
     logger.info("\nDeployment completed successfully!")
     print(f"SQS URL: {RESOURCES['sqs_url']}")
+    print(f"Telemetry SQS URL: {RESOURCES['telemetry_sqs_url']}")
+    print(f"Export SQS URL: {RESOURCES['export_sqs_url']}")
+    print(f"IoT shard SQS URL: {RESOURCES['iot_shard_sqs_url']}")
     print(f"SSM Prefix: {RESOURCES['ssm_prefix']}")
     print(f"Cognito Pool ID: {RESOURCES['cognito_pool_id']}")
     print(f"Cognito Client ID: {RESOURCES['cognito_client_id']}")
@@ -427,4 +617,8 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # `python deployer.py migrate` only applies new tables and indexes to the existing database
+    if sys.argv[1:] == ['migrate']:
+        migrate_db()
+    else:
+        main()
\ No newline at end of file
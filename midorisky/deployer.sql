@@ -1,3 +1,34 @@
+create table DeviceDailyUptime
+(
+    Date            date                               not null,
+    IoTSerialNumber varchar(20)                        not null,
+    PlotID          varchar(10)                        null,
+    UpSeconds       double                             not null,
+    DownSeconds     double                             not null,
+    DowntimeCount   int                                not null,
+    Recoveries      int                                not null,
+    RecoverySeconds double                             not null,
+    UpdatedAt       datetime default CURRENT_TIMESTAMP not null on update CURRENT_TIMESTAMP,
+    primary key (Date, IoTSerialNumber)
+);
+
+create table ExportJobs
+(
+    id           int auto_increment
+        primary key,
+    Dataset      varchar(32)                        not null,
+    Status       varchar(16)  default 'queued'      not null,
+    FromDate     datetime                           null,
+    ToDate       datetime                           null,
+    RequestedBy  varchar(128)                       not null,
+    S3Key        varchar(255)                       null,
+    RowCount     bigint                             null,
+    Attempts     int      default 0                 not null,
+    Error        varchar(1024)                      null,
+    CreatedAt    datetime default CURRENT_TIMESTAMP not null,
+    CompletedAt  datetime                           null
+);
+
 create table Farms
 (
     id          int           not null
@@ -8,6 +39,22 @@ create table Farms
     lon         decimal(9, 6) null
 );
 
+create table IoTDeviceIntervals
+(
+    id              bigint auto_increment
+        primary key,
+    IoTSerialNumber varchar(20)  not null,
+    IoTType         varchar(50)  null,
+    PlotID          varchar(10)  null,
+    IoTStatus       tinyint      null,
+    StartTime       datetime(6)  not null,
+    EndTime         datetime(6)  null,
+    ChangedBy       varchar(100) null
+);
+
+create index idx_iotdeviceintervals_serial_start
+    on IoTDeviceIntervals (IoTSerialNumber, StartTime);
+
 create table IoTDeviceLogTest
 (
     id              int auto_increment
@@ -20,6 +67,9 @@ create table IoTDeviceLogTest
     ChangedBy       varchar(100) null
 );
 
+create index idx_iotdevicelogtest_serial_time
+    on IoTDeviceLogTest (IoTSerialNumber, Timestamp);
+
 create table IoTDeviceLogs
 (
     id              int auto_increment
@@ -57,6 +107,12 @@ create table IoTDevicesTest
         unique (IoTSerialNumber)
 );
 
+create index idx_iotdevicestest_status_downtime
+    on IoTDevicesTest (IoTStatus, LastDowntime, PlotID);
+
+create index idx_iotdevicestest_plot_status_type
+    on IoTDevicesTest (PlotID, IoTStatus, IoTType);
+
 create table Notifications
 (
     id         int auto_increment
@@ -73,6 +129,14 @@ create table Notifications
 create index Notifications_username_created_at_index
     on Notifications (username asc, created_at desc);
 
+create table RollupWatermarks
+(
+    name       varchar(64) not null
+        primary key,
+    last_id    bigint      default 0 not null,
+    updated_at datetime    default CURRENT_TIMESTAMP not null on update CURRENT_TIMESTAMP
+);
+
 create table SoilMoistureIoT
 (
     id              int auto_increment
@@ -83,6 +147,14 @@ create table SoilMoistureIoT
     SoilMoisture    double      not null
 );
 
+create table SpoiltDeviceAlerts
+(
+    DeviceID     int      not null
+        primary key,
+    LastDowntime datetime null,
+    AlertedAt    datetime not null
+);
+
 create table Tasks
 (
     id          int auto_increment
@@ -127,13 +199,41 @@ create index fk_tasks_idx
 
 create table WeatherData
 (
-    id            int auto_increment
-        primary key,
+    id            int auto_increment,
     Timestamp     datetime(6) not null,
     Windspeed     double      not null,
     Temperature   double      not null,
     Precipitation double      not null,
-    Humidity      double      not null
+    Humidity      double      not null,
+    primary key (id, Timestamp)
+);
+
+create index idx_weatherdata_timestamp
+    on WeatherData (Timestamp);
+
+create table WeatherDailyRollup
+(
+    Date              date        not null
+        primary key,
+    ReadingCount      int         not null,
+    TemperatureCount  int         not null,
+    TemperatureSum    double      null,
+    TemperatureMin    double      null,
+    TemperatureMax    double      null,
+    HumidityCount     int         not null,
+    HumiditySum       double      null,
+    HumidityMin       double      null,
+    HumidityMax       double      null,
+    PrecipitationCount int        not null,
+    PrecipitationSum  double      null,
+    PrecipitationMin  double      null,
+    PrecipitationMax  double      null,
+    WindspeedCount    int         not null,
+    WindspeedSum      double      null,
+    WindspeedMin      double      null,
+    WindspeedMax      double      null,
+    LastTimestamp     datetime(6) not null,
+    UpdatedAt         datetime    default CURRENT_TIMESTAMP not null
 );
 
 create table WeatherIoT
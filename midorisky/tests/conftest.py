@@ -0,0 +1,191 @@
+import contextlib
+import json
+import os
+import threading
+import pytest
+from botocore.exceptions import ClientError
+
+# Modules read these at import time, mirror the values chalice injects from .chalice/config.json
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('REGION', 'us-east-1')
+os.environ.setdefault('USER_POOL_ID', 'us-east-1_test')
+os.environ.setdefault('WS_API_ID', 'test')
+os.environ.setdefault('SSM_PREFIX', '/midori/')
+os.environ.setdefault('IOT_ENDPOINT', 'localhost')
+
+
+class LocalIotData(object):
+    """Stand-in for the iot-data API, keeps the desired state of every shadow and can throttle things on request."""
+
+    def __init__(self):
+        self.shadows = {}
+        self.calls = 0
+        # Thing name to the number of updates to reject before accepting one, or the error code to always fail with
+        self.throttle = {}
+        self.fail = {}
+        self._lock = threading.Lock()
+
+    def update_thing_shadow(self, thingName, payload):
+        with self._lock:
+            self.calls += 1
+            if thingName in self.fail:
+                raise ClientError({'Error': {'Code': self.fail[thingName]}}, 'UpdateThingShadow')
+            if self.throttle.get(thingName):
+                self.throttle[thingName] -= 1
+                raise ClientError({'Error': {'Code': 'ThrottlingException'}}, 'UpdateThingShadow')
+
+            desired = json.loads(payload)['state']['desired']
+            self.shadows.setdefault(thingName, {}).update(desired)
+            return {'payload': json.dumps({'state': {'desired': self.shadows[thingName]}})}
+
+
+@pytest.fixture(autouse=True)
+def local_iot_data(monkeypatch):
+    """Every test publishes device shadows to a LocalIotData instead of AWS."""
+    from chalicelib import deviceShadows
+
+    iot_data = LocalIotData()
+    monkeypatch.setattr(deviceShadows, 'iot_client', iot_data)
+    monkeypatch.setattr(deviceShadows, 'SHADOW_BASE_DELAY', 0.001)
+    return iot_data
+
+
+class FakeCursor(object):
+    """Stand-in for a PyMySQL cursor, records statements on its FakeConnection and answers them from its rules."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+        self.rowcount = 0
+        self.lastrowid = None
+        self.description = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, args=None):
+        query = ' '.join(query.split())
+        self.connection.statements.append(('execute', query, args))
+        rows, columns = self.connection.answer(query, args)
+        self.rows = list(rows)
+        self.rowcount = len(self.rows)
+        self.description = [(name,) for name in columns] if columns else None
+        return self.rowcount
+
+    def executemany(self, query, args):
+        query = ' '.join(query.split())
+        args = list(args)
+        self.connection.statements.append(('executemany', query, args))
+        self.connection.answer(query, args, queued=False)
+        self.rowcount = len(args)
+        return self.rowcount
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    """
+    Stand-in for a PyMySQL connection. A statement is answered by the first rule whose text is part of it, then by
+    the next queued result, and otherwise with no rows. Every statement is kept in statements as
+    (execute | executemany, query with whitespace collapsed, args).
+    """
+
+    def __init__(self, monkeypatch=None):
+        self.monkeypatch = monkeypatch
+        self.statements = []
+        self.rules = []
+        self.results = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.open = True
+
+    @property
+    def committed(self):
+        return self.commits > 0
+
+    @property
+    def rolled_back(self):
+        return self.rollbacks > 0
+
+    def on(self, text, rows=(), columns=None):
+        """
+        Answer statements containing text with rows, a callable(query, args) returning rows, or an exception to
+        raise. columns sets the cursor description, for tuple rows.
+        """
+        self.rules.append((text, rows, columns))
+        return self
+
+    def queue(self, *results):
+        """Answer the next statements no rule matches with these row lists, in order."""
+        self.results.extend(results)
+        return self
+
+    def answer(self, query, args, queued=True):
+        for text, rows, columns in self.rules:
+            if text in query:
+                if isinstance(rows, Exception):
+                    raise rows
+                return (rows(query, args) if callable(rows) else rows), columns
+        if queued and self.results:
+            return self.results.pop(0), None
+        return [], None
+
+    def queries(self, kind=None):
+        return [query for statement_kind, query, _ in self.statements if kind in (None, statement_kind)]
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self)
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.open = False
+
+    def patch(self, *modules):
+        """Make the db_connection, db_cursor and db_stream_cursor helpers of modules use this connection."""
+        @contextlib.contextmanager
+        def db_connection(readonly=False):
+            yield self
+
+        @contextlib.contextmanager
+        def db_cursor(readonly=False):
+            with self.cursor() as cursor:
+                yield cursor
+
+        for module in modules:
+            for name, helper in (('db_connection', db_connection), ('db_cursor', db_cursor),
+                                 ('db_stream_cursor', db_cursor)):
+                if hasattr(module, name):
+                    self.monkeypatch.setattr(module, name, helper)
+        return self
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """A scriptable FakeConnection, fake_db.patch(module) routes the module's database helpers to it."""
+    return FakeConnection(monkeypatch)
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+import pymysql
+import pytest
+from chalicelib import connectHelper
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.open = True
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.open = False
+
+
+def test_credentials_are_cached_in_tmp(monkeypatch, tmp_path):
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {'host': 'db', 'user': 'admin', 'password': 'secret', 'database': 'midori'}
+
+    monkeypatch.setattr(connectHelper, 'CREDENTIALS_CACHE_FILE', str(tmp_path / 'credentials.json'))
+    monkeypatch.setattr(connectHelper, '_fetch_credentials', fetch)
+    monkeypatch.setattr(connectHelper, '_credentials', None)
+
+    assert connectHelper.get_db_credentials()['password'] == 'secret'
+
+    # A recycled container starts with an empty memory cache but keeps /tmp
+    monkeypatch.setattr(connectHelper, '_credentials', None)
+    assert connectHelper.get_db_credentials()['password'] == 'secret'
+    assert len(calls) == 1
+
+
+def test_rotated_password_refreshes_credentials(monkeypatch):
+    passwords = iter(['old', 'new'])
+    monkeypatch.setattr(connectHelper, 'get_db_credentials', lambda force_refresh=False: {'password': next(passwords)})
+
+    def connect(credentials, host=None, **options):
+        if credentials['password'] == 'old':
+            raise pymysql.err.OperationalError(connectHelper.ER_ACCESS_DENIED_ERROR, 'Access denied')
+        return credentials
+
+    monkeypatch.setattr(connectHelper, '_connect', connect)
+
+    assert connectHelper.create_connection() == {'password': 'new'}
+
+
+def test_readonly_checkouts_use_replicas_unless_pinned(monkeypatch):
+    credentials = {'host': 'primary', 'replica_hosts': ['replica-1', 'replica-2']}
+
+    def create_connection(host=None):
+        connection = FakeConnection()
+        connection.host = host or 'primary'
+        return connection
+
+    monkeypatch.setattr(connectHelper, 'get_db_credentials', lambda force_refresh=False: credentials)
+    monkeypatch.setattr(connectHelper, 'create_connection', create_connection)
+    monkeypatch.setattr(connectHelper, '_pools', {})
+
+    def checkout_host(readonly):
+        with connectHelper.db_connection(readonly) as connection:
+            return connection.host
+
+    assert checkout_host(False) == 'primary'
+    assert {checkout_host(True), checkout_host(True)} == {'replica-1', 'replica-2'}
+
+    with connectHelper.pin_primary():
+        assert checkout_host(True) == 'primary'
+
+
+@pytest.mark.skipif(not os.environ.get('MIDORI_TEST_REPLICA_HOST'), reason="needs a local primary and replica MySQL")
+def test_replica_routing_against_local_mysql(monkeypatch):
+    # e.g. MIDORI_TEST_PRIMARY_HOST=127.0.0.1:3306 MIDORI_TEST_REPLICA_HOST=127.0.0.1:3307
+    credentials = {
+        'host': os.environ.get('MIDORI_TEST_PRIMARY_HOST', '127.0.0.1:3306'),
+        'user': os.environ.get('MIDORI_TEST_DB_USER', 'root'),
+        'password': os.environ.get('MIDORI_TEST_DB_PASSWORD', ''),
+        'database': os.environ.get('MIDORI_TEST_DB_NAME', 'mysql'),
+        'replica_hosts': [os.environ['MIDORI_TEST_REPLICA_HOST']]
+    }
+    monkeypatch.setattr(connectHelper, 'get_db_credentials', lambda force_refresh=False: credentials)
+    monkeypatch.setattr(connectHelper, '_pools', {})
+
+    def server_port(readonly):
+        with connectHelper.db_cursor(readonly) as cursor:
+            cursor.execute("SELECT @@port AS port")
+            return str(cursor.fetchone()['port'])
+
+    assert credentials['host'].endswith(server_port(False))
+    assert credentials['replica_hosts'][0].endswith(server_port(True))
+
+
+def test_run_parallel_overlaps_tasks(monkeypatch):
+    monkeypatch.setattr(connectHelper, 'get_db_credentials', lambda force_refresh=False: {'host': 'primary'})
+    monkeypatch.setattr(connectHelper, 'create_connection', lambda host=None: FakeConnection())
+    monkeypatch.setattr(connectHelper, '_pools', {})
+
+    def slow(value):
+        def task(connection):
+            time.sleep(0.2)
+            return value
+        return task
+
+    start = time.monotonic()
+    assert connectHelper.run_parallel(slow(1), slow(2)) == [1, 2]
+    assert time.monotonic() - start < 0.35
+
+
+def test_run_parallel_runs_inline_while_holding_a_connection(monkeypatch):
+    monkeypatch.setattr(connectHelper, 'get_db_credentials', lambda force_refresh=False: {'host': 'primary'})
+    monkeypatch.setattr(connectHelper, '_pools', {})
+    threads = []
+
+    def task(connection):
+        threads.append(threading.current_thread())
+        return len(threads)
+
+    # With the pool down to one free connection the tasks still finish, one at a time on this thread
+    connectHelper._pools[None] = connectHelper.ConnectionPool(FakeConnection, max_size=2, timeout=0.5)
+    with connectHelper.db_connection():
+        assert connectHelper.run_parallel(task, task, task) == [1, 2, 3]
+    assert threads == [threading.current_thread()] * 3
@@ -0,0 +1,74 @@
+import pymysql
+import pytest
+from chalicelib.connectHelper import ConnectionPool
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.open = True
+        self.pings = 0
+
+    def ping(self, reconnect=True):
+        self.pings += 1
+        if not self.open:
+            if not reconnect:
+                raise pymysql.err.OperationalError(2006, "MySQL server has gone away")
+            self.open = True
+
+    def close(self):
+        self.open = False
+
+
+def test_pool_reuses_released_connection():
+    pool = ConnectionPool(FakeConnection, max_size=2)
+    connection = pool.acquire()
+    pool.release(connection)
+
+    assert pool.acquire() is connection
+
+
+def test_pool_caps_open_connections():
+    pool = ConnectionPool(FakeConnection, max_size=1, timeout=0.05)
+    pool.acquire()
+
+    with pytest.raises(pymysql.err.OperationalError):
+        pool.acquire()
+
+
+def test_pool_pings_idle_connections():
+    pool = ConnectionPool(FakeConnection, max_size=1, ping_interval=0)
+    connection = pool.acquire()
+    pool.release(connection)
+
+    assert pool.acquire().pings == 1
+
+
+def test_pool_replaces_stale_connections_instead_of_reconnecting():
+    pool = ConnectionPool(FakeConnection, max_size=1, ping_interval=0)
+    connection = pool.acquire()
+    pool.release(connection)
+    # The server dropped the socket while it sat idle
+    connection.open = False
+
+    replacement = pool.acquire()
+    assert replacement is not connection
+    assert not connection.open
+    assert pool._created.keys() == {id(replacement)}
+
+
+def test_pool_replaces_broken_connection():
+    pool = ConnectionPool(FakeConnection, max_size=1)
+    connection = pool.acquire()
+    pool.release(connection, broken=True)
+
+    assert not connection.open
+    assert pool.acquire() is not connection
+
+
+def test_pool_retires_connections_past_max_lifetime():
+    pool = ConnectionPool(FakeConnection, max_size=1, max_lifetime=-1)
+    connection = pool.acquire()
+    pool.release(connection)
+
+    assert pool.acquire() is not connection
+    assert not connection.open
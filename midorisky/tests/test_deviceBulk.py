@@ -0,0 +1,97 @@
+from datetime import datetime
+import json
+import pymysql.cursors
+import pytest
+from chalice.app import Request
+from app import app
+from chalicelib import deviceRoutes
+from chalicelib.deviceBulk import (DeviceBulkError, UPSERT_QUERY, LOG_QUERY, parse_operations, validate_operations,
+                                   apply_operations)
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+
+def test_csv_and_json_parse_to_the_same_operations():
+    csv_body = "op,IoTSerialNumber,IoTType,IoTStatus,PlotID\nupsert, SN-1 ,Sensor,1,P1\n\ndelete,SN-2,,,\n"
+    json_body = ('[{"op": "upsert", "IoTSerialNumber": "SN-1", "IoTType": "Sensor", "IoTStatus": 1, "PlotID": "P1"},'
+                 ' {"op": "delete", "IoTSerialNumber": "SN-2"}]')
+
+    from_csv, errors = validate_operations(parse_operations(csv_body, 'text/csv'))
+    assert errors == []
+    assert from_csv == validate_operations(parse_operations(json_body, 'application/json'))[0]
+
+    with pytest.raises(DeviceBulkError):
+        parse_operations('{"IoTSerialNumber": "SN-1"}', 'application/json')
+
+
+def test_every_invalid_row_is_reported():
+    _, errors = validate_operations([
+        {'IoTSerialNumber': 'SN-1', 'IoTType': 'Sensor', 'IoTStatus': 1, 'PlotID': 'P1'},
+        {'IoTSerialNumber': 'SN-1', 'op': 'delete'},
+        {'IoTSerialNumber': 'SN-3', 'IoTType': 'Sensor', 'IoTStatus': 'on', 'PlotID': 'P12345678901'},
+        {'op': 'rename', 'IoTSerialNumber': 'SN-4'},
+        'SN-5',
+    ])
+
+    assert [error['row'] for error in errors] == [2, 3, 4, 5]
+    assert 'appears more than once' in errors[0]['error']
+    assert 'IoTStatus' in errors[1]['error'] and 'PlotID is longer' in errors[1]['error']
+
+
+def test_operations_are_applied_with_multi_row_statements(fake_db):
+    devices = [
+        {'id': 1, 'IoTType': 'Sensor', 'IoTStatus': 1, 'IoTSerialNumber': 'SN-1', 'PlotID': 'P1'},
+        {'id': 2, 'IoTType': 'Sensor', 'IoTStatus': 1, 'IoTSerialNumber': 'SN-2', 'PlotID': 'P1'},
+        {'id': 3, 'IoTType': 'Sensor', 'IoTStatus': 0, 'IoTSerialNumber': 'SN-3', 'PlotID': 'P2'},
+    ]
+    fake_db.on('FOR UPDATE', lambda query, args: [device for device in devices if device['IoTSerialNumber'] in args])
+    operations, _ = validate_operations([
+        {'IoTSerialNumber': 'SN-1', 'IoTType': 'Sensor', 'IoTStatus': 1, 'PlotID': 'P1'},
+        {'IoTSerialNumber': 'SN-2', 'IoTType': 'Sensor', 'IoTStatus': '0', 'PlotID': 'P1'},
+        {'IoTSerialNumber': 'SN-9', 'IoTType': 'Valve', 'IoTStatus': 1, 'PlotID': 'P3'},
+        {'op': 'delete', 'IoTSerialNumber': 'SN-3'},
+        {'op': 'delete', 'IoTSerialNumber': 'SN-8'},
+    ])
+
+    results = apply_operations(fake_db, operations, NOW)
+
+    assert [result['result'] for result in results] == ['unchanged', 'updated', 'created', 'deleted', 'not_found']
+    assert fake_db.committed
+
+    writes = {query: args for kind, query, args in fake_db.statements if kind == 'executemany'}
+    assert writes[' '.join(UPSERT_QUERY.split())] == [('Sensor', 0, 'SN-2', 'P1', NOW), ('Valve', 1, 'SN-9', 'P3', NOW)]
+    assert [log[2] for log in writes[' '.join(LOG_QUERY.split())]] == ['SN-2', 'SN-9', 'SN-3']
+    assert any(query.startswith('DELETE FROM IoTDevicesTest') and args == ['SN-3']
+               for _, query, args in fake_db.statements)
+
+    # Both statements are sent as one multi-row INSERT per chunk
+    assert pymysql.cursors.RE_INSERT_VALUES.match(UPSERT_QUERY)
+    assert pymysql.cursors.RE_INSERT_VALUES.match(LOG_QUERY)
+
+
+def test_bulk_route_reports_shadow_failures_within_the_gateway_timeout(monkeypatch, local_iot_data, fake_db):
+    deadlines = []
+    publish = deviceRoutes.publish_status_changes
+
+    def publish_within(changes, seconds=None):
+        deadlines.append(seconds)
+        return publish(changes, seconds=seconds)
+
+    fake_db.patch(deviceRoutes)
+    monkeypatch.setattr(deviceRoutes, 'sgt_now', lambda: NOW)
+    monkeypatch.setattr(deviceRoutes, 'publish_status_changes', publish_within)
+    local_iot_data.fail['SN-2'] = 'ResourceNotFoundException'
+    body = ('[{"IoTSerialNumber": "SN-1", "IoTType": "Sensor", "IoTStatus": 1, "PlotID": "P1"},'
+            ' {"IoTSerialNumber": "SN-2", "IoTType": "Sensor", "IoTStatus": 0, "PlotID": "P1"}]')
+    monkeypatch.setattr(app, 'current_request', Request(
+        {'multiValueQueryStringParameters': None, 'headers': {'content-type': 'application/json'},
+         'pathParameters': {}, 'requestContext': {'httpMethod': 'POST', 'resourcePath': '/staff/devices/bulk'},
+         'body': body, 'isBase64Encoded': False, 'stageVariables': None}), raising=False)
+
+    response = deviceRoutes.bulk_devices()
+
+    assert response.status_code == 200
+    assert deadlines[0] < 29
+    assert json.loads(response.body)['summary'] == {
+        'created': 2, 'shadows': {'published': 1, 'failed': [{'IoTSerialNumber': 'SN-2',
+                                                               'error': 'ResourceNotFoundException'}]}}
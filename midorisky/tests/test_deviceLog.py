@@ -0,0 +1,61 @@
+from datetime import datetime
+from chalicelib.deviceLog import plan_intervals, device_log_query, compact_step
+
+
+def entry(id, serial, status, hour, changed_by='system'):
+    return {'id': id, 'IoTType': 'Sensor', 'IoTSerialNumber': serial, 'IoTStatus': status, 'PlotID': 'P1',
+            'Timestamp': datetime(2024, 6, 1, hour), 'ChangedBy': changed_by}
+
+
+def test_repeated_statuses_are_folded_into_intervals():
+    entries = [entry(1, 'SN-1', 1, 0), entry(2, 'SN-1', 1, 1), entry(3, 'SN-1', 0, 2, 'admin'), entry(4, 'SN-1', 0, 3),
+               entry(5, 'SN-2', 0, 0), entry(6, 'SN-2', 1, 4)]
+
+    # SN-2 continues an interval stored by an earlier run
+    intervals, closes = plan_intervals(entries, {'SN-2': {'id': 77, 'IoTSerialNumber': 'SN-2', 'IoTStatus': 0,
+                                                          'StartTime': datetime(2024, 5, 31)}})
+
+    assert [(i['IoTSerialNumber'], i['IoTStatus'], i['StartTime'].hour, i['EndTime'] and i['EndTime'].hour,
+             i['ChangedBy']) for i in intervals] == [
+        ('SN-1', 1, 0, 2, 'system'),
+        ('SN-1', 0, 2, None, 'admin'),
+        ('SN-2', 1, 4, None, 'system'),
+    ]
+    assert closes == [(datetime(2024, 6, 1, 4), 77)]
+
+
+def test_late_entries_do_not_reorder_stored_intervals():
+    # SN-1's 02:00 entry got a higher id than its 03:00 entry, which an earlier run already compacted
+    open_intervals = {'SN-1': {'id': 77, 'IoTSerialNumber': 'SN-1', 'IoTStatus': 0,
+                               'StartTime': datetime(2024, 6, 1, 3)}}
+
+    intervals, closes = plan_intervals([entry(9, 'SN-1', 1, 2), entry(10, 'SN-1', 1, 4)], open_intervals)
+
+    assert [(i['IoTStatus'], i['StartTime'].hour) for i in intervals] == [(1, 4)]
+    assert closes == [(datetime(2024, 6, 1, 4), 77)]
+
+
+def test_device_log_query_reads_both_stores():
+    query, args = device_log_query('SN-1', [("{time} >= %s", [datetime(2024, 6, 1)])], limit=5)
+
+    assert 'FROM IoTDeviceLogTest WHERE IoTSerialNumber = %s AND id > (SELECT' in ' '.join(query.split())
+    assert 'StartTime >= %s' in query and 'Timestamp >= %s' in query
+    # Ids of the two stores overlap, the source breaks ties between entries of the same time
+    assert ' '.join(query.split()).endswith('ORDER BY Timestamp DESC, Source DESC, id DESC LIMIT %s')
+    assert args == ['SN-1', datetime(2024, 6, 1), 5, 'SN-1', datetime(2024, 6, 1), 5, 5]
+
+
+def test_compaction_stops_at_the_cutoff(fake_db):
+    fake_db.on('SELECT last_id', [{'last_id': 0}])
+    fake_db.on('FROM IoTDeviceLogTest', [entry(1, 'SN-1', 1, 0), entry(2, 'SN-1', 1, 1), entry(3, 'SN-1', 0, 5)])
+
+    assert compact_step(fake_db, datetime(2024, 6, 1, 3)) == (2, 1)
+    assert fake_db.committed
+
+    inserted = next(args for _, query, args in fake_db.statements
+                    if query.startswith('INSERT INTO IoTDeviceIntervals'))
+    assert inserted == [('SN-1', 'Sensor', 'P1', 1, datetime(2024, 6, 1, 0), None, 'system')]
+
+    # The watermark ends at the last compacted entry, the newer one stays raw
+    _, query, args = fake_db.statements[-1]
+    assert query.startswith('INSERT INTO RollupWatermarks') and args == ('IoTDeviceIntervals', 2)
@@ -0,0 +1,218 @@
+import datetime
+import json
+from chalice.test import Client
+from app import app
+from chalicelib import connectHelper, deviceRoutes
+
+COLUMNS = ['id', 'IoTType', 'IoTStatus', 'IoTSerialNumber', 'PlotID', 'LastDowntime']
+
+
+def device(id, status):
+    return {'id': id, 'IoTType': 'Sensor', 'IoTStatus': status, 'IoTSerialNumber': 'SN-%d' % id, 'PlotID': 'P1',
+            'LastDowntime': None}
+
+
+def device_table(fake_db, devices):
+    """Answer the shard's streamed read and its FOR UPDATE lock from devices."""
+    def shard(query, args):
+        start_id, end_id = args
+        return [tuple(device[name] for name in COLUMNS) for device in devices if start_id <= device['id'] <= end_id]
+
+    def locked(query, args):
+        return [{'id': device['id'], 'IoTStatus': device['IoTStatus']} for device in devices if device['id'] in args]
+
+    return fake_db.patch(deviceRoutes).on('FOR UPDATE', locked).on('FROM IoTDevicesTest WHERE id >= %s', shard, COLUMNS)
+
+
+def test_plan_shards_covers_the_id_range():
+    assert deviceRoutes.plan_shards(1, 10, size=4) == [(1, 4), (5, 8), (9, 10)]
+    assert deviceRoutes.plan_shards(7, 7, size=4) == [(7, 7)]
+    assert deviceRoutes.plan_shards(None, None) == []
+
+
+def test_shard_only_logs_changed_devices(monkeypatch, local_iot_data, fake_db):
+    connection = device_table(fake_db, [device(1, 1), device(2, 0), device(3, 0), device(9, 1)])
+    # Every active device past its cooldown goes down
+    monkeypatch.setattr(deviceRoutes, 'DOWNTIME_PROBABILITY', 100)
+
+    result = deviceRoutes.process_device_shard(1, 3, datetime.datetime(2024, 6, 1, 12, 0))
+
+    assert result == {'changed': 1, 'unchanged': 2, 'published': 1}
+    assert local_iot_data.shadows == {'SN-1': {'IoTStatus': 0, 'PlotID': 'P1'}}
+    assert connection.committed
+
+    # Unchanged devices are not written at all, not even their LastUpdated
+    kinds = [(kind, query.split()[0]) for kind, query, _ in connection.statements]
+    assert kinds == [('execute', 'SELECT'), ('execute', 'SELECT'), ('executemany', 'INSERT'), ('executemany', 'UPDATE')]
+
+    _, _, logs = connection.statements[2]
+    assert [(log[1], log[2]) for log in logs] == [('SN-1', 0)]
+
+    _, _, updates = connection.statements[3]
+    assert [update[3] for update in updates] == [1]
+
+
+def test_large_fleet_is_fanned_out_through_sqs(monkeypatch, fake_db):
+    sent = []
+
+    class FakeSQS(object):
+        def send_message_batch(self, QueueUrl, Entries):
+            sent.append(Entries)
+            return {'Successful': Entries}
+
+    fake_db.patch(deviceRoutes).on('MIN(id)', [{'min_id': 1, 'max_id': 25}])
+    monkeypatch.setattr(deviceRoutes, 'sqs', FakeSQS())
+    monkeypatch.setattr(deviceRoutes, 'IOT_SHARD_SIZE', 2)
+
+    with Client(app) as client:
+        event = client.events.generate_cw_event(source='aws.events', detail_type='Scheduled Event', detail={},
+                                                resources=[])
+        result = client.lambda_.invoke('scheduled_iot_status_update', event).payload
+
+    assert result['shards'] == 13
+    assert [len(batch) for batch in sent] == [10, 3]
+    assert json.loads(sent[1][-1]['MessageBody'])['start_id'] == 25
+
+
+def test_device_listing_is_filtered_and_keyset_paginated(fake_db):
+    fake_db.patch(deviceRoutes).on('COUNT(*)', [{'total': 12}]).on('ORDER BY id', lambda query, args: [
+        {'id': 7, 'IoTType': 'Sensor', 'IoTStatus': 0, 'IoTSerialNumber': 'SN-7', 'PlotID': 'P1',
+         'LastDowntime': datetime.datetime(2024, 6, 1, 12, 47)},
+        {'id': 9, 'IoTType': 'Sensor', 'IoTStatus': 0, 'IoTSerialNumber': 'SN-9', 'PlotID': 'P1',
+         'LastDowntime': None}])
+
+    with Client(app) as client:
+        response = client.http.get('/staff/devices/view-all-devices?plot=P1&status=0&after=5&limit=2')
+
+    assert response.status_code == 200
+    body = json.loads(response.body)
+    assert body['next'] == 9 and body['total'] == 12
+    assert body['devices'][0]['RoundedLastDowntime'] == '2024-06-01T12:30:00'
+    assert 'LastDowntime' not in body['devices'][0]
+
+    (_, page_query, page_args), (_, count_query, count_args) = fake_db.statements
+    assert 'PlotID = %s AND IoTStatus = %s AND id > %s ORDER BY id LIMIT %s' in page_query
+    assert page_args == ['P1', 0, 5, 2]
+    assert count_args == ['P1', 0]
+
+    with Client(app) as client:
+        response = client.http.get('/staff/devices/view-all-devices?status=off')
+    assert response.status_code == 400
+
+
+def test_device_listing_without_paging_is_a_plain_array(fake_db):
+    fake_db.patch(deviceRoutes).on('ORDER BY id', [
+        {'id': 7, 'IoTType': 'Sensor', 'IoTStatus': 0, 'IoTSerialNumber': 'SN-7', 'PlotID': 'P1',
+         'LastDowntime': datetime.datetime(2024, 6, 1, 12, 47)}])
+
+    with Client(app) as client:
+        response = client.http.get('/staff/devices/view-all-devices?plot=P1')
+
+    assert json.loads(response.body) == [{'id': 7, 'IoTType': 'Sensor', 'IoTStatus': 0, 'IoTSerialNumber': 'SN-7',
+                                          'PlotID': 'P1', 'RoundedLastDowntime': '2024-06-01T12:30:00'}]
+    (_, query, args), = fake_db.statements
+    assert query.endswith('WHERE PlotID = %s ORDER BY id') and args == ['P1']
+
+
+def test_device_since_is_read_in_one_statement(fake_db):
+    fake_db.patch(deviceRoutes).on('FROM IoTDevicesTest', [{'IoTSerialNumber': 'SN-1'}])
+    fake_db.on('LAG(IoTStatus)', [{'Timestamp': datetime.datetime(2024, 6, 1, 9)}])
+    fake_db.on('UNION ALL', [{'id': 20, 'IoTType': 'Sensor', 'IoTStatus': 0, 'IoTSerialNumber': 'SN-1', 'PlotID': 'P1',
+                              'Timestamp': datetime.datetime(2024, 6, 3), 'ChangedBy': 'System', 'Source': 1}])
+
+    with Client(app) as client:
+        response = client.http.get('/staff/devices/view/1')
+
+    assert response.json_body['Since'] == '2024-06-01T09:00:00'
+    # The device, its latest entry and the start of its current status
+    assert len(fake_db.statements) == 3
+    _, query, args = fake_db.statements[2]
+    assert ' '.join(query.split()).endswith('WHERE NOT (IoTStatus <=> PreviousStatus) '
+                                            'ORDER BY Timestamp DESC, Source DESC, id DESC LIMIT 1')
+    assert args == ['SN-1', 'SN-1']
+
+
+def test_device_history_pages_are_intervals(fake_db):
+    columns = ['id', 'IoTType', 'IoTStatus', 'IoTSerialNumber', 'PlotID', 'Timestamp', 'ChangedBy', 'Source']
+    # A raw log entry and an interval with the same id, told apart by their source
+    logs = [(20, 'Sensor', 1, 'SN-1', 'P1', datetime.datetime(2024, 6, 3), 'System', 1),
+            (20, 'Sensor', 0, 'SN-1', 'P1', datetime.datetime(2024, 6, 2), 'System', 0)]
+
+    fake_db.patch(deviceRoutes).on('FROM IoTDevicesTest', [{'IoTSerialNumber': 'SN-1'}])
+    fake_db.on('UNION ALL', lambda query, args: [dict(zip(columns, log)) for log in logs])
+
+    with Client(app) as client:
+        first = json.loads(client.http.get('/staff/devices/view/1/history?limit=2').body)
+
+    assert [(log['Timestamp'], log['Until']) for log in first['logs']] == [
+        ('2024-06-03T00:00:00', None), ('2024-06-02T00:00:00', '2024-06-03T00:00:00')]
+    assert first['next'] == '2024-06-02T00:00:00,0,20'
+
+    # Columnar pages come from a tuple cursor
+    fake_db.rules[-1] = ('UNION ALL', logs, columns)
+    with Client(app) as client:
+        second = json.loads(client.http.get('/staff/devices/view/1/history?limit=2&format=columnar&before='
+                                            + first['next']).body)
+
+    # The first entry of an older page ends where the cursor entry starts
+    assert second['columns'] == columns + ['Until']
+    assert second['data']['Until'] == ['2024-06-02T00:00:00', '2024-06-03T00:00:00']
+    assert second['next'] == '2024-06-02T00:00:00,0,20'
+    _, query, args = fake_db.statements[-1]
+    assert ('(Timestamp < %s OR (Timestamp = %s AND (1 < %s OR (1 = %s AND id < %s)))) '
+            'ORDER BY Timestamp DESC, id DESC') in query
+    assert ('(StartTime < %s OR (StartTime = %s AND (0 < %s OR (0 = %s AND id < %s)))) '
+            'ORDER BY StartTime DESC, id DESC') in query
+    page = [datetime.datetime(2024, 6, 2), datetime.datetime(2024, 6, 2), 0, 0, 20, 2]
+    assert args == ['SN-1'] + page + ['SN-1'] + page + [2]
+
+    with Client(app) as client:
+        assert client.http.get('/staff/devices/view/1/history?before=yesterday').status_code == 400
+        assert client.http.get('/staff/devices/view/1/history?before=2024-06-02T00:00:00,20').status_code == 400
+
+
+def test_edited_device_is_read_back_from_the_primary(fake_db):
+    pins = []
+
+    def written(query, args):
+        pins.append(getattr(connectHelper._routing, 'pinned', 0))
+        return [{'id': 5, 'IoTType': 'Sensor', 'IoTStatus': 1, 'IoTSerialNumber': 'SN-5', 'PlotID': 'P2',
+                 'LastDowntime': None}]
+
+    fake_db.patch(deviceRoutes).on('SELECT id, IoTType', written)
+
+    with Client(app) as client:
+        response = client.http.put('/staff/devices/edit/5', headers={'Content-Type': 'application/json'},
+                                   body=json.dumps({'IoTType': 'Sensor', 'IoTStatus': 1, 'IoTSerialNumber': 'SN-5',
+                                                    'PlotID': 'P2'}))
+
+    assert response.status_code == 200
+    assert json.loads(response.body)['device']['PlotID'] == 'P2'
+    assert fake_db.committed and pins == [1]
+
+
+def test_edited_device_shadow_is_only_published_on_a_status_change(local_iot_data, fake_db):
+    fake_db.patch(deviceRoutes).on('SELECT IoTStatus FROM IoTDevicesTest', [{'IoTStatus': 1}])
+
+    def edit(status):
+        with Client(app) as client:
+            return client.http.put('/staff/devices/edit/5', headers={'Content-Type': 'application/json'},
+                                   body=json.dumps({'IoTType': 'Sensor', 'IoTStatus': status,
+                                                    'IoTSerialNumber': 'SN-5', 'PlotID': 'P2'}))
+
+    assert edit(1).status_code == 200
+    assert local_iot_data.calls == 0
+
+    assert edit(0).status_code == 200
+    assert local_iot_data.shadows == {'SN-5': {'IoTStatus': 0, 'PlotID': 'P2'}}
+
+
+def test_admin_log_entries_use_the_scheduler_clock(monkeypatch, fake_db):
+    fake_db.patch(deviceRoutes)
+    monkeypatch.setattr(deviceRoutes, 'sgt_now', lambda: datetime.datetime(2024, 6, 1, 20, 0))
+
+    with Client(app) as client:
+        assert client.http.delete('/staff/devices/delete/5').status_code == 200
+
+    _, query, args = fake_db.statements[0]
+    assert 'NOW()' not in query and args == (datetime.datetime(2024, 6, 1, 20, 0), '5')
@@ -0,0 +1,55 @@
+from chalicelib import deviceShadows
+from chalicelib.deviceShadows import publish_status_changes
+
+
+def changes(count):
+    return [{'IoTSerialNumber': 'SN-%d' % i, 'IoTStatus': i % 2, 'PlotID': 'P1'} for i in range(count)]
+
+
+def test_fleet_update_is_published_to_every_shadow(local_iot_data):
+    result = publish_status_changes(changes(200))
+
+    assert result == {'published': 200, 'failed': []}
+    assert local_iot_data.shadows['SN-7'] == {'IoTStatus': 1, 'PlotID': 'P1'}
+    assert len(local_iot_data.shadows) == 200
+
+
+def test_throttled_updates_are_retried(local_iot_data):
+    local_iot_data.throttle = {'SN-1': 3, 'SN-2': 1}
+
+    result = publish_status_changes(changes(3))
+
+    assert result['published'] == 3
+    assert local_iot_data.calls == 3 + 3 + 1
+
+
+def test_failures_are_reported_per_device(local_iot_data, monkeypatch):
+    monkeypatch.setattr(deviceShadows, 'SHADOW_MAX_ATTEMPTS', 2)
+    local_iot_data.throttle = {'SN-0': 10}
+    local_iot_data.fail = {'SN-1': 'UnauthorizedException'}
+
+    result = publish_status_changes(changes(3))
+
+    assert result['published'] == 1
+    assert result['failed'] == [{'IoTSerialNumber': 'SN-0', 'error': 'ThrottlingException'},
+                                {'IoTSerialNumber': 'SN-1', 'error': 'UnauthorizedException'}]
+    # Errors that are not throttling are not retried
+    assert local_iot_data.calls == 2 + 1 + 1
+
+
+def test_retries_stop_at_the_deadline(local_iot_data, monkeypatch):
+    local_iot_data.throttle = {'SN-0': 100}
+    # The first retry waits past the deadline
+    monkeypatch.setattr(deviceShadows.random, 'uniform', lambda low, high: 1)
+
+    result = publish_status_changes(changes(1), seconds=0.5)
+
+    assert result['failed'] == [{'IoTSerialNumber': 'SN-0', 'error': 'ThrottlingException'}]
+    assert local_iot_data.calls == 1
+
+
+def test_nothing_is_sent_after_the_deadline(local_iot_data):
+    result = publish_status_changes(changes(3), seconds=0)
+
+    assert [failure['error'] for failure in result['failed']] == ['DeadlineExceeded'] * 3
+    assert local_iot_data.calls == 0
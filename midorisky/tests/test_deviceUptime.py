@@ -0,0 +1,71 @@
+from datetime import date, datetime
+import numpy as np
+from chalicelib import deviceUptime
+from chalicelib.deviceUptime import state_intervals, compute_daily_uptime, summarize_uptime, UP, DOWN, UNKNOWN
+
+
+def test_state_intervals_fold_repeated_statuses():
+    codes = np.array([0, 0, 0, 0, 1, 1])
+    statuses = np.array([1, 1, 0, 1, 0, 0])
+    times = np.array([0, 10, 20, 30, 5, 15])
+
+    run_codes, run_statuses, starts, ends, next_statuses = state_intervals(codes, statuses, times, 100)
+
+    assert run_codes.tolist() == [0, 0, 0, 1]
+    assert run_statuses.tolist() == [UP, DOWN, UP, DOWN]
+    assert starts.tolist() == [0, 20, 30, 5]
+    assert ends.tolist() == [20, 30, 100, 100]
+    assert next_statuses.tolist() == [DOWN, UP, UNKNOWN, UNKNOWN]
+
+
+def test_daily_uptime_is_cut_per_day_from_one_pass(monkeypatch, fake_db):
+    # Both stores are read in (IoTSerialNumber, time) order, SN-1's carry-in and first outage were compacted
+    fake_db.on('FROM IoTDeviceIntervals i', [('SN-1', 'P1', 1, datetime(2024, 5, 20))])
+    fake_db.on('FROM IoTDeviceIntervals', [('SN-1', 'P1', 0, datetime(2024, 6, 1, 18, 0))])
+    fake_db.on('FROM IoTDeviceLogTest l', [])
+    fake_db.on('FROM IoTDeviceLogTest', [('SN-1', 'P1', 1, datetime(2024, 6, 2, 6, 0)),
+                                         ('SN-2', 'P2', 0, datetime(2024, 6, 2, 12, 0))])
+    # One device per batch
+    monkeypatch.setattr(deviceUptime, 'UPTIME_BATCH_ROWS', 1)
+
+    rows = compute_daily_uptime(fake_db.cursor(), fake_db.cursor(), date(2024, 6, 1), date(2024, 6, 2),
+                                datetime(2024, 6, 2, 18, 0))
+    by_key = {(row['Date'], row['IoTSerialNumber']): row for row in rows}
+
+    first = by_key[(date(2024, 6, 1), 'SN-1')]
+    assert (first['UpSeconds'], first['DownSeconds'], first['DowntimeCount']) == (18 * 3600, 6 * 3600, 1)
+    assert first['Recoveries'] == 0
+
+    # The outage is recovered the next day, the whole 12 hours count towards the recovery time
+    second = by_key[(date(2024, 6, 2), 'SN-1')]
+    assert (second['UpSeconds'], second['DownSeconds'], second['DowntimeCount']) == (12 * 3600, 6 * 3600, 0)
+    assert (second['Recoveries'], second['RecoverySeconds']) == (1, 12 * 3600)
+
+    # Today ends at now, and SN-2 was not observed before it went down
+    assert by_key[(date(2024, 6, 2), 'SN-2')]['DownSeconds'] == 6 * 3600
+    assert (date(2024, 6, 1), 'SN-2') not in by_key
+
+    assert all('ORDER BY' in query for query in fake_db.queries())
+
+
+def test_uptime_summary_per_plot():
+    rows = [
+        {'Date': date(2024, 6, 1), 'IoTSerialNumber': 'SN-1', 'PlotID': 'P1', 'UpSeconds': 75.0, 'DownSeconds': 25.0,
+         'DowntimeCount': 1, 'Recoveries': 1, 'RecoverySeconds': 25.0},
+        {'Date': date(2024, 6, 1), 'IoTSerialNumber': 'SN-2', 'PlotID': 'P1', 'UpSeconds': 100.0,
+         'DownSeconds': 0.0, 'DowntimeCount': 0, 'Recoveries': 0, 'RecoverySeconds': 0.0},
+        {'Date': date(2024, 6, 1), 'IoTSerialNumber': 'SN-3', 'PlotID': None, 'UpSeconds': 0.0, 'DownSeconds': 0.0,
+         'DowntimeCount': 0, 'Recoveries': 0, 'RecoverySeconds': 0.0},
+    ]
+
+    plots = summarize_uptime(rows, 'plot')
+
+    assert [plot['PlotID'] for plot in plots] == ['P1', None]
+    assert plots[0]['Devices'] == 2
+    assert plots[0]['UptimePercent'] == 87.5
+    assert plots[0]['MTTRSeconds'] == 25.0
+    assert plots[1]['UptimePercent'] is None and plots[1]['MTTRSeconds'] is None
+
+    devices = summarize_uptime(rows)
+    assert [device['IoTSerialNumber'] for device in devices] == ['SN-1', 'SN-2', 'SN-3']
+    assert 'Devices' not in devices[0]
@@ -0,0 +1,32 @@
+import numpy as np
+from chalicelib.downsample import lttb_indices, bucket_aggregate
+
+
+def test_lttb_keeps_endpoints_and_spikes():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.sin(x / 50)
+    y[500] = 10
+
+    indices = lttb_indices(x, y, 50)
+
+    assert len(indices) == 50
+    assert indices[0] == 0 and indices[-1] == 999
+    assert 500 in indices
+    assert np.all(np.diff(indices) > 0)
+
+
+def test_lttb_returns_everything_when_series_is_short():
+    x = np.arange(10, dtype=np.float64)
+
+    assert lttb_indices(x, x, 20).tolist() == list(range(10))
+
+
+def test_bucket_aggregate_skips_empty_buckets():
+    x = np.array([0, 1, 2, 10], dtype=np.float64)
+    starts, aggregates = bucket_aggregate(x, {'temperature': np.array([1, 2, 3, 4], dtype=np.float64)}, 5)
+
+    means, mins, maxes = aggregates['temperature']
+    assert starts.tolist() == [0, 2, 8]
+    assert means.tolist() == [1.5, 3, 4]
+    assert mins.tolist() == [1, 3, 4]
+    assert maxes.tolist() == [2, 3, 4]
@@ -0,0 +1,101 @@
+import os
+import re
+from datetime import datetime, timedelta
+import pymysql
+import pytest
+from chalicelib import weatherRoutes, weatherRollup, notificationService
+
+# Runs against a local MySQL, e.g. MIDORI_TEST_PRIMARY_HOST=127.0.0.1:3306 MIDORI_TEST_DB_USER=root
+pytestmark = pytest.mark.skipif(not os.environ.get('MIDORI_TEST_PRIMARY_HOST'), reason="needs a local MySQL")
+
+SCHEMA = 'midori_explain_test'
+NOW = datetime(2024, 6, 1, 12, 0)
+
+# The WeatherData queries as they were before the Singapore day boundaries moved into Python
+BEFORE_QUERIES = {
+    'current_day': """
+    SELECT CONVERT_TZ(timestamp, '+00:00', '+08:00') AS timestamp, AVG(temperature) AS temperature
+    FROM WeatherData
+    WHERE DATE(CONVERT_TZ(timestamp, '+00:00', '+08:00')) = DATE(CONVERT_TZ(%s, '+00:00', '+08:00'))
+    GROUP BY DATE(CONVERT_TZ(timestamp, '+00:00', '+08:00'))
+    """,
+    'closest': """
+    SELECT timestamp, temperature FROM WeatherData
+    WHERE timestamp BETWEEN DATE_SUB(%s, INTERVAL 1 DAY) AND %s
+    ORDER BY ABS(TIMESTAMPDIFF(SECOND, timestamp, %s)) ASC
+    LIMIT 1
+    """
+}
+
+
+@pytest.fixture(scope='module')
+def cursor():
+    host, _, port = os.environ['MIDORI_TEST_PRIMARY_HOST'].partition(':')
+    connection = pymysql.connect(host=host, port=int(port or 3306), user=os.environ.get('MIDORI_TEST_DB_USER', 'root'),
+                                 password=os.environ.get('MIDORI_TEST_DB_PASSWORD', ''), autocommit=True,
+                                 cursorclass=pymysql.cursors.DictCursor)
+
+    with open(os.path.join(os.path.dirname(__file__), '..', 'deployer.sql')) as f:
+        statements = [s for s in f.read().split(';')
+                      if re.search(r'\b(WeatherData|RollupWatermarks|WeatherDailyRollup|IoTDevicesTest|SpoiltDeviceAlerts)\b', s)
+                      and re.search(r'create (table|index)', s)]
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP DATABASE IF EXISTS {SCHEMA}")
+        cursor.execute(f"CREATE DATABASE {SCHEMA}")
+        cursor.execute(f"USE {SCHEMA}")
+        for statement in statements:
+            cursor.execute(statement)
+
+        # A year of 30-minute readings
+        start = NOW - timedelta(days=365)
+        cursor.executemany(
+            "INSERT INTO WeatherData (Timestamp, Windspeed, Temperature, Precipitation, Humidity) VALUES (%s, 3, 28, 0, 80)",
+            [(start + timedelta(minutes=30 * i),) for i in range(365 * 48)]
+        )
+        cursor.executemany(
+            "INSERT INTO IoTDevicesTest (IoTType, IoTStatus, IoTSerialNumber, PlotID, LastDowntime) VALUES ('Sensor', %s, %s, %s, %s)",
+            [(i % 20 != 0, 'SN-%05d' % i, 'P%d' % (i % 7), NOW - timedelta(hours=i % 100)) for i in range(5000)]
+        )
+        cursor.execute("ANALYZE TABLE WeatherData, IoTDevicesTest")
+        yield cursor
+        cursor.execute(f"DROP DATABASE {SCHEMA}")
+
+    connection.close()
+
+
+def access_types(cursor, query, args):
+    cursor.execute("EXPLAIN " + query, args)
+    return {row['type'] for row in cursor.fetchall() if row['table'] == 'WeatherData'}
+
+
+def test_before_queries_scan_the_whole_table(cursor):
+    assert 'ALL' in access_types(cursor, BEFORE_QUERIES['current_day'], (NOW,)) | \
+        access_types(cursor, BEFORE_QUERIES['closest'], (NOW, NOW, NOW))
+
+
+@pytest.mark.parametrize('query, args', [
+    (weatherRoutes.WEATHER_DATA_QUERY, (NOW - timedelta(days=7), NOW, 1000)),
+    (weatherRoutes.CLOSEST_READING_QUERY, (NOW - timedelta(days=1), NOW, NOW, NOW + timedelta(days=1))),
+    (weatherRoutes.CURRENT_HOURS_QUERY, (NOW - timedelta(hours=2), NOW)),
+    (weatherRollup.TAIL_QUERY, (365 * 48 - 48,) + weatherRollup.sgt_day_range(NOW.date(), NOW.date())),
+])
+def test_weather_queries_use_range_scans(cursor, query, args):
+    assert access_types(cursor, query, args) == {'range'}
+
+
+def test_spoilt_device_count_is_an_index_only_range_scan(cursor):
+    query = notificationService.SPOILT_DEVICES_QUERY.format(due=notificationService.spoilt_due_condition())
+    cursor.execute("EXPLAIN " + query)
+    plan = next(row for row in cursor.fetchall() if row['table'] == 'd')
+    assert plan['type'] == 'range'
+    assert plan['key'] == 'idx_iotdevicestest_status_downtime'
+    assert 'Using index' in plan['Extra']
+
+
+def test_filtered_device_count_is_an_index_only_scan(cursor):
+    cursor.execute("EXPLAIN SELECT COUNT(*) AS total FROM IoTDevicesTest WHERE PlotID = %s AND IoTStatus = %s",
+                   ('P3', 1))
+    plan = cursor.fetchone()
+    assert plan['key'] == 'idx_iotdevicestest_plot_status_type'
+    assert 'Using index' in plan['Extra']
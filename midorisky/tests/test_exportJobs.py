@@ -0,0 +1,65 @@
+import csv
+import io
+from chalicelib import exportJobs
+from chalicelib.exportJobs import S3MultipartWriter, write_csv
+
+
+class FakeS3(object):
+    def __init__(self):
+        self.parts = {}
+        self.completed = None
+        self.aborted = False
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        return {'UploadId': 'upload-1'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.parts[PartNumber] = Body
+        return {'ETag': 'etag-%d' % PartNumber}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.completed = MultipartUpload['Parts']
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted = True
+
+
+class FakeRows(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+def test_export_is_uploaded_in_fixed_size_parts(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(exportJobs, 's3', s3)
+    monkeypatch.setattr(exportJobs, 'EXPORT_FETCH_SIZE', 7)
+    rows = [(i, 'SN-%05d' % i, 27.5) for i in range(100)]
+
+    writer = S3MultipartWriter('bucket', 'exports/1/weather.csv', part_size=256)
+    assert write_csv(writer, ['id', 'IoTSerialNumber', 'Temperature'], FakeRows(rows)) == 100
+    writer.close()
+
+    sizes = [len(s3.parts[number]) for number in sorted(s3.parts)]
+    assert all(size == 256 for size in sizes[:-1]) and 0 < sizes[-1] <= 256
+    assert s3.completed == [{'ETag': 'etag-%d' % n, 'PartNumber': n} for n in sorted(s3.parts)]
+
+    uploaded = b''.join(s3.parts[number] for number in sorted(s3.parts)).decode('utf-8')
+    parsed = list(csv.reader(io.StringIO(uploaded)))
+    assert parsed[0] == ['id', 'IoTSerialNumber', 'Temperature']
+    assert parsed[-1] == ['99', 'SN-00099', '27.5']
+    assert len(parsed) == 101
+
+
+def test_empty_export_still_completes(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(exportJobs, 's3', s3)
+
+    writer = S3MultipartWriter('bucket', 'exports/2/weather.csv')
+    write_csv(writer, ['Timestamp'], FakeRows([]))
+    writer.close()
+
+    assert s3.completed == [{'ETag': 'etag-1', 'PartNumber': 1}]
@@ -0,0 +1,56 @@
+import json
+from datetime import datetime
+import pytest
+from chalice import BadRequestError
+from chalicelib.helpers import iter_json_array, cursor_to_columnar, concat_columnar, get_datetime_param
+
+
+def test_iter_json_array_matches_json_dumps():
+    columns = ['timestamp', 'temperature']
+    rows = [(datetime(2024, 1, 1, 8, 0), 27.5), (datetime(2024, 1, 1, 8, 30), 28.0)]
+
+    body = ''.join(iter_json_array(iter(rows), columns))
+
+    assert json.loads(body) == [
+        {'timestamp': '2024-01-01T08:00:00', 'temperature': 27.5},
+        {'timestamp': '2024-01-01T08:30:00', 'temperature': 28.0}
+    ]
+    assert ''.join(iter_json_array(iter([]), columns)) == '[]'
+
+
+def test_cursor_to_columnar_reads_tuple_rows():
+    class Cursor(object):
+        description = [('Date',), ('Temperature',)]
+
+        def __iter__(self):
+            return iter([('2024-01-01', 27.5), ('2024-01-02', 28.0)])
+
+    assert cursor_to_columnar(Cursor()) == {
+        'columns': ['Date', 'Temperature'],
+        'data': {'Date': ['2024-01-01', '2024-01-02'], 'Temperature': [27.5, 28.0]}
+    }
+
+
+def test_concat_columnar_fills_missing_columns():
+    first = {'columns': ['Date', 'Temperature'], 'data': {'Date': ['2024-01-01'], 'Temperature': [27.5]}}
+    second = {'columns': ['Date', 'Type'], 'data': {'Date': ['2024-01-02', '2024-01-03'], 'Type': ['Predicted'] * 2}}
+
+    assert concat_columnar(first, second) == {
+        'columns': ['Date', 'Temperature', 'Type'],
+        'data': {
+            'Date': ['2024-01-01', '2024-01-02', '2024-01-03'],
+            'Temperature': [27.5, None, None],
+            'Type': [None, 'Predicted', 'Predicted']
+        }
+    }
+    assert concat_columnar() == {'columns': [], 'data': {}}
+
+
+def test_get_datetime_param_rejects_json_values_that_are_not_strings():
+    body = {'from': '2024-01-01T08:00:00', 'to': 20240102, 'since': [2024, 1, 1]}
+
+    assert get_datetime_param(body, 'from') == datetime(2024, 1, 1, 8, 0)
+    with pytest.raises(BadRequestError, match='Invalid date for parameter to: 20240102'):
+        get_datetime_param(body, 'to')
+    with pytest.raises(BadRequestError):
+        get_datetime_param(body, 'since', required=False)
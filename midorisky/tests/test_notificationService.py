@@ -0,0 +1,72 @@
+import datetime
+import json
+from chalice.test import Client
+from app import app
+from chalicelib import notificationService
+
+ALERTED_AT = datetime.datetime(2024, 6, 1, 12, 0)
+
+
+def run_check(monkeypatch, fake_db, rows, send_error=None):
+    sent = []
+    fake_db.patch(notificationService).on('SELECT d.PlotID', rows).on('SELECT NOW()', [{'now': ALERTED_AT}])
+    fake_db.on('FOR UPDATE', [{'id': 7}, {'id': 9}] if any(row['due'] for row in rows) else [])
+
+    class FakeSQS(object):
+        def send_message(self, QueueUrl, MessageBody):
+            # The alerts are already committed when the message goes out
+            assert fake_db.committed
+            if send_error:
+                raise send_error
+            sent.append(json.loads(MessageBody))
+
+    monkeypatch.setattr(notificationService, 'sqs', FakeSQS())
+
+    with Client(app) as client:
+        event = client.events.generate_cw_event(source='aws.events', detail_type='Scheduled Event', detail={},
+                                                resources=[])
+        client.lambda_.invoke('check_spoilt_devices', event)
+
+    return sent, fake_db.queries(), fake_db
+
+
+def test_spoilt_devices_alert_has_a_per_plot_breakdown(monkeypatch, fake_db):
+    sent, queries, connection = run_check(monkeypatch, fake_db, [
+        {'PlotID': 'P1', 'count': 3, 'due': 1},
+        {'PlotID': None, 'count': 1, 'due': 0},
+    ])
+
+    assert sent == [{'type': 'device', 'count': 4, 'new': 1, 'plots': {'P1': 3, 'Unassigned': 1}}]
+    assert 'LastDowntime <= NOW() - INTERVAL 2 HOUR' in queries[1]
+    assert queries[3].endswith('FOR UPDATE')
+    assert queries[4].startswith('INSERT INTO SpoiltDeviceAlerts')
+    assert 'WHERE id IN (%s, %s)' in queries[4]
+    assert 'ON DUPLICATE KEY UPDATE LastDowntime = new.LastDowntime, AlertedAt = new.AlertedAt' in queries[4]
+    assert 'VALUES(' not in queries[4]
+    assert connection.statements[4][2] == [ALERTED_AT, 7, 9]
+    assert connection.committed
+
+
+def test_unsent_alerts_are_taken_back(monkeypatch, fake_db):
+    sent, queries, connection = run_check(monkeypatch, fake_db, [{'PlotID': 'P1', 'count': 3, 'due': 1}],
+                                          send_error=RuntimeError("SQS unavailable"))
+
+    assert sent == []
+    # Only the devices this run recorded are taken back, not other alerts of the same second
+    assert connection.statements[-1][1:] == (
+        "DELETE FROM SpoiltDeviceAlerts WHERE DeviceID IN (%s, %s) AND AlertedAt = %s", [7, 9, ALERTED_AT])
+
+
+def test_already_alerted_devices_are_not_sent_again(monkeypatch, fake_db):
+    sent, queries, connection = run_check(monkeypatch, fake_db, [{'PlotID': 'P1', 'count': 3, 'due': 0}])
+
+    assert sent == []
+    assert not any(query.startswith('INSERT') for query in queries)
+
+
+def test_renotify_interval_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(notificationService, 'SPOILT_RENOTIFY_HOURS', 0)
+    assert 'AlertedAt' not in notificationService.spoilt_due_condition()
+
+    monkeypatch.setattr(notificationService, 'SPOILT_RENOTIFY_HOURS', 6)
+    assert 'a.AlertedAt <= NOW() - INTERVAL 360 MINUTE' in notificationService.spoilt_due_condition()
@@ -0,0 +1,26 @@
+from chalicelib import queryMetrics
+from chalicelib.queryMetrics import normalize_sql
+
+
+def test_normalize_sql_strips_literals_and_comments():
+    sql = """
+    SELECT id FROM IoTDevicesTest  -- spoilt devices
+    WHERE IoTStatus = 0 AND PlotID = 'A1' AND id = %s
+    """
+
+    assert normalize_sql(sql) == "SELECT id FROM IoTDevicesTest WHERE IoTStatus = ? AND PlotID = ? AND id = %s"
+
+
+def test_request_summary_and_slow_query_log(monkeypatch, capsys):
+    monkeypatch.setattr(queryMetrics, 'SLOW_QUERY_MS', 100)
+
+    queryMetrics.start_request()
+    queryMetrics.record_query("SELECT 1", 5, 1)
+    queryMetrics.record_query("SELECT * FROM WeatherData", 250, 10)
+    summary = queryMetrics.end_request('GET /staff/weather/fetch-weather-data')
+
+    assert summary == {'queries': 2, 'db_ms': 255, 'rows': 11}
+    output = capsys.readouterr().out
+    assert '"type": "slow_query"' in output
+    assert '"sql": "SELECT * FROM WeatherData"' in output
+    assert '"route": "GET /staff/weather/fetch-weather-data"' in output
@@ -0,0 +1,101 @@
+import json
+import pytest
+from chalice.test import Client
+from app import app
+from chalicelib import telemetryHelper
+from chalicelib.telemetryHelper import TelemetryBatchError
+
+
+class LocalQueue(object):
+    """
+    Stand-in for the telemetry queue, builds the events Lambda would receive from SQS and takes the consumer's
+    deletes. The event source mapping is left as Chalice creates it, without ReportBatchItemFailures.
+    """
+
+    def __init__(self, client, monkeypatch):
+        self.client = client
+        self.messages = []
+        self.deleted = []
+        monkeypatch.setattr(telemetryHelper, 'sqs', self)
+
+    def send(self, body):
+        self.messages.append(body if isinstance(body, str) else json.dumps(body))
+        return str(len(self.messages))
+
+    def receive(self):
+        event = self.client.events.generate_sqs_event(message_bodies=self.messages, queue_name='midori-telemetry')
+        for message_id, record in enumerate(event['Records'], start=1):
+            record['messageId'] = str(message_id)
+            record['receiptHandle'] = 'handle-' + str(message_id)
+        return event
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        assert QueueUrl.endswith('/midori-telemetry') and len(Entries) <= 10
+        self.deleted.extend(entry['ReceiptHandle'][len('handle-'):] for entry in Entries)
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries]}
+
+    def redelivered(self):
+        """Ids of the messages a failed invocation leaves on the queue."""
+        return [str(i) for i in range(1, len(self.messages) + 1) if str(i) not in self.deleted]
+
+
+def soil(serial, moisture):
+    return {'Timestamp': '2024-01-01T08:00:00', 'PlotID': 'P1', 'IoTSerialNumber': serial, 'SoilMoisture': moisture}
+
+
+def weather(temperature):
+    return {'Timestamp': '2024-01-01T08:00:00', 'Windspeed': 3, 'Temperature': temperature,
+            'Precipitation': 0, 'Humidity': 80}
+
+
+def inserted_tables(fake_db):
+    return [(query.split()[2], rows) for kind, query, rows in fake_db.statements if kind == 'executemany']
+
+
+def test_batch_is_grouped_by_table_and_only_bad_messages_are_redelivered(monkeypatch, fake_db):
+    fake_db.patch(telemetryHelper)
+
+    with Client(app) as client:
+        queue = LocalQueue(client, monkeypatch)
+        queue.send({'table': 'SoilMoistureIoT', 'readings': [soil('SN-1', 40), soil('SN-2', 41)]})
+        queue.send(dict(soil('SN-3', 42), table='SoilMoistureIoT'))
+        bad_reading = queue.send({'table': 'SoilMoistureIoT', 'readings': [soil('SN-4', 43), soil('SN-5', 500)]})
+        queue.send({'table': 'WeatherData', 'readings': [weather(28)]})
+        bad_json = queue.send('{"table": ')
+
+        with pytest.raises(TelemetryBatchError):
+            client.lambda_.invoke('handle_telemetry_messages', queue.receive())
+
+    assert queue.redelivered() == [bad_reading, bad_json]
+    # One executemany per table, the valid reading of the rejected message is not written either
+    assert [(table, len(rows)) for table, rows in inserted_tables(fake_db)] == [('SoilMoistureIoT', 3), ('WeatherData', 1)]
+
+
+def test_failed_insert_only_retries_that_table(monkeypatch, fake_db):
+    fake_db.patch(telemetryHelper).on('INSERT INTO WeatherData', RuntimeError("Lost connection"))
+
+    with Client(app) as client:
+        queue = LocalQueue(client, monkeypatch)
+        queue.send({'table': 'SoilMoistureIoT', 'readings': [soil('SN-1', 40)]})
+        weather_message = queue.send({'table': 'WeatherData', 'readings': [weather(28), weather(29)]})
+
+        with pytest.raises(TelemetryBatchError):
+            client.lambda_.invoke('handle_telemetry_messages', queue.receive())
+
+    assert queue.redelivered() == [weather_message]
+    assert [table for table, _ in inserted_tables(fake_db)] == ['SoilMoistureIoT', 'WeatherData']
+    assert fake_db.rollbacks == 1
+
+
+def test_clean_batch_is_left_to_lambda(monkeypatch, fake_db):
+    fake_db.patch(telemetryHelper)
+
+    with Client(app) as client:
+        queue = LocalQueue(client, monkeypatch)
+        for serial in range(12):
+            queue.send(dict(soil('SN-%d' % serial, 40), table='SoilMoistureIoT'))
+
+        client.lambda_.invoke('handle_telemetry_messages', queue.receive())
+
+    # Lambda deletes the whole batch once the invocation succeeds
+    assert queue.deleted == []
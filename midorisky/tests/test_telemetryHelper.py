@@ -0,0 +1,67 @@
+import datetime
+import pytest
+from chalicelib import telemetryHelper
+from chalicelib.telemetryHelper import (TelemetryError, parse_ndjson, parse_json_array, parse_csv, validate,
+                                      insert_rows)
+
+
+def test_validate_ndjson_reports_bad_lines():
+    body = "\n".join([
+        '{"Timestamp": "2024-01-01T08:00:00", "Windspeed": 3, "Temperature": 28.5, "Precipitation": 0, "Humidity": 80}',
+        'not json',
+        '{"Timestamp": "2024-01-01T08:30:00", "Windspeed": 3, "Temperature": 99, "Precipitation": 0, "Humidity": 80}',
+        '{"Timestamp": 1704096000, "Windspeed": 3, "Temperature": 28, "Precipitation": 0, "Humidity": 80}',
+        '{"Timestamp": "2024-01-01T09:30:00", "Windspeed": 3, "Temperature": 28, "Precipitation": 0}',
+    ])
+    columns, errors = parse_ndjson(body, 'WeatherData')
+    rows, invalid = validate('WeatherData', columns)
+
+    assert rows == [(datetime.datetime(2024, 1, 1, 8, 0), 3.0, 28.5, 0.0, 80.0)]
+    assert [error['line'] for error in errors] == [2]
+    assert invalid == [
+        {'line': 3, 'error': 'Temperature out of range [-50, 70]'},
+        {'line': 4, 'error': 'Invalid Timestamp'},
+        {'line': 5, 'error': 'Missing Humidity'},
+    ]
+
+
+def test_json_array_parses_like_ndjson():
+    reading = '{"Timestamp": "2024-01-01T08:00:00", "Windspeed": 3, "Temperature": 28.5, "Precipitation": 0, "Humidity": 80}'
+    columns, errors = parse_json_array('[' + reading + ', 7, ' + reading + ']', 'WeatherData')
+
+    assert (columns, errors) == parse_ndjson(reading + '\n7\n' + reading, 'WeatherData')
+    assert errors == [{'line': 2, 'error': 'Invalid JSON: not an object'}]
+    assert len(validate('WeatherData', columns)[0]) == 2
+
+    with pytest.raises(TelemetryError):
+        parse_json_array(reading, 'WeatherData')
+
+
+def test_validate_csv_checks_string_lengths():
+    body = ("IoTSerialNumber,PlotID,Timestamp,SoilMoisture\n"
+            "SN-1,P1,2024-01-01 08:00:00,42\n"
+            "SN-2,P1,2024-01-01 08:00:00,abc\n"
+            + "SN-3," + "P" * 11 + ",2024-01-01 08:00:00,40\n")
+    columns, errors = parse_csv(body, 'SoilMoistureIoT')
+    rows, invalid = validate('SoilMoistureIoT', columns)
+
+    assert errors == []
+    assert rows == [(datetime.datetime(2024, 1, 1, 8, 0), 'P1', 'SN-1', 42.0)]
+    assert invalid == [
+        {'line': 3, 'error': 'Invalid SoilMoisture'},
+        {'line': 4, 'error': 'PlotID longer than 10'},
+    ]
+
+
+def test_parse_csv_requires_every_column():
+    with pytest.raises(TelemetryError):
+        parse_csv("Timestamp,Windspeed\n2024-01-01 08:00:00,3\n", 'WeatherData')
+
+
+def test_insert_rows_chunks_inside_one_transaction(monkeypatch, fake_db):
+    monkeypatch.setattr(telemetryHelper, 'INSERT_CHUNK_SIZE', 2)
+    rows = [(datetime.datetime(2024, 1, 1), 1.0, 2.0, 3.0, 4.0)] * 5
+
+    assert insert_rows(fake_db, 'WeatherData', rows) == 5
+    assert [len(batch) for kind, _, batch in fake_db.statements if kind == 'executemany'] == [2, 2, 1]
+    assert fake_db.committed and not fake_db.rolled_back
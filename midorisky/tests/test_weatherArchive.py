@@ -0,0 +1,123 @@
+import datetime
+import io
+from chalicelib import weatherArchive
+from chalicelib.weatherArchive import add_months, ensure_partitions, archive_partitions, ArchiveMergedCursor
+
+
+class FakeS3(object):
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def get_paginator(self, operation):
+        self.listings = getattr(self, 'listings', 0) + 1
+        return self
+
+    def paginate(self, Bucket, Prefix):
+        return [{'Contents': [{'Key': key} for key in sorted(self.objects) if key.startswith(Prefix)]}]
+
+
+def test_add_months_wraps_years():
+    assert add_months(datetime.date(2024, 11, 1), 3) == datetime.date(2025, 2, 1)
+    assert add_months(datetime.date(2024, 1, 1), -13) == datetime.date(2022, 12, 1)
+
+
+def partitions(fake_db, names, rows=()):
+    return fake_db.on('information_schema.PARTITIONS', [{'name': name} for name in names]).on('PARTITION (', rows)
+
+
+def test_ensure_partitions_splits_pmax_up_to_three_months_ahead(fake_db):
+    connection = partitions(fake_db, ['p202404', 'p202405', 'pmax'])
+
+    added = ensure_partitions(connection, datetime.date(2024, 6, 15))
+
+    assert added == [datetime.date(2024, month, 1) for month in (6, 7, 8, 9)]
+    assert connection.queries()[-1] == (
+        "ALTER TABLE WeatherData REORGANIZE PARTITION pmax INTO ("
+        "PARTITION p202406 VALUES LESS THAN ('2024-07-01'), PARTITION p202407 VALUES LESS THAN ('2024-08-01'), "
+        "PARTITION p202408 VALUES LESS THAN ('2024-09-01'), PARTITION p202409 VALUES LESS THAN ('2024-10-01'), "
+        "PARTITION pmax VALUES LESS THAN (MAXVALUE))"
+    )
+
+
+def test_archived_partition_reads_back_through_merged_cursor(monkeypatch, fake_db):
+    s3 = FakeS3()
+    monkeypatch.setattr(weatherArchive, 's3', s3)
+    monkeypatch.setattr(weatherArchive, 'RETENTION_MONTHS', 12)
+    weatherArchive.load_archive.cache_clear()
+
+    january = [(i + 1, datetime.datetime(2023, 1, 1 + i), 3.0, 25.0 + i, 0.0, 80.0) for i in range(3)]
+    connection = partitions(fake_db, ['p202301', 'p202302', 'p202403', 'pmax'], january)
+    connection.rules.insert(0, ('COUNT(*)', [{'count': 3}], None))
+
+    archived = archive_partitions(connection, datetime.date(2024, 3, 10))
+
+    assert archived == [datetime.date(2023, 1, 1), datetime.date(2023, 2, 1)]
+    assert connection.queries()[-1] == "ALTER TABLE WeatherData DROP PARTITION p202302"
+    assert sorted(s3.objects) == ['archive/WeatherData/2023-01.npz', 'archive/WeatherData/2023-02.npz']
+
+    class DatabaseRows(object):
+        description = [('timestamp',), ('temperature',)]
+
+        def __iter__(self):
+            return iter([(datetime.datetime(2023, 1, 2, 12), 99.0), (datetime.datetime(2023, 3, 1), 30.0)])
+
+    rows = weatherArchive.merge_archived_rows(
+        DatabaseRows(), [datetime.date(2023, 1, 1)],
+        datetime.datetime(2023, 1, 2), datetime.datetime(2023, 4, 1), limit=3
+    )
+
+    assert isinstance(rows, ArchiveMergedCursor)
+    assert list(rows) == [
+        (datetime.datetime(2023, 1, 2), 26.0),
+        (datetime.datetime(2023, 1, 2, 12), 99.0),
+        (datetime.datetime(2023, 1, 3), 27.0),
+    ]
+
+
+def test_archived_months_follow_partitions_dropped_elsewhere(monkeypatch, fake_db):
+    s3 = FakeS3()
+    s3.objects = {'archive/WeatherData/2023-01.npz': b'', 'archive/WeatherData/2023-02.npz': b''}
+    monkeypatch.setattr(weatherArchive, 's3', s3)
+    monkeypatch.setattr(weatherArchive, '_archive_state', {'first_partition': None, 'months': [], 'checked_at': 0})
+    names = ['p202302', 'p202303', 'pmax']
+    fake_db.patch(weatherArchive).on('information_schema.PARTITIONS', lambda query, args: [{'name': name}
+                                                                                          for name in names])
+
+    # February is uploaded but its partition is still there, the partitions are read once per PARTITIONS_TTL
+    assert weatherArchive.get_archived_months() == [datetime.date(2023, 1, 1)]
+    assert weatherArchive.get_archived_months() == [datetime.date(2023, 1, 1)]
+    assert s3.listings == 1
+    assert len(fake_db.queries()) == 1
+
+    # Another container drops it, the next read after the TTL switches to S3
+    names.remove('p202302')
+    assert weatherArchive.get_archived_months() == [datetime.date(2023, 1, 1)]
+    weatherArchive._archive_state['checked_at'] -= weatherArchive.PARTITIONS_TTL
+    assert weatherArchive.get_archived_months() == [datetime.date(2023, 1, 1), datetime.date(2023, 2, 1)]
+    assert s3.listings == 2
+
+
+def test_partition_is_exported_again_when_rows_arrive_before_the_drop(monkeypatch, fake_db):
+    monkeypatch.setattr(weatherArchive, 's3', FakeS3())
+    monkeypatch.setattr(weatherArchive, 'RETENTION_MONTHS', 12)
+
+    january = [(i + 1, datetime.datetime(2023, 1, 1 + i), 3.0, 25.0, 0.0, 80.0) for i in range(4)]
+    exports = []
+
+    def partition_rows(query, args):
+        exports.append(query)
+        # The fourth reading lands in January while the first export runs
+        return january[:3] if len(exports) == 1 else january
+
+    fake_db.on('COUNT(*)', [{'count': 4}])
+    partitions(fake_db, ['p202301', 'p202403', 'pmax'], partition_rows)
+
+    assert archive_partitions(fake_db, datetime.date(2024, 3, 10)) == [datetime.date(2023, 1, 1)]
+    assert len(exports) == 2
+    assert fake_db.queries()[-1] == "ALTER TABLE WeatherData DROP PARTITION p202301"
@@ -0,0 +1,71 @@
+from datetime import date, datetime
+from chalicelib.weatherRollup import fetch_daily_weather, refresh_daily_rollup, sgt_day_range, daily_mean
+
+
+def day_row(day, count, value, last_timestamp):
+    row = {'Date': day, 'ReadingCount': count, 'LastTimestamp': last_timestamp}
+    for m in ['Temperature', 'Humidity', 'Precipitation', 'Windspeed']:
+        row.update({m + 'Count': count, m + 'Sum': value * count, m + 'Min': value, m + 'Max': value})
+    return row
+
+
+def test_sgt_day_range_is_utc():
+    assert sgt_day_range(date(2024, 5, 1), date(2024, 5, 1)) == (datetime(2024, 4, 30, 16), datetime(2024, 5, 1, 16))
+
+
+def test_fetch_daily_weather_merges_tail_into_rollup(fake_db):
+    rolled = day_row(date(2024, 5, 1), 2, 30.0, datetime(2024, 5, 1, 1))
+    tail = [
+        day_row(date(2024, 5, 1), 1, 27.0, datetime(2024, 5, 1, 2)),
+        day_row(date(2024, 5, 2), 1, 25.0, datetime(2024, 5, 1, 17))
+    ]
+    fake_db.queue([{'last_id': 10}], [rolled], tail)
+
+    days = fetch_daily_weather(fake_db, date(2024, 5, 1), date(2024, 5, 2))
+
+    assert [day['Date'] for day in days] == [date(2024, 5, 1), date(2024, 5, 2)]
+    assert days[0]['ReadingCount'] == 3
+    assert days[0]['TemperatureSum'] == 87.0
+    assert days[0]['TemperatureMin'] == 27.0
+    assert days[0]['LastTimestamp'] == datetime(2024, 5, 1, 2)
+    assert daily_mean(days[0], 'Temperature') == 29.0
+    # The tail only reads rows after the rollup watermark
+    assert fake_db.statements[2][2][0] == 10
+
+
+def test_days_without_readings_of_a_metric_merge(fake_db):
+    rolled = day_row(date(2024, 5, 1), 2, 30.0, datetime(2024, 5, 1, 1))
+    rolled.update(HumidityCount=0, HumiditySum=None, HumidityMin=None, HumidityMax=None)
+    tail = day_row(date(2024, 5, 1), 1, 27.0, datetime(2024, 5, 1, 2))
+    tail.update(TemperatureCount=0, TemperatureSum=None, TemperatureMin=None, TemperatureMax=None)
+    fake_db.queue([{'last_id': 10}], [rolled], [tail])
+
+    day, = fetch_daily_weather(fake_db, date(2024, 5, 1), date(2024, 5, 1))
+
+    assert (day['TemperatureCount'], day['TemperatureSum'], day['TemperatureMin']) == (2, 60.0, 30.0)
+    assert (day['HumidityCount'], day['HumiditySum'], day['HumidityMax']) == (1, 27.0, 27.0)
+    assert daily_mean(day, 'Humidity') == 27.0
+
+    day['WindspeedCount'] = 0
+    assert daily_mean(day, 'Windspeed') is None
+
+
+def test_rollup_waits_a_run_before_counting_new_ids(fake_db):
+    fake_db.on('INSERT INTO RollupWatermarks')
+
+    # First run: nothing rolled up yet, MAX(id) 50 is only remembered
+    fake_db.queue([{'last_id': 10}], [], [{'max_id': 50}])
+    assert refresh_daily_rollup(fake_db) == []
+    assert fake_db.statements[-1][2] == ('WeatherDailyRollupPending', 50)
+
+    # Second run: ids up to 50 have settled, a late reading of an old day only rescans that day
+    fake_db.statements.clear()
+    fake_db.queue([{'last_id': 10}], [{'last_id': 50}], [{'max_id': 80}],
+                  [{'Date': date(2024, 1, 3)}, {'Date': date(2024, 5, 1)}, {'Date': date(2024, 5, 2)}])
+    assert refresh_daily_rollup(fake_db) == [date(2024, 1, 3), date(2024, 5, 1), date(2024, 5, 2)]
+
+    _, query, args = next(statement for statement in fake_db.statements if statement[1].startswith('REPLACE'))
+    assert query.count('Timestamp >= %s AND Timestamp < %s') == 2
+    assert args == [*sgt_day_range(date(2024, 1, 3), date(2024, 1, 3)),
+                    *sgt_day_range(date(2024, 5, 1), date(2024, 5, 2)), 50]
+    assert fake_db.statements[-1][2] == ('WeatherDailyRollup', 50)
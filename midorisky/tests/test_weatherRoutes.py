@@ -0,0 +1,125 @@
+from chalice.test import Client
+from app import app
+
+
+def test_fetch_weather_data_requires_range_and_limit():
+    with Client(app) as client:
+        response = client.http.get('/staff/weather/fetch-weather-data?from=2024-01-01')
+        assert response.status_code == 400
+        assert response.json_body == {'error': 'Missing required parameter: to'}
+
+        response = client.http.get('/staff/weather/fetch-weather-data?from=2024-01-01&to=2024-02-01&limit=0')
+        assert response.status_code == 400
+
+
+def test_fetch_closest_weather_data_is_cached_per_bucket(monkeypatch):
+    from chalicelib import weatherRoutes
+
+    calls = []
+
+    def fetch_closest_reading(now):
+        calls.append(now)
+        return {'timestamp': '2024-01-01T08:00:00', 'temperature': 27.5}
+
+    monkeypatch.setattr(weatherRoutes, 'fetch_closest_reading', fetch_closest_reading)
+    monkeypatch.setattr(weatherRoutes, '_closest_cache', {})
+
+    with Client(app) as client:
+        first = client.http.get('/staff/weather/fetch-closest-weather-data')
+        second = client.http.get('/staff/weather/fetch-closest-weather-data')
+
+    assert first.json_body == second.json_body == [{'timestamp': '2024-01-01T08:00:00', 'temperature': 27.5}]
+    assert len(calls) == 1
+
+    # A reading that arrives later in the bucket is picked up once the entry expires
+    monkeypatch.setattr(weatherRoutes, 'CLOSEST_CACHE_TTL', 0)
+    monkeypatch.setattr(weatherRoutes, '_closest_cache', {})
+    with Client(app) as client:
+        client.http.get('/staff/weather/fetch-closest-weather-data')
+        client.http.get('/staff/weather/fetch-closest-weather-data')
+    assert len(calls) == 3
+
+
+def test_fetch_closest_weather_data_columnar(monkeypatch):
+    from chalicelib import weatherRoutes
+
+    monkeypatch.setattr(weatherRoutes, 'fetch_closest_reading', lambda now: {'timestamp': '2024-01-01T08:00:00', 'temperature': 27.5})
+    monkeypatch.setattr(weatherRoutes, '_closest_cache', {})
+
+    with Client(app) as client:
+        response = client.http.get('/staff/weather/fetch-closest-weather-data?format=columnar')
+        assert response.json_body == {
+            'columns': ['timestamp', 'temperature'],
+            'data': {'timestamp': ['2024-01-01T08:00:00'], 'temperature': [27.5]}
+        }
+
+        response = client.http.get('/staff/weather/fetch-closest-weather-data?format=csv')
+        assert response.status_code == 400
+
+
+def test_fetch_combined_weather_data_columnar_reads_predictions_as_columns(monkeypatch):
+    from datetime import date
+    from chalicelib import weatherRoutes
+    from chalicelib.queryMetrics import InstrumentedSSCursor
+
+    day = {'Date': date(2024, 5, 1)}
+    for metric in ['Temperature', 'Humidity', 'Precipitation', 'Windspeed']:
+        day.update({metric + 'Count': 2, metric + 'Sum': 60.0})
+
+    class Cursor(object):
+        description = [('Date',), ('Temperature',), ('Humidity',), ('Precipitation',), ('Windspeed',)]
+
+        def __init__(self, connection, cursor_class):
+            connection.cursor_classes.append(cursor_class)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def execute(self, query, args):
+            pass
+
+        def __iter__(self):
+            return iter([(date(2024, 5, 2), 31.0, 70.0, 0.0, 2.0)])
+
+    class Connection(object):
+        cursor_classes = []
+
+        def cursor(self, cursor_class=None):
+            return Cursor(self, cursor_class)
+
+    connection = Connection()
+    monkeypatch.setattr(weatherRoutes, 'fetch_daily_weather', lambda connection, start, end: [day])
+    monkeypatch.setattr(weatherRoutes, 'run_parallel', lambda *tasks: [task(connection) for task in tasks])
+
+    with Client(app) as client:
+        response = client.http.get('/staff/weather/fetch-combined-weather-data?format=columnar')
+
+    # The predictions come from a tuple cursor, not a dict cursor
+    assert connection.cursor_classes == [InstrumentedSSCursor]
+    assert response.json_body == {
+        'columns': ['Date', 'Temperature', 'Humidity', 'Precipitation', 'Windspeed', 'Type'],
+        'data': {
+            'Date': ['2024-05-01', '2024-05-02'],
+            'Temperature': [30.0, 31.0],
+            'Humidity': [30.0, 70.0],
+            'Precipitation': [30.0, 0.0],
+            'Windspeed': [30.0, 2.0],
+            'Type': ['Actual', 'Predicted']
+        }
+    }
+
+
+def test_fetch_closest_weather_data_buckets_by_epoch_time(monkeypatch):
+    from chalicelib import weatherRoutes
+
+    monkeypatch.setattr(weatherRoutes, 'fetch_closest_reading', lambda now: {'temperature': 27.5})
+    monkeypatch.setattr(weatherRoutes, '_closest_cache', {})
+    monkeypatch.setattr(weatherRoutes.time, 'time', lambda: 1717243200.0)
+
+    with Client(app) as client:
+        client.http.get('/staff/weather/fetch-closest-weather-data')
+
+    assert list(weatherRoutes._closest_cache) == [1717243200 // weatherRoutes.CLOSEST_CACHE_SECONDS]